@@ -1,12 +1,36 @@
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionClosedError, ConnectTimeoutError, EndpointConnectionError, ReadTimeoutError
+
+import cloud_utils
 
 rekognition_client = None
 
+# Limits the calls in flight, and retries failed calls within a deadline and retry budget
+cloud_client = cloud_utils.CloudClient()
+
+# Error codes of Rekognition that are worth retrying, other errors are caused by the request itself
+RETRYABLE_ERROR_CODES = (
+    'ThrottlingException',
+    'ProvisionedThroughputExceededException',
+    'LimitExceededException',
+    'InternalServerError',
+    'ServiceUnavailableException',
+)
+
+
+def is_retryable(error):
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code') in RETRYABLE_ERROR_CODES
+    return isinstance(error, (ConnectionClosedError, ConnectTimeoutError, EndpointConnectionError, ReadTimeoutError))
+
 
-def create_session(logger, rekognition_client = None):
+def create_session(logger, endpoint_url=None, max_connections=10, timeout_seconds=5.0):
 
     logger.info("Creating session to AWS")
 
+    new_rekognition_client = None
+
     try:
         # create configuration in ~/.aws/credentials
         #
@@ -21,7 +45,16 @@ def create_session(logger, rekognition_client = None):
 
         session = boto3.Session()
 
-        new_rekognition_client = session.client('rekognition')
+        # The retries are done by the cloud client, so botocore only makes a single attempt per call
+        client_config = Config(
+            max_pool_connections=max_connections,
+            connect_timeout=timeout_seconds,
+            read_timeout=timeout_seconds,
+            retries={'total_max_attempts': 1},
+        )
+
+        # The endpoint URL can point to a local stand-in service, see rekognition_standin.py
+        new_rekognition_client = session.client('rekognition', endpoint_url=endpoint_url or None, config=client_config)
 
         logger.info("Created session rekognition to AWS")
 
@@ -31,7 +64,7 @@ def create_session(logger, rekognition_client = None):
     return new_rekognition_client
 
 
-def classify_faces(image_path, logger):
+def classify_faces(image_bytes, logger):
 
     global rekognition_client
 
@@ -39,18 +72,28 @@ def classify_faces(image_path, logger):
         rekognition_client = create_session(logger)
 
     try:
-        with open(image_path, 'rb') as image:
-            response = rekognition_client.detect_faces(
-                Image={
-                    'Bytes': image.read()
-                },
-                Attributes=['GENDER', 'EMOTIONS', 'AGE_RANGE', 'SUNGLASSES', 'SMILE']
-            )
+        # The image is an encoded PNG or JPEG image held in memory
+        response = cloud_client.call(
+            rekognition_client.detect_faces,
+            Image={
+                'Bytes': image_bytes
+            },
+            Attributes=['GENDER', 'EMOTIONS', 'AGE_RANGE', 'SUNGLASSES', 'SMILE']
+        )
+    except ClientError as e:
+        if is_retryable(e):
+            raise
+        # Rekognition rejected the image, classifying it again will not help
+        logger.error(f"Error: {e}")
+        return None
 
+    # Failures of the service itself are raised, so the face can be classified again later
+    try:
         faces = response['FaceDetails']
 
-        facedescription = f', '.join(f"{k}:{v}" for k, v in faces.items())
-        logger.info(f"Description joined: {facedescription}")
+        logger.debug("Found %d face(s)", len(faces))
+        if len(faces) == 0:
+            return None
 
         for face in faces:
             age_range = face['AgeRange']
@@ -64,7 +107,7 @@ def classify_faces(image_path, logger):
         his_her = 'his' if gender['Value'].lower() == 'male' else 'her'
         description = f"A {gender['Value'].lower()} in {his_her} {age} feeling {emotions[0]['Type'].lower()}."
 
-        logger.info(f"Description: {description}")
+        logger.debug("Description: %s", description)
 
         return description
 
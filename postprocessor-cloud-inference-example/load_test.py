@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# Load test of the cloud client against the local Rekognition stand-in.
+#
+# Usage: python3 load_test.py [--requests 200] [--concurrency 16] [--max-in-flight 4] [--latency-ms 150] [--error-rate 0.1] [--throttle-rate 0.05]
+#
+# Starts the stand-in in the same process, unless --url points to a running one, and sends
+# DetectFaces requests from `concurrency` threads through a CloudClient. Reports the throughput,
+# the latency percentiles and how the requests ended. The requests are sent over plain HTTP, so
+# boto3 is not needed.
+
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+script_location = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_location, "../python-utilities"))
+import cloud_utils
+import rekognition_standin
+
+
+def is_retryable(error):
+    # Rekognition reports throttling with a 400 status and the error type in the body
+    if isinstance(error, cloud_utils.HTTPStatusError) and b"ThrottlingException" in error.body:
+        return True
+    return cloud_utils.is_retryable(error)
+
+
+def detect_faces(pool, image_bytes):
+    body = json.dumps({"Image": {"Bytes": base64.b64encode(image_bytes).decode()}, "Attributes": ["ALL"]})
+    headers = {"Content-Type": "application/x-amz-json-1.1", "X-Amz-Target": "RekognitionService.DetectFaces"}
+    _, _, data = pool.request("POST", "/", body.encode(), headers)
+    return json.loads(data)["FaceDetails"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the cloud client against the Rekognition stand-in")
+    parser.add_argument("--url", default="", help="URL of a running stand-in, by default one is started")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16, help="Number of threads sending requests")
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--deadline-seconds", type=float, default=5.0)
+    parser.add_argument("--latency-ms", type=float, default=150.0)
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    arguments = parser.parse_args()
+
+    server = None
+    url = arguments.url
+    if not url:
+        settings = rekognition_standin.parse_arguments(
+            [
+                "--port", "0",
+                "--latency-ms", str(arguments.latency_ms),
+                "--jitter-ms", str(arguments.jitter_ms),
+                "--error-rate", str(arguments.error_rate),
+                "--throttle-rate", str(arguments.throttle_rate),
+            ]
+        )
+        server = rekognition_standin.StandinServer(settings)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:" + str(server.server_address[1])
+
+    pool = cloud_utils.HTTPConnectionPool(url, max_connections=arguments.max_in_flight)
+    client = cloud_utils.CloudClient(
+        max_in_flight=arguments.max_in_flight,
+        deadline_seconds=arguments.deadline_seconds,
+        max_attempts=arguments.max_attempts,
+        retryable=is_retryable,
+    )
+    images = [b"\x89PNG" + os.urandom(1024) for _ in range(16)]
+    outcomes = {}
+    latencies = []
+    lock = threading.Lock()
+
+    def send(index):
+        start = time.perf_counter()
+        try:
+            client.call(detect_faces, pool, images[index % len(images)])
+            outcome = "succeeded"
+        except Exception as e:
+            outcome = type(e).__name__
+        with lock:
+            latencies.append(time.perf_counter() - start)
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    print("Sending " + str(arguments.requests) + " requests to " + url + " from " + str(arguments.concurrency) + " threads")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=arguments.concurrency) as executor:
+        list(executor.map(send, range(arguments.requests)))
+    elapsed = time.perf_counter() - start
+    pool.close()
+    if server is not None:
+        server.shutdown()
+
+    milliseconds = np.array(latencies) * 1000
+    print("Throughput: {:.1f} requests/s".format(arguments.requests / elapsed))
+    print(
+        "Latency: p50 {:.0f} ms, p95 {:.0f} ms, p99 {:.0f} ms, max {:.0f} ms".format(
+            *np.percentile(milliseconds, [50, 95, 99]), milliseconds.max()
+        )
+    )
+    print("Outcomes: " + str(outcomes))
+    print("Client: " + str(client.metrics()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,25 @@
 import os
 import sys
-import socket
-import signal
 import logging
 import logging.handlers
-import configparser
-from pprint import pformat
-from PIL import Image
-import msgpack
-import struct
 import numpy as np
-from aws_utils import classify_faces, create_session
 
 # Add the nxai-utilities python utilities
 script_location = os.path.dirname(sys.argv[0])
 sys.path.append(os.path.join(script_location, "../nxai-utilities/python-utilities"))
-import communication_utils
+sys.path.append(os.path.join(script_location, "../python-utilities"))
+import cache_utils
+import classification_utils
+import cloud_utils
+import config_utils
+import image_utils
+import log_utils
+import motion_utils
+import processor_utils
+import roi_utils
+import shm_utils
+import aws_utils
+from aws_utils import classify_faces, create_session
 
 CONFIG_FILE = os.path.join(script_location, "..", "etc", "plugin.cloud-inference.ini")
 
@@ -42,192 +46,256 @@ Postprocessor_Name = "Cloud-Inference-Postprocessor"
 # But it can be manually defined as well, as long as it is the same as the socket path in the runtime settings
 Postprocessor_Socket_Path = "/tmp/python-cloud-inference-postprocessor.sock"
 
+# Skips the classification of frames that show the same scene as the last classified frame of the device.
+scene_gate = None
 
-def parse_image_from_shm(shm_key: int, width: int, height: int, channels: int):
-    try:
-        image_data = communication_utils.read_shm(shm_key)
-        image_size = width * height * channels
-        image_array = list(struct.unpack("B" * image_size, image_data))
-        image_array = np.array(image_array).reshape((height, width, channels)).astype("uint8")
-    except Exception as e:
-        logger.debug("Failed to parse image from shared memory: ", e)
-        return None
+# Classifies the faces in the background, so the frame loop does not wait for the cloud.
+classification_queue = None
 
-    return image_array
+# Descriptions of the faces that have been classified, per camera.
+result_cache = None
 
+# Marks faces that are not in the result cache, a cached description can be None.
+NOT_CLASSIFIED = object()
 
-def config():
+# Assigns IDs to the faces when the model output has no object IDs.
+box_tracker = classification_utils.BoxTracker()
 
-    global aws_access_key_id
-    global aws_secret_access_key
-    global region_name
-    global image_path
+# Image format the faces are encoded in before they are sent for classification.
+image_format = "PNG"
 
-    logger.info("Reading configuration from:" + CONFIG_FILE)
+# The settings the cloud client, classification queue and scene gate were created with.
+cloud_settings = None
+queue_settings = None
+scene_settings = None
 
-    try:
-        configuration = configparser.ConfigParser()
-        configuration.read(CONFIG_FILE)
-
-        configured_log_level = configuration.get("common", "debug_level", fallback="INFO")
-        set_log_level(configured_log_level)
-
-        for section in configuration.sections():
-            logger.info("config section: " + section)
-            for key in configuration[section]:
-                logger.info("config key: " + key + " = " + configuration[section][key])
-
-        aws_access_key_id = configuration.get("cloud", "aws_access_key_id", fallback=False)
-        aws_secret_access_key = configuration.get("cloud", "aws_secret_access_key", fallback=False)
-        region_name = configuration.get("cloud", "region_name", fallback=False)
-        image_path = configuration.get(
-            "inference",
-            "image_path",
-            fallback="/opt/networkoptix-metavms/mediaserver/bin/plugins/nxai_plugin/nxai_manager/postprocessors/face.png",
-        )
 
+def crop_faces(image_header, faces):
+    # Copy the faces out of shared memory, the copies are classified after the segment is detached
+    try:
+        with shm_utils.attach(image_header["SHMKey"]) as image_data:
+            crops = [
+                crop.copy()
+                for crop in roi_utils.crop_views(
+                    image_utils.image_view(image_data, image_header["Width"], image_header["Height"], image_header["Channels"]),
+                    faces,
+                )
+            ]
     except Exception as e:
-        logger.error(e, exc_info=True)
+        logger.debug("Failed to read image from shared memory: %s", e)
+        return None
 
-    logger.debug("Read configuration done")
+    return crops
 
 
-def set_log_level(level):
-    try:
-        logger.setLevel(level)
-    except Exception as e:
-        logger.error(e, exc_info=True)
+def scene_changed(image_header, device_id):
+    # Compare a thumbnail of the image with the last classified frame of the device
+    with shm_utils.attach(image_header["SHMKey"]) as image_data:
+        scene_change = scene_gate.check(
+            device_id,
+            image_utils.image_view(image_data, image_header["Width"], image_header["Height"], image_header["Channels"]),
+        )
+    logger.debug("Scene change: %s", scene_change)
+    return scene_change.changed
+
+
+def face_keys(input_object, faces):
+    # Keys identifying the faces across frames, the object IDs of the AI Manager when available
+    device_id = input_object.get("DeviceID")
+    object_ids = input_object.get("ObjectsMetaData", {}).get("face", {}).get("ObjectIDs", [])
+    if len(object_ids) == len(faces):
+        return [(device_id, bytes(object_id)) for object_id in object_ids]
+    return [(device_id, track_id) for track_id in box_tracker.update(device_id, faces)]
 
 
-def signal_handler(sig, _):
-    logging.info("Received interrupt signal: " + str(sig))
-    sys.exit(0)
+def classify_face(crop):
+    # Runs on the worker threads of the classification queue
+    logger.debug("Classifying face of %dx%d pixels", crop.shape[1], crop.shape[0])
+    return classify_faces(roi_utils.encode_image(crop, image_format), logger)
 
 
-def main():
+def config(configuration):
+    # Called with the configuration at startup and again whenever the configuration file changes.
+    # The AWS session is only created at startup, the other objects are created again when their
+    # settings change, which drops their state: breaker and budget, cached results, scene thumbnails.
+    # All settings are read and the new objects created before any of them is applied, so a
+    # configuration with an error leaves the previous configuration in place.
 
     global aws_access_key_id
     global aws_secret_access_key
     global region_name
-    global image_path
-
-    # Start socket listener to receive messages from NXAI runtime
-    server = communication_utils.startUnixSocketServer(Postprocessor_Socket_Path)
-    # Wait for messages in a loop
-    while True:
-        # Wait for input message from runtime
-        logger.debug("Waiting for input message")
-
-        try:
-            input_message, connection = communication_utils.waitForSocketMessage(server)
-        except socket.timeout:
-            # Request timed out. Continue waiting
-            continue
+    global image_format
+    global scene_gate
+    global endpoint_url
+    global max_connections
+    global timeout_seconds
+    global classification_queue
+    global result_cache
+    global cloud_settings
+    global queue_settings
+    global scene_settings
 
-        # Since we're also expecting an image, receive the image header
-        try:
-            image_header = communication_utils.receiveMessageOverConnection(connection)
-        except socket.timeout:
-            # Did not receive image header
-            logger.debug("Did not receive image header. Are the settings correct?")
-            continue
-
-        # Parse input message
-        input_object = communication_utils.parseInferenceResults(input_message)
-
-        image_header = msgpack.unpackb(image_header)
-        image_array = parse_image_from_shm(
-            image_header["SHMKey"],
-            image_header["Width"],
-            image_header["Height"],
-            image_header["Channels"],
+    try:
+        new_aws_access_key_id = configuration.get("cloud", "aws_access_key_id", fallback=False)
+        new_aws_secret_access_key = configuration.get("cloud", "aws_secret_access_key", fallback=False)
+        new_region_name = configuration.get("cloud", "region_name", fallback=False)
+        new_endpoint_url = configuration.get("cloud", "endpoint_url", fallback="")
+        new_max_connections = configuration.getint("cloud", "max_connections", fallback=10)
+        new_timeout_seconds = configuration.getfloat("cloud", "timeout_seconds", fallback=5.0)
+        new_image_format = configuration.get("inference", "image_format", fallback="PNG").upper()
+
+        new_cloud_settings = config_utils.section_items(configuration, "cloud")
+        new_cloud_client = aws_utils.cloud_client
+        if new_cloud_settings != cloud_settings:
+            new_cloud_client = cloud_utils.CloudClient(
+                max_in_flight=configuration.getint("cloud", "max_in_flight", fallback=4),
+                deadline_seconds=configuration.getfloat("cloud", "deadline_seconds", fallback=10.0),
+                max_attempts=configuration.getint("cloud", "max_attempts", fallback=3),
+                retry_budget=cloud_utils.RetryBudget(ratio=configuration.getfloat("cloud", "retry_ratio", fallback=0.2)),
+                circuit_breaker=cloud_utils.CircuitBreaker(
+                    failure_threshold=configuration.getint("cloud", "breaker_failures", fallback=5),
+                    reset_seconds=configuration.getfloat("cloud", "breaker_reset_seconds", fallback=30.0),
+                ),
+                retryable=aws_utils.is_retryable,
+            )
+
+        new_scene_settings = config_utils.section_items(configuration, "scene")
+        new_scene_gate = scene_gate
+        if new_scene_settings != scene_settings:
+            new_scene_gate = None
+            if configuration.getboolean("scene", "enabled", fallback=False):
+                new_scene_gate = motion_utils.SceneChangeGate(
+                    threshold=configuration.getfloat("scene", "threshold", fallback=6.0),
+                    max_skip_seconds=configuration.getfloat("scene", "max_skip_seconds", fallback=0.0),
+                )
+
+        # The queue stores its results in the cache, so both are created together. The queue starts
+        # threads, so it is created last, when everything else is valid
+        new_queue_settings = (
+            config_utils.section_items(configuration, "cache"),
+            configuration.getint("inference", "threads", fallback=2),
+            configuration.getint("inference", "max_pending", fallback=16),
         )
-        if image_array is None:
-            continue
-
-        image = Image.fromarray(image_array)
-
-        faces = np.array(input_object["BBoxes_xyxy"]["face"]).reshape(-1, 4)
-
-        faces_to_delete = []
-        for i, face in enumerate(faces):
-            path = image_path
-            x1, y1, x2, y2 = face
-            cropped_image = image.crop((x1, y1, x2, y2))
-            cropped_image.save(path)
-
-            logger.info("Classifying image " + path)
-
-            description = classify_faces(path, logger)
-
-            if description is None:
-                logger.info("No description for this face.")
-                continue
+        new_result_cache = result_cache
+        new_classification_queue = classification_queue
+        if new_queue_settings != queue_settings:
+            new_result_cache = cache_utils.ObjectResultCache(
+                ttl_seconds=configuration.getfloat("cache", "ttl_seconds", fallback=300.0),
+                negative_ttl_seconds=configuration.getfloat("cache", "negative_ttl_seconds", fallback=10.0),
+                max_entries=configuration.getint("cache", "max_entries", fallback=1024),
+            )
+            new_classification_queue = classification_utils.ClassificationQueue(
+                classify_face,
+                threads=configuration.getint("inference", "threads", fallback=2),
+                max_pending=configuration.getint("inference", "max_pending", fallback=16),
+                cache=new_result_cache,
+                expected_errors=(cloud_utils.CircuitOpenError,),
+            )
 
-            # Add the description to the object
-            if description not in input_object:
-                input_object["BBoxes_xyxy"][description] = face.tolist()
-            else:
-                input_object["BBoxes_xyxy"][description].extend(face.tolist())
-
-            faces_to_delete.append(i)
+    except Exception as e:
+        logger.error("Keeping the previous configuration: " + str(e), exc_info=True)
+        return
+
+    previous_queue = classification_queue
+    aws_access_key_id = new_aws_access_key_id
+    aws_secret_access_key = new_aws_secret_access_key
+    region_name = new_region_name
+    endpoint_url = new_endpoint_url
+    max_connections = new_max_connections
+    timeout_seconds = new_timeout_seconds
+    image_format = new_image_format
+    aws_utils.cloud_client, cloud_settings = new_cloud_client, new_cloud_settings
+    scene_gate, scene_settings = new_scene_gate, new_scene_settings
+    result_cache, classification_queue, queue_settings = new_result_cache, new_classification_queue, new_queue_settings
+
+    if previous_queue is not None and previous_queue is not classification_queue:
+        previous_queue.shutdown(wait=False)
+
+
+def shutdown():
+    # The faces that are still queued are not needed anymore once the processor stops
+    logger.info("Classification queue: " + str(classification_queue.metrics()))
+    classification_queue.shutdown(wait=False)
+
+
+def process_frame(input_object, image_header):
+    device_id = input_object.get("DeviceID")
+    faces = np.array(input_object["BBoxes_xyxy"].get("face", [])).reshape(-1, 4)
+    keys = face_keys(input_object, faces)
+
+    # Replace the faces that have been classified by their description
+    faces_to_delete = []
+    new_faces = []
+    for i, (face, key) in enumerate(zip(faces, keys)):
+        # A face that shows up under a new ID is found again by its box
+        description = result_cache.lookup(*key, box=face, default=NOT_CLASSIFIED)
+        if description is NOT_CLASSIFIED:
+            if not classification_queue.is_pending(key):
+                new_faces.append(i)
+            continue
+        if description is None:
+            continue
 
-            # FIXME: Run the classification for 2 faces max to avoid affecting FPS rate
-            if len(faces_to_delete) >= 2:
-                break
+        # Add the description to the object
+        if description not in input_object["BBoxes_xyxy"]:
+            input_object["BBoxes_xyxy"][description] = face.tolist()
+        else:
+            input_object["BBoxes_xyxy"][description].extend(face.tolist())
 
-        # Delete the faces that have been classified
-        faces = np.delete(faces, faces_to_delete, axis=0)
-        input_object["BBoxes_xyxy"]["face"] = faces.flatten().tolist()
+        faces_to_delete.append(i)
 
-        formatted_packed_object = pformat(input_object)
-        logger.debug(f"Returning packed object:\n\n{formatted_packed_object}\n\n")
+    # Queue the faces that were not classified yet, unless the scene did not change or the cloud is down
+    if aws_utils.cloud_client.circuit_breaker.is_open():
+        new_faces = []
+    if len(new_faces) > 0 and (scene_gate is None or scene_changed(image_header, device_id)):
+        crops = crop_faces(image_header, faces[new_faces])
+        if crops is not None:
+            for i, crop in zip(new_faces, crops):
+                if crop.size > 0:
+                    classification_queue.submit(keys[i], crop, box=faces[i])
+        logger.debug("Classification queue: %s", log_utils.Lazy(classification_queue.metrics))
+        logger.debug("Result cache: %s", log_utils.Lazy(result_cache.metrics))
+        logger.debug("Cloud client: %s", log_utils.Lazy(aws_utils.cloud_client.metrics))
 
-        # Write object back to string
-        output_message = communication_utils.writeInferenceResults(input_object)
+    # Delete the faces that have been classified
+    faces = np.delete(faces, faces_to_delete, axis=0)
+    input_object["BBoxes_xyxy"]["face"] = faces.flatten().tolist()
 
-        # Send message back to runtime
-        communication_utils.sendMessageOverConnection(connection, output_message)
+    frame_logger.dump("Returning packed object", input_object)
 
 
 if __name__ == "__main__":
     ## initialize the logger
     logger = logging.getLogger(__name__)
+    frame_logger = log_utils.FrameLogger(logger)
 
     ## read configuration file if it's available
-    config()
+    config(processor_utils.read_config(CONFIG_FILE, logger))
 
     logger.info("Initializing cloud interference plugin")
     logger.debug("Input parameters: " + str(sys.argv))
 
-    global rekognition_client
+    if classification_queue is None:
+        logger.error("Could not apply the configuration, stopping")
+        exit()
 
     try:
-        rekognition_client = create_session(logger)
+        aws_utils.rekognition_client = create_session(logger, endpoint_url, max_connections, timeout_seconds)
     except Exception as e:
         logger.error(e, exc_info=True)
 
-    if rekognition_client:
+    if aws_utils.rekognition_client:
         logging.debug("AWS Session started")
     else:
         logging.error("AWS session failed")
         exit()
 
-    # Parse input arguments
-    if len(sys.argv) > 1:
-        Postprocessor_Socket_Path = sys.argv[1]
-    # Handle interrupt signals
-    signal.signal(signal.SIGTERM, signal_handler)
-    # Start program
-    try:
-        main()
-    except Exception as e:
-        logger.error(e, exc_info=True)
-    except KeyboardInterrupt:
-        logger.info("Exited with keyboard interrupt")
-
-    try:
-        os.unlink(Postprocessor_Socket_Path)
-    except OSError:
-        if os.path.exists(Postprocessor_Socket_Path):
-            logger.error("Could not remove socket file: " + Postprocessor_Socket_Path)
+    # Handle frames until the processor is stopped, the image header follows every message
+    processor_utils.run_processor(
+        Postprocessor_Socket_Path,
+        process_frame,
+        image_header=True,
+        on_shutdown=[shutdown],
+        config_file=CONFIG_FILE,
+        on_config=config,
+    )
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# Local stand-in for the AWS Rekognition DetectFaces API, to test and load test the cloud inference
+# postprocessor without an AWS account.
+#
+# Usage: python3 rekognition_standin.py [--port 8765] [--latency-ms 150] [--jitter-ms 50] [--error-rate 0.0] [--throttle-rate 0.0]
+#
+# Point the postprocessor to it by setting endpoint_url=http://127.0.0.1:8765 in the [cloud] section
+# of the configuration file. boto3 still signs the requests, so any credentials will do:
+#
+#   AWS_ACCESS_KEY_ID=test AWS_SECRET_ACCESS_KEY=test AWS_DEFAULT_REGION=us-east-1
+#
+# The stand-in speaks the same JSON protocol as Rekognition. The returned attributes are derived
+# from a hash of the image, so the same face always gets the same description.
+
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+IMAGE_SIGNATURES = (b"\x89PNG", b"\xff\xd8\xff")
+EMOTIONS = ("HAPPY", "CALM", "SURPRISED", "CONFUSED", "SAD", "ANGRY", "DISGUSTED", "FEAR")
+
+
+def describe_face(image_bytes):
+    # Deterministic face details for the given image
+    digest = hashlib.sha256(image_bytes).digest()
+    low = 10 + digest[0] % 60
+    emotions = [{"Type": emotion, "Confidence": float(digest[2 + index] % 100)} for index, emotion in enumerate(EMOTIONS)]
+    emotions.sort(key=lambda emotion: -emotion["Confidence"])
+    return {
+        "BoundingBox": {"Width": 0.8, "Height": 0.9, "Left": 0.1, "Top": 0.05},
+        "AgeRange": {"Low": low, "High": low + 8},
+        "Smile": {"Value": digest[1] % 2 == 0, "Confidence": 90.0},
+        "Sunglasses": {"Value": digest[1] % 7 == 0, "Confidence": 90.0},
+        "Gender": {"Value": "Male" if digest[0] % 2 == 0 else "Female", "Confidence": 95.0},
+        "Emotions": emotions,
+        "Confidence": 99.9,
+    }
+
+
+class RekognitionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        target = self.headers.get("X-Amz-Target", "")
+        settings = self.server.settings
+
+        delay = max(0.0, random.gauss(settings.latency_ms, settings.jitter_ms)) / 1000
+        time.sleep(delay)
+
+        if target != "RekognitionService.DetectFaces":
+            return self.send_error_response(400, "UnknownOperationException", "Unsupported operation " + target)
+        if random.random() < settings.throttle_rate:
+            return self.send_error_response(400, "ThrottlingException", "Rate exceeded")
+        if random.random() < settings.error_rate:
+            return self.send_error_response(500, "InternalServerError", "Internal server error")
+
+        try:
+            image_bytes = base64.b64decode(json.loads(body)["Image"]["Bytes"])
+        except (ValueError, KeyError, TypeError):
+            return self.send_error_response(400, "InvalidParameterException", "Request has invalid parameters")
+        if not image_bytes.startswith(IMAGE_SIGNATURES):
+            return self.send_error_response(400, "InvalidImageFormatException", "Request has invalid image format")
+
+        self.server.count_request()
+        self.send_json(200, {"FaceDetails": [describe_face(image_bytes)]})
+
+    def send_error_response(self, status, error_type, message):
+        self.send_json(status, {"__type": error_type, "message": message})
+
+    def send_json(self, status, content):
+        data = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/x-amz-json-1.1")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("x-amzn-RequestId", hashlib.md5(data).hexdigest())
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.settings.verbose:
+            super().log_message(format, *args)
+
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, settings):
+        super().__init__(("127.0.0.1", settings.port), RekognitionHandler)
+        self.settings = settings
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+
+def parse_arguments(arguments=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for AWS Rekognition DetectFaces")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=150.0)
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with a server error")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests failing with a ThrottlingException")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(arguments)
+
+
+def main():
+    settings = parse_arguments()
+    server = StandinServer(settings)
+    print("Rekognition stand-in listening on http://127.0.0.1:" + str(server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
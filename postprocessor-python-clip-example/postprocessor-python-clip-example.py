@@ -1,18 +1,18 @@
 import os
 import sys
-import socket
-import signal
 import logging
 import logging.handlers
-import configparser
-from pprint import pformat
-from collections import OrderedDict
-import time
 
 # Add the nxai-utilities python utilities
 script_location = os.path.dirname(sys.argv[0])
 sys.path.append(os.path.join(script_location, "../nxai-utilities/python-utilities"))
-import communication_utils
+sys.path.append(os.path.join(script_location, "../python-utilities"))
+import cache_utils
+import config_utils
+import event_utils
+import log_utils
+import processor_utils
+import prompt_utils
 
 
 CONFIG_FILE = os.path.join(script_location, "..", "etc", "plugin.clip.post.ini")
@@ -51,184 +51,119 @@ Postprocessor_Socket_Path = "/tmp/example-clip-postprocessor.sock"
 # 13: //UINT64
 
 
-def config():
-    logger.info("Reading configuration from:" + CONFIG_FILE)
+def config(configuration):
+    # Called with the configuration at startup and again whenever the configuration file changes.
+    # Both objects are created before either is applied, so a configuration with an error leaves
+    # the previous configuration in place.
+    global attribute_store
+    global attribute_settings
+    global event_engine
+    global event_settings
 
     try:
-        configuration = configparser.ConfigParser()
-        configuration.read(CONFIG_FILE)
-
-        configured_log_level = configuration.get("common", "debug_level", fallback="INFO")
-        set_log_level(configured_log_level)
-
-        for section in configuration.sections():
-            logger.info("config section: " + section)
-            for key in configuration[section]:
-                logger.info("config key: " + key + " = " + configuration[section][key])
+        # The stored attributes and the state of the events are kept while their settings do not change
+        new_attribute_settings = config_utils.section_items(configuration, "attributes")
+        new_attribute_store = attribute_store
+        if new_attribute_settings != attribute_settings:
+            new_attribute_store = cache_utils.ObjectResultCache(
+                ttl_seconds=configuration.getfloat("attributes", "ttl_seconds", fallback=300.0),
+                max_entries=configuration.getint("attributes", "max_entries", fallback=10000),
+                max_entries_per_device=configuration.getint("attributes", "max_entries_per_device", fallback=100),
+                max_bytes=int(configuration.getfloat("attributes", "max_megabytes", fallback=16) * 1024 * 1024),
+            )
+        # The cooldown is set per camera in the eventCooldown setting
+        new_event_settings = config_utils.section_items(configuration, "events")
+        new_event_engine = event_engine
+        if new_event_settings != event_settings:
+            new_event_engine = event_utils.EventEngine(
+                hits_required=configuration.getint("events", "hits_required", fallback=1),
+                window=configuration.getint("events", "window", fallback=1),
+                change_only=configuration.getboolean("events", "change_only", fallback=False),
+            )
 
     except Exception as e:
-        logger.error(e, exc_info=True)
-
-    logger.debug("Read configuration done")
-
-
-def set_log_level(level):
-    try:
-        logger.setLevel(level)
-    except Exception as e:
-        logger.error(e, exc_info=True)
-
-
-def signal_handler(sig, _):
-    logger.info("Received interrupt signal: " + str(sig))
-    sys.exit(0)
-
-
-objects_attributes = OrderedDict()
-# Keep track of the last states and times we generated an event per camera
-previous_state = {}
-previous_event_time = {}
-
-
-def main():
-    # Start socket listener to receive messages from NXAI runtime
-    logger.debug("Creating socket at " + Postprocessor_Socket_Path)
-    server = communication_utils.startUnixSocketServer(Postprocessor_Socket_Path)
-
-    # Wait for messages in a loop
-    while True:
-        # Wait for input message from runtime
-        logger.debug("Waiting for input message")
-
-        try:
-            input_message, connection = communication_utils.waitForSocketMessage(server)
-            logger.debug("Received input message")
-        except socket.timeout:
-            # Request timed out. Continue waiting
-            continue
-
-        # Parse input message
-        input_object = communication_utils.parseInferenceResults(input_message)
-
-        # Use pformat to format the deep object
-        # formatted_unpacked_object = pformat(input_object)
-        # logging.info(f"Unpacked:\n\n{formatted_unpacked_object}\n\n")
-
-        if "ObjectsMetaData" in input_object:
-            logger.info("Found objects ")
-            # This is the output of the object detector
-            # Add prompts as attributes if present
-            for class_data in input_object["ObjectsMetaData"].values():
-                for index, id in enumerate(class_data["ObjectIDs"]):
-                    if id in objects_attributes:
-                        logger.info("Found ID " + objects_attributes[id])
-                        class_data["AttributeKeys"][index].append(objects_attributes[id])
-                        class_data["AttributeValues"][index].append(objects_attributes[id])
-
-        # Get prompts from settings
-        prompts = {}
-        settings_names = sorted(list(input_object["ExternalProcessorSettings"].keys()))
-        for setting_name in settings_names:
-            if setting_name.startswith("externalprocessor.prompt"):
-                prompts[setting_name.replace("externalprocessor.", "")] = input_object["ExternalProcessorSettings"][setting_name]
-        logger.info("Got prompts: " + str(prompts))
-
-        # Get event cooldown setting
-        device_id = input_object["DeviceID"]
-        event_cooldown = 0
-        if "externalprocessor.eventCooldown" in input_object["ExternalProcessorSettings"]:
-            try:
-                event_cooldown = int(input_object["ExternalProcessorSettings"]["externalprocessor.eventCooldown"])
-            except:
-                pass
-
-        if "Scores" in input_object:
-            # This is the output of the clip model
-            # Replace the prompts with the appropriate text
-            score_names = list(input_object["Scores"].keys())
-            top_score = ("", 0.0)
-            prompt_found = False
-            for score_name in score_names:
-                if score_name in prompts:
-                    prompt_found = True
-                    if top_score[1] < input_object["Scores"][score_name]:
-                        top_score = (
-                            prompts[score_name],
-                            input_object["Scores"][score_name],
-                        )
-            if prompt_found == True:
-                # Remove original scores
-                del input_object["Scores"]
-                if top_score[0] != "":
-                    # Check if event should be added
-                    add_event = True
-                    if device_id in previous_state and previous_state[device_id] == top_score[0]:
-                        # State has not changed, check if timed out
-                        if (time.time() - previous_event_time[device_id]) < event_cooldown:
-                            add_event = False
-
-                    if add_event is True:
-                        # Add event to output
-                        if "Events" not in input_object:
-                            input_object["Events"] = []
-                        input_object["Events"].append(
-                            {
-                                "ID": "nx.clip.event",
-                                "Caption": "CLIP Prompt Recognized",
-                                "Description": top_score[0],
-                            }
-                        )
-                        # Set previous state to handle event cooldowns
-                        previous_event_time[device_id] = time.time()
-                        previous_state[device_id] = top_score[0]
-
-            # Check if object is feature extracted
-            if "OriginalObjectID" in input_object:
-                if top_score[0] != "":
-                    objects_attributes[input_object["OriginalObjectID"]] = top_score[0]
-
-        # formatted_unpacked_object = pformat(input_object)
-        # logging.info(f"Packing:\n\n{formatted_unpacked_object}\n\n")
-
-        # Write object back to string
-        output_message = communication_utils.writeInferenceResults(input_object)
-
-        # Send message back to runtime
-        communication_utils.sendMessageOverConnection(connection, output_message)
-
-        # Remove objects
-        while len(objects_attributes) > 100:
-            logger.info("Popping item from objects_attributes " + str(len(objects_attributes)))
-            objects_attributes.popitem(False)
+        logger.error("Keeping the previous configuration: " + str(e), exc_info=True)
+        return
+
+    attribute_store, attribute_settings = new_attribute_store, new_attribute_settings
+    event_engine, event_settings = new_event_engine, new_event_settings
+
+
+# The recognized prompt of each object, by device and object ID
+attribute_store = cache_utils.ObjectResultCache(ttl_seconds=300.0, max_entries=10000, max_entries_per_device=100)
+# Compiled prompts and settings per settings snapshot
+plan_cache = prompt_utils.PlanCache()
+# Keep track of the recognized prompts and the times we generated an event per camera
+event_engine = event_utils.EventEngine()
+# The [attributes] and [events] settings the store and the engine were created with
+attribute_settings = None
+event_settings = None
+
+
+def process_frame(input_object):
+    # Dump the deep object at DEBUG level, it is only formatted when it is written
+    frame_logger.dump("Unpacked", input_object)
+
+    if "ObjectsMetaData" in input_object:
+        logger.debug("Found objects")
+        # This is the output of the object detector
+        # Add prompts as attributes if present
+        for class_data in input_object["ObjectsMetaData"].values():
+            for index, id in enumerate(class_data["ObjectIDs"]):
+                attribute = attribute_store.get(input_object["DeviceID"], id)
+                if attribute is not None:
+                    logger.debug("Found ID %s", attribute)
+                    class_data["AttributeKeys"][index].append(attribute)
+                    class_data["AttributeValues"][index].append(attribute)
+
+    # Prompts and event cooldown from the settings, compiled once per settings snapshot
+    device_id = input_object["DeviceID"]
+    plan = plan_cache.plan(device_id, input_object["ExternalProcessorSettings"])
+    event_cooldown = plan.event_cooldown
+
+    if "Scores" in input_object:
+        # This is the output of the clip model
+        # Replace the prompts with the appropriate text
+        top_score = plan.top_prompt(input_object["Scores"])
+        prompt_found = top_score is not None
+        if prompt_found == True:
+            # Remove original scores
+            del input_object["Scores"]
+            # Add an event when a prompt is recognized, or another prompt than before, or the cooldown has passed
+            if event_engine.update(
+                device_id, "nx.clip.event", top_score[0] != "", state=top_score[0], cooldown_seconds=event_cooldown
+            ):
+                # Add event to output
+                if "Events" not in input_object:
+                    input_object["Events"] = []
+                input_object["Events"].append(
+                    {
+                        "ID": "nx.clip.event",
+                        "Caption": "CLIP Prompt Recognized",
+                        "Description": top_score[0],
+                    }
+                )
+
+        # Check if object is feature extracted
+        if "OriginalObjectID" in input_object:
+            if prompt_found and top_score[0] != "":
+                attribute_store.put(device_id, input_object["OriginalObjectID"], top_score[0])
+
+    frame_logger.dump("Packing", input_object)
 
 
 if __name__ == "__main__":
     ## initialize the logger
     logger = logging.getLogger(__name__)
+    frame_logger = log_utils.FrameLogger(logger)
 
     logger.info("Location: " + str(script_location))
 
     ## read configuration file if it's available
-    config()
+    config(processor_utils.read_config(CONFIG_FILE, logger))
 
     logger.info("Initializing example plugin")
     logger.debug("Input parameters: " + str(sys.argv))
 
-    # Parse input arguments
-    if len(sys.argv) > 1:
-        Postprocessor_Socket_Path = sys.argv[1]
-    # Handle interrupt signals
-    signal.signal(signal.SIGTERM, signal_handler)
-    # Start program
-    try:
-        main()
-    except Exception as e:
-        logger.error(e, exc_info=True)
-    except KeyboardInterrupt:
-        logger.info("Exited with keyboard interrupt")
-
-    try:
-        os.unlink(Postprocessor_Socket_Path)
-    except OSError:
-        if os.path.exists(Postprocessor_Socket_Path):
-            logger.error("Could not remove socket file: " + Postprocessor_Socket_Path)
+    # Handle frames until the processor is stopped, the socket path is given as the first argument
+    processor_utils.run_processor(Postprocessor_Socket_Path, process_frame, config_file=CONFIG_FILE, on_config=config)
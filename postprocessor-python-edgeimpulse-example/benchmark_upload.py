@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# Benchmark of the sample capture path of the Edge Impulse postprocessor for each upload backend.
+#
+# Usage: python3 benchmark_upload.py [--frames 300] [--capture-every 2] [--width 1280] [--height 720] [--latency-ms 50] [--spool] [--api-key ei_...]
+#
+# Runs a simulated frame loop that selects samples from a detection output and captures every
+# `capture-every`th frame through the encoder, the background uploader and the backend, like the
+# postprocessor does. Reports the time the frame loop spends per frame, compared to a loop that
+# captures nothing, and the end-to-end throughput in samples per second until the last sample
+# was uploaded. The HTTP backend sends the samples to an in-process ingestion_standin.py. Edge
+# Impulse is only benchmarked when an API key is given, the samples are then uploaded to your
+# project.
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+import numpy as np
+
+script_location = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_location, "../python-utilities"))
+import encoding_utils
+import selection_utils
+import spool_utils
+import upload_utils
+import upload_backends
+import ingestion_standin
+
+
+def run(backend, images, outputs, arguments, spool_directory=None):
+    # The per frame times of the loop in ms, and the samples per second from the first capture until the last upload
+    selector = selection_utils.SampleSelector(max_score=0.4)
+    encoder = encoding_utils.EncoderService(threads=2, max_pending=8)
+    spool = spool_utils.SampleSpool(spool_directory) if spool_directory else None
+    uploader = None
+    if backend is not None:
+        uploader = upload_utils.BackgroundUploader(
+            lambda batch: backend.upload([(str(time.monotonic_ns()) + ".jpg", data, {}) for data in batch]),
+            batch_size=20,
+            max_latency_seconds=0.5,
+            queue=spool,
+        )
+
+    def queue_sample(future):
+        uploader.submit(future.result())
+
+    frame_times = []
+    dropped = 0
+    start = time.perf_counter()
+    for index in range(arguments.frames):
+        frame_start = time.perf_counter()
+        selector.select(outputs[index % len(outputs)])
+        if uploader is not None and index % arguments.capture_every == 0:
+            future = encoder.submit(images[index % len(images)])
+            if future is None:
+                dropped += 1
+            else:
+                future.add_done_callback(queue_sample)
+        frame_times.append(time.perf_counter() - frame_start)
+        # The rest of the frame interval, the camera delivers at `fps`
+        time.sleep(max(0.0, 1.0 / arguments.fps - (time.perf_counter() - frame_start)))
+
+    encoder.shutdown()
+    samples_per_second = 0.0
+    if uploader is not None:
+        uploader.close(timeout=60)
+        metrics = uploader.metrics()
+        samples_per_second = metrics["UploadUploaded"] / (time.perf_counter() - start)
+        print("  " + str(metrics) + ", dropped by the encoder: " + str(dropped))
+    if spool is not None:
+        spool.close()
+    return np.array(frame_times) * 1000, samples_per_second
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the upload backends of the Edge Impulse postprocessor")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--fps", type=float, default=30.0, help="Frame rate of the simulated camera")
+    parser.add_argument("--capture-every", type=int, default=2, help="Capture every nth frame")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Latency of the HTTP stand-in")
+    parser.add_argument("--spool", action="store_true", help="Queue the samples in an on-disk spool")
+    parser.add_argument("--api-key", default="", help="Also benchmark uploading to Edge Impulse with this key")
+    arguments = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 256, (arguments.height, arguments.width, 3), dtype=np.uint8) for _ in range(4)]
+    entries = np.zeros((100, 6), dtype=np.float32)
+    outputs = []
+    for _ in range(16):
+        entries[:, 4] = rng.uniform(0.2, 1.0, len(entries))
+        outputs.append(entries.reshape(-1).copy())
+
+    settings = ingestion_standin.parse_arguments(["--port", "0", "--latency-ms", str(arguments.latency_ms), "--jitter-ms", "0"])
+    server = ingestion_standin.StandinServer(settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    work_directory = tempfile.mkdtemp(prefix="benchmark-upload-")
+
+    backends = [
+        ("none", None),
+        ("directory", upload_backends.DirectoryBackend(os.path.join(work_directory, "samples"))),
+        ("http", upload_backends.HTTPBackend("http://127.0.0.1:" + str(server.server_address[1]), max_connections=4)),
+    ]
+    if arguments.api_key:
+        backends.append(("edgeimpulse", upload_backends.EdgeImpulseBackend(arguments.api_key)))
+
+    print(
+        "{} frames of {}x{} at {:.0f} fps, capturing every {} frames{}".format(
+            arguments.frames, arguments.width, arguments.height, arguments.fps, arguments.capture_every, ", spooled to disk" if arguments.spool else ""
+        )
+    )
+    try:
+        for name, backend in backends:
+            print(name)
+            spool_directory = os.path.join(work_directory, "spool-" + name) if arguments.spool and backend is not None else None
+            milliseconds, samples_per_second = run(backend, images, outputs, arguments, spool_directory)
+            print(
+                "  frame loop: mean {:.2f} ms, p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms, upload: {:.1f} samples/s".format(
+                    milliseconds.mean(), *np.percentile(milliseconds, [50, 99]), milliseconds.max(), samples_per_second
+                )
+            )
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
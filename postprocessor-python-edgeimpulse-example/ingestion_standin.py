@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Local stand-in for the Edge Impulse ingestion service, to test and benchmark the Edge Impulse
+# postprocessor without an Edge Impulse account.
+#
+# Usage: python3 ingestion_standin.py [--port 8766] [--latency-ms 50] [--jitter-ms 20] [--error-rate 0.0] [--directory samples]
+#
+# Point the postprocessor to it with backend = http and url = http://127.0.0.1:8766 in the [upload]
+# section of the configuration file. The stand-in accepts single files posted to
+# /api/<category>/data with an x-file-name header, and stores them in --directory when it is set.
+
+import os
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CATEGORIES = ("training", "testing", "anomaly")
+
+
+class IngestionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        settings = self.server.settings
+
+        delay = max(0.0, random.gauss(settings.latency_ms, settings.jitter_ms)) / 1000
+        time.sleep(delay)
+
+        parts = self.path.strip("/").split("/")
+        if len(parts) != 3 or parts[0] != "api" or parts[1] not in CATEGORIES or parts[2] != "data":
+            return self.send_text(404, "Unknown path " + self.path)
+        if settings.api_key and self.headers.get("x-api-key") != settings.api_key:
+            return self.send_text(401, "Invalid API key")
+        filename = os.path.basename(self.headers.get("x-file-name", ""))
+        if not filename:
+            return self.send_text(400, "Missing x-file-name header")
+        if random.random() < settings.error_rate:
+            return self.send_text(500, "Internal server error")
+
+        if settings.directory:
+            with open(os.path.join(settings.directory, filename), "wb") as file:
+                file.write(body)
+        self.server.count_sample(len(body))
+        self.send_text(200, hashlib.md5(body).hexdigest())
+
+    def send_text(self, status, text):
+        data = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.settings.verbose:
+            super().log_message(format, *args)
+
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, settings):
+        super().__init__(("127.0.0.1", settings.port), IngestionHandler)
+        self.settings = settings
+        self.samples = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        if settings.directory:
+            os.makedirs(settings.directory, exist_ok=True)
+
+    def count_sample(self, size: int):
+        with self._lock:
+            self.samples += 1
+            self.bytes += size
+
+
+def parse_arguments(arguments=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the Edge Impulse ingestion service")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with a server error")
+    parser.add_argument("--api-key", default="", help="Only accept requests with this API key")
+    parser.add_argument("--directory", default="", help="Store the received samples in this directory")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(arguments)
+
+
+def main():
+    settings = parse_arguments()
+    server = StandinServer(settings)
+    print("Ingestion stand-in listening on http://127.0.0.1:" + str(server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
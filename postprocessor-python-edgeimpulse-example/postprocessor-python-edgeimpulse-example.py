@@ -1,19 +1,10 @@
 import os
 import sys
-import socket
-import signal
 import logging
 import logging.handlers
-import configparser
-import io
 import time
-from pprint import pformat
-import msgpack
-import struct
-from math import prod
 from datetime import datetime
-from PIL import Image
-import edgeimpulse
+import numpy as np
 
 script_location = os.path.dirname(sys.argv[0])
 CONFIG_FILE = os.path.join(script_location, "..", "etc", "plugin.cloud-edgeimpulse.ini")
@@ -27,8 +18,47 @@ default_edge_impulse_api_key = "ei_xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
 # We keep a counter to generate unique filenames.
 samples_counter: int = 0
 
-# The buffer with samples to batch.
-samples_buffer: list = []
+# Destination of the samples: Edge Impulse, a local directory or an HTTP server.
+upload_backend = "edgeimpulse"
+backend = None
+
+# Uploads batches of samples in the background, the samples are the encoded JPEG images.
+uploader = None
+
+# On-disk spool of the samples waiting for upload, so they are uploaded after a crash or restart.
+spool = None
+
+# Encodes the samples on a thread pool, so the socket loop does not wait for the encoding.
+encoder = None
+
+# Selects the frames to capture from the detection output, by score band, class and rate per class.
+selector = None
+
+# Pixel format of the input image, when empty it is derived from the number of channels.
+pixel_format = ""
+
+# Reusable buffer holding the RGB image of the captured sample.
+rgb_buffer = None
+
+# Skips samples of frames that show the same scene as the last captured sample of the device.
+scene_gate = None
+
+# Skips samples that are near duplicates of recent samples of the device.
+duplicate_filter = None
+
+# The settings the selector, encoder and sample filters were created with, they are only created
+# again when the configuration file changes these settings.
+selector_settings = None
+encoder_settings = None
+scene_settings = None
+dedup_settings = None
+
+# Time to upload the queued samples when the postprocessor is stopped.
+shutdown_timeout_seconds = 10
+
+# Number of frames received, and the time the last timed sample was taken.
+frame_counter = 0
+last_timed_sample_time = time.time()
 
 # Returning data to the AI Manager is not needed for this postprocessor.
 # See also "NoResponse": true value in external_postprocessors.json / README.md
@@ -44,7 +74,20 @@ logging.basicConfig(
 
 # Add the nxai-utilities python utilities
 sys.path.append(os.path.join(script_location, "../nxai-utilities/python-utilities"))
-import communication_utils
+sys.path.append(os.path.join(script_location, "../python-utilities"))
+import colorspace_utils
+import config_utils
+import dedup_utils
+import encoding_utils
+import image_utils
+import log_utils
+import motion_utils
+import processor_utils
+import selection_utils
+import shm_utils
+import spool_utils
+import upload_utils
+import upload_backends
 
 # The name of the postprocessor.
 # This is used to match the definition of the postprocessor with routing.
@@ -56,292 +99,340 @@ Postprocessor_Name = "Python-EdgeImpulse-Postprocessor"
 Postprocessor_Socket_Path = "/tmp/python-edgeimpulse-postprocessor.sock"
 
 
-def send_samples_buffer():
-    # This function sends the buffered samples to an Edge Impulse instance for data processing.
-    # It generates a unique filename for each sample and adds it to a new list of samples while
-    # updating the global counter.
-    # It then uploads all these samples to the Edge Impulse. The function also times the duration of
-    # the upload and prints this time along with the number of samples uploaded. If the sample buffer
-    # was already empty, the function just prints that there were no samples to upload.
-    # At the end, it empties the sample buffer.
-    global samples_buffer, samples_counter
-    if len(samples_buffer) > 0:
-        logging.info(
-            "Sending {c} samples to Edge Impulse...".format(c=len(samples_buffer))
-        )
-        start_at = time.perf_counter()
-        samples = []
-        for contents in samples_buffer:
-            samples_counter += 1
-            logging.info("Create sample" + str(samples_counter))
-            filename = "{dt}C{c}.jpg".format(
-                dt=datetime.now().strftime("%Y-%m-%dT%H:%M:%S"), c=samples_counter
-            )
-            output = io.BytesIO(contents)
-            sample = edgeimpulse.experimental.data.Sample(
-                filename=filename,
-                data=output,
-                metadata={
-                    "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                },
-            )
-            samples.append(sample)
-
-        logging.info("Done creating samples, starting upload...")
-        response = edgeimpulse.experimental.data.upload_samples(samples)
-        logging.info("Done upload")
-
-        # Check to make sure there were no failures
-        if (len(response.fails)) != 0:
-            logging.info("Could not upload files")
-
-        end_at = time.perf_counter()
-        logging.info(
-            "Send {c} samples in {d:0.1f}sec to Edge Impulse. Total {t}".format(
-                c=len(samples_buffer),
-                d=end_at - start_at,
-                t=samples_counter,
-            )
+def send_samples(samples_buffer):
+    # This function sends a batch of buffered samples to the upload backend, Edge Impulse by default.
+    # It runs on the uploader thread, so the socket loop keeps handling frames during the upload.
+    # It generates a unique filename for each sample while updating the global counter.
+    # It then uploads all these samples and times the duration of the upload, an exception is
+    # raised when the upload failed.
+    global samples_counter
+    logging.info(
+        "Sending {c} samples to {b}...".format(c=len(samples_buffer), b=backend.name)
+    )
+    start_at = time.perf_counter()
+    samples = []
+    for contents in samples_buffer:
+        samples_counter += 1
+        logging.debug("Create sample %d", samples_counter)
+        filename = "{dt}C{c}.jpg".format(
+            dt=datetime.now().strftime("%Y-%m-%dT%H:%M:%S"), c=samples_counter
         )
-        logging.info(
-            "Send a total of {t} samples to Edge Impulse".format(t=samples_counter)
-        )
-
-        samples_buffer = []
-    else:
-        logging.info(
-            "No samples to send to Edge Impulse. Total {t}".format(t=samples_counter)
+        metadata = {"date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        samples.append((filename, contents, metadata))
+
+    backend.upload(samples)
+
+    end_at = time.perf_counter()
+    logging.info(
+        "Send {c} samples in {d:0.1f}sec to {b}. Total {t}".format(
+            c=len(samples_buffer),
+            d=end_at - start_at,
+            b=backend.name,
+            t=samples_counter,
         )
+    )
+    logging.info("Uploader: " + str(uploader.metrics()))
 
 
-def config():
+def queue_sample(future):
+    # Called on an encoder thread when a sample is encoded, queues it for upload
+    try:
+        contents = future.result()
+    except Exception as e:
+        logging.error("Could not encode sample: " + str(e))
+        return
+    if not uploader.submit(contents):
+        logging.info("Upload queue is full, dropped the oldest samples. %s", log_utils.Lazy(uploader.metrics))
+
+
+def read_rgb_image(image_header):
+    # Convert the image in shared memory to RGB, without an intermediate copy
+    global rgb_buffer
+    width = image_header["Width"]
+    height = image_header["Height"]
+    image_format = pixel_format or colorspace_utils.pixel_format_for_channels(image_header["Channels"])
+    if rgb_buffer is None or rgb_buffer.shape != (height, width, 3):
+        rgb_buffer = np.empty((height, width, 3), dtype=np.uint8)
+    with shm_utils.attach(image_header["SHMKey"]) as image_data:
+        colorspace_utils.to_rgb(image_data, width, height, image_format, out=rgb_buffer)
+    return rgb_buffer
+
+
+def luma_view(image_data, image_header):
+    # View of the image for the sample filters, the luma plane is enough for YUV images
+    channels = image_header["Channels"]
+    if pixel_format in (colorspace_utils.NV12, colorspace_utils.NV21, colorspace_utils.I420):
+        channels = 1
+    return image_utils.image_view(image_data, image_header["Width"], image_header["Height"], channels)
+
+
+def keep_sample(image_header, device_id):
+    # Skip samples of unchanged scenes and near duplicates of recent samples of the device
+    with shm_utils.attach(image_header["SHMKey"]) as image_data:
+        if scene_gate is not None:
+            scene_change = scene_gate.check(device_id, luma_view(image_data, image_header))
+            logging.debug("Scene change: %s", scene_change)
+            if not scene_change.changed:
+                return False
+        if duplicate_filter is not None and duplicate_filter.is_duplicate(device_id, luma_view(image_data, image_header)):
+            logging.debug("Skipping duplicate sample. %s", log_utils.Lazy(duplicate_filter.metrics))
+            return False
+    return True
+
+
+def start_uploads(configuration):
+    # Called once at startup, creates the upload backend, the spool and the uploader.
+    # When one of them can not be created the error is logged and the uploader is left unset,
+    # so the postprocessor stops instead of handling frames it can not upload.
 
     global edge_impulse_api_key
-    global default_edge_impulse_api_key
-    global auto_generator
-    global auto_generator_every_seconds
-    global samples_buffer_flush_size
-    global p_value
+    global upload_backend
+    global backend
+    global uploader
+    global spool
+
+    # Override default values from config
+    edge_impulse_api_key = configuration.get(
+        "edgeimpulse", "api_key", fallback=default_edge_impulse_api_key
+    )
 
-    logger.info("Reading configuration from:" + CONFIG_FILE)
+    logger.info("new edge_impulse_api_key: " + edge_impulse_api_key)
+
+    upload_backend = configuration.get("upload", "backend", fallback="edgeimpulse").lower()
+    if upload_backend == "edgeimpulse" and edge_impulse_api_key == default_edge_impulse_api_key:
+        logger.error("Edge Impulse Key is not set yet")
+        return
 
     try:
-        configuration = configparser.ConfigParser()
-        configuration.read(CONFIG_FILE)
+        backend = upload_backends.create_backend(
+            upload_backend,
+            api_key=edge_impulse_api_key,
+            directory=configuration.get("upload", "directory", fallback="") or os.path.join(script_location, "..", "var", "edgeimpulse-samples"),
+            url=configuration.get("upload", "url", fallback="http://127.0.0.1:8766"),
+            max_connections=configuration.getint("upload", "max_connections", fallback=2),
+        )
+    except Exception as e:
+        logger.error("Could not create the " + upload_backend + " upload backend: " + str(e), exc_info=True)
+        return
 
-        configured_log_level = configuration.get(
-            "common", "debug_level", fallback="INFO"
+    try:
+        if configuration.getboolean("spool", "enabled", fallback=True):
+            spool = spool_utils.SampleSpool(
+                configuration.get("spool", "directory", fallback="") or os.path.join(script_location, "..", "var", "edgeimpulse-spool"),
+                max_bytes=int(configuration.getfloat("spool", "max_megabytes", fallback=256) * 1024 * 1024),
+                segment_bytes=int(configuration.getfloat("spool", "segment_megabytes", fallback=4) * 1024 * 1024),
+                fsync=configuration.getboolean("spool", "fsync", fallback=False),
+            )
+        uploader = upload_utils.BackgroundUploader(
+            send_samples,
+            queue=spool,
+            batch_size=int(configuration.get("edgeimpulse", "samples_buffer_flush_size", fallback=20)),
+            max_latency_seconds=configuration.getfloat("edgeimpulse", "samples_buffer_max_latency_seconds", fallback=30.0),
+            max_queue=configuration.getint("edgeimpulse", "samples_buffer_max_size", fallback=200),
         )
-        set_log_level(configured_log_level)
+    except Exception as e:
+        logger.error("Could not start the uploads: " + str(e), exc_info=True)
 
-        for section in configuration.sections():
-            logger.info("config section: " + section)
-            for key in configuration[section]:
-                logger.info("config key: " + key + " = " + configuration[section][key])
 
-        # Override default values from config
-        edge_impulse_api_key = configuration.get(
-            "edgeimpulse", "api_key", fallback=default_edge_impulse_api_key
-        )
+def config(configuration):
+    # Called with the configuration at startup and again whenever the configuration file changes.
+    # The upload backend, the spool and the size of the upload queue are set up once by
+    # start_uploads, the other settings apply to the next frame.
+    # All settings are read and the new objects created before any of them is applied, so a
+    # configuration with an error leaves the previous configuration in place.
 
-        logger.info("new edge_impulse_api_key: " + edge_impulse_api_key)
+    global auto_generator
+    global auto_generator_every_seconds
+    global samples_buffer_flush_size
+    global selector
+    global selector_settings
+    global pixel_format
+    global scene_gate
+    global scene_settings
+    global duplicate_filter
+    global dedup_settings
+    global encoder
+    global encoder_settings
 
-        auto_generator = configuration.get(
+    try:
+        new_auto_generator = configuration.get(
             "edgeimpulse", "auto_generator", fallback=False
         )
-        auto_generator_every_seconds = int(
+        new_auto_generator_every_seconds = int(
             configuration.get("edgeimpulse", "auto_generator_every_seconds", fallback=1)
         )
-        samples_buffer_flush_size = int(
+        new_samples_buffer_flush_size = int(
             configuration.get("edgeimpulse", "samples_buffer_flush_size", fallback=20)
         )
-        p_value = float(configuration.get("edgeimpulse", "p_value", fallback=0.4))
+        samples_buffer_max_latency_seconds = configuration.getfloat(
+            "edgeimpulse", "samples_buffer_max_latency_seconds", fallback=30.0
+        )
+        new_pixel_format = configuration.get("edgeimpulse", "pixel_format", fallback="").upper()
+
+        p_value = configuration.getfloat("edgeimpulse", "p_value", fallback=0.4)
+        new_selector_settings = (p_value, config_utils.section_items(configuration, "selection"))
+        new_selector = selector
+        if new_selector_settings != selector_settings:
+            classes = configuration.get("selection", "classes", fallback="").strip()
+            exclude_classes = configuration.get("selection", "exclude_classes", fallback="").strip()
+            new_selector = selection_utils.SampleSelector(
+                entry_size=configuration.getint("selection", "entry_size", fallback=6),
+                score_index=configuration.getint("selection", "score_index", fallback=4),
+                class_index=configuration.getint("selection", "class_index", fallback=5),
+                min_score=configuration.getfloat("selection", "min_score", fallback=0.0),
+                max_score=configuration.getfloat("selection", "max_score", fallback=p_value),
+                classes=[int(c) for c in classes.split(",")] if classes else None,
+                exclude_classes=[int(c) for c in exclude_classes.split(",")] if exclude_classes else None,
+                rate_per_second=configuration.getfloat("selection", "rate_per_second", fallback=0.0),
+                burst=configuration.getfloat("selection", "burst", fallback=1.0),
+            )
 
-    except Exception as e:
-        logger.error(e, exc_info=True)
+        new_scene_settings = config_utils.section_items(configuration, "scene")
+        new_scene_gate = scene_gate
+        if new_scene_settings != scene_settings:
+            new_scene_gate = None
+            if configuration.getboolean("scene", "enabled", fallback=False):
+                new_scene_gate = motion_utils.SceneChangeGate(
+                    threshold=configuration.getfloat("scene", "threshold", fallback=6.0),
+                    max_skip_seconds=configuration.getfloat("scene", "max_skip_seconds", fallback=0.0),
+                )
 
-    logger.debug("Read configuration done")
+        new_dedup_settings = config_utils.section_items(configuration, "dedup")
+        new_duplicate_filter = duplicate_filter
+        if new_dedup_settings != dedup_settings:
+            new_duplicate_filter = None
+            if configuration.getboolean("dedup", "enabled", fallback=False):
+                new_duplicate_filter = dedup_utils.DuplicateFilter(
+                    method=configuration.get("dedup", "method", fallback=dedup_utils.DHASH).lower(),
+                    max_distance=configuration.getint("dedup", "max_distance", fallback=4),
+                    history=configuration.getint("dedup", "history", fallback=32),
+                )
 
+        # The encoder starts threads, so it is created last, when everything else is valid
+        new_encoder_settings = config_utils.section_items(configuration, "encoding")
+        new_encoder = encoder
+        if new_encoder_settings != encoder_settings:
+            new_encoder = encoding_utils.EncoderService(
+                threads=configuration.getint("encoding", "threads", fallback=2),
+                max_pending=configuration.getint("encoding", "max_pending", fallback=8),
+                quality=configuration.getint("encoding", "quality", fallback=85),
+                max_width=configuration.getint("encoding", "max_width", fallback=0),
+                max_height=configuration.getint("encoding", "max_height", fallback=0),
+            )
 
-def set_log_level(level):
-    try:
-        logger.setLevel(level)
     except Exception as e:
-        logger.error(e, exc_info=True)
+        logger.error("Keeping the previous configuration: " + str(e), exc_info=True)
+        return
 
+    previous_encoder = encoder
+    auto_generator = new_auto_generator
+    auto_generator_every_seconds = new_auto_generator_every_seconds
+    samples_buffer_flush_size = new_samples_buffer_flush_size
+    pixel_format = new_pixel_format
+    selector, selector_settings = new_selector, new_selector_settings
+    scene_gate, scene_settings = new_scene_gate, new_scene_settings
+    duplicate_filter, dedup_settings = new_duplicate_filter, new_dedup_settings
+    encoder, encoder_settings = new_encoder, new_encoder_settings
 
-def signal_handler(sig, _):
-    logging.info("Received interrupt signal: " + str(sig))
-    if len(samples_buffer) > 0:
-        send_samples_buffer()
-    sys.exit(0)
+    if uploader is not None:
+        uploader.configure(batch_size=samples_buffer_flush_size, max_latency_seconds=samples_buffer_max_latency_seconds)
+    # The samples that are still being encoded are queued by the previous encoder
+    if previous_encoder is not None and previous_encoder is not encoder:
+        previous_encoder.shutdown(wait=False)
 
 
-def main():
+def shutdown():
+    # Queue the samples that are still being encoded, then upload the queued samples
+    if encoder is not None:
+        encoder.shutdown()
+    if uploader is not None and not uploader.close(timeout=shutdown_timeout_seconds):
+        logging.info("Could not upload all samples before shutting down. " + str(uploader.metrics()))
+    if spool is not None:
+        spool.close()
 
-    global samples_buffer
-    global samples_buffer_flush_size
-    global samples_counter
-    global p_value
-    global auto_generator
-    global auto_generator_every_seconds
-    global edge_impulse_api_key
 
-    # Add your own project level Edge Impulse API key
-    edgeimpulse.API_KEY = edge_impulse_api_key
+def process_frame(parsed_response, image_header):
 
-    # Start socket listener to receive messages from NXAI runtime
-    try:
-        os.remove(Postprocessor_Socket_Path)
-    except OSError:
-        pass
-    server = communication_utils.startUnixSocketServer(Postprocessor_Socket_Path)
-
-    # Get the current time at the start
-    start_time = time.time()
-
-    # Wait for messages in a loop
-    counter = 0
-    while True:
-
-        upload_sample = False
-
-        logging.debug("Wait for message " + str(counter))
-        # Wait for input message from runtime
-        try:
-            input_message, connection = communication_utils.waitForSocketMessage(server)
-            image_header = communication_utils.receiveMessageOverConnection(connection)
-        except socket.timeout:
-            # Request timed out. Continue waiting
-            continue
-
-        counter = counter + 1
-
-        logging.debug("Message " + str(counter) + "received")
-
-        # Parse input message
-        parsed_response = msgpack.unpackb(input_message)
-
-        # Read Output types, shapes and sizes
-        output_data_types = parsed_response.get(
-            "OutputDataTypes"
-        )  # 1 for float32 and 3 for int8
-        output_shapes = parsed_response.get("OutputShapes")
-        output_sizes = [prod(output_shapes[i]) for i in range(len(output_shapes))]
-
-        # Unpack Output values
-        for i, key in enumerate(parsed_response["Outputs"]):
-            value = parsed_response["Outputs"][key]
-            if output_data_types[i] == 1:
-                parsed_response["Outputs"][key] = list(
-                    struct.unpack("f" * output_sizes[i], value)
-                )
-            elif output_data_types[i] == 3:
-                parsed_response["Outputs"][key] = list(
-                    struct.unpack("b" * output_sizes[i], value)
-                )
+    global frame_counter
+    global last_timed_sample_time
 
-        if logging.getLogger().isEnabledFor(logging.DEBUG):
-            logging.debug("Message " + str(counter) + " parsed")
-            # Use pformat to format the deep object
-            formatted_object = pformat(parsed_response)
-            logging.debug(f"Parsed response:\n\n{formatted_object}\n\n")
+    upload_sample = False
+    frame_counter = frame_counter + 1
 
-        current_time = time.time()
+    logging.debug("Message %d received", frame_counter)
 
-        # Check if auto_generator is True and 60 seconds have passed
-        if auto_generator and current_time - start_time >= auto_generator_every_seconds:
+    # Output values as NumPy arrays, the message itself keeps the raw output bytes
+    outputs = selection_utils.decode_outputs(parsed_response)
 
-            start_time = current_time
-            logging.info(
-                "Add timed sample every "
-                + str(auto_generator_every_seconds)
-                + " seconds number "
-                + str(counter)
-                + " to upload queue"
-            )
+    # Dump the deep objects at DEBUG level, they are only formatted when they are written
+    frame_logger.dump("Parsed response", parsed_response)
+    frame_logger.dump("Outputs", outputs)
+
+    current_time = time.time()
+
+    # Check if auto_generator is True and 60 seconds have passed
+    if auto_generator and current_time - last_timed_sample_time >= auto_generator_every_seconds:
+
+        last_timed_sample_time = current_time
+        logging.debug(
+            "Add timed sample every %d seconds number %d to upload queue",
+            auto_generator_every_seconds,
+            frame_counter,
+        )
+        upload_sample = True
+
+    elif not auto_generator:
+
+        # Capture the frame when a detection of an allowed class has a score within the band
+        selected_classes = selector.select(next(iter(outputs.values())))
+        if len(selected_classes) > 0:
+            logging.debug("Selected for classes: %s", selected_classes)
             upload_sample = True
 
-        elif not auto_generator:
-
-            # Retrieve the bounding box values
-            bbox_values = list(parsed_response["Outputs"].values())[0]
-
-            # Number of elements in each bounding box entry (assuming format: x1, y1, x2, y2, score, class)
-            num_elements_per_entry = 6
-
-            # Extract every 5th out of six values
-            parsed_values = [
-                bbox_values[i]
-                for i in range(4, len(bbox_values), num_elements_per_entry)
-            ]
-
-            # Check if any of the values are below p_value and earmark result for retrieval
-            for value in parsed_values:
-                if value < p_value:
-                    logging.debug("Parsed value: %.8f", value)
-                    upload_sample = True
-
-        if upload_sample:
-            logging.debug("uploading sample")
-            # Parse image information
-            image_header = msgpack.unpackb(image_header)
-
-            # Read image
-            image_data = communication_utils.read_shm(image_header["SHMKey"])
-            with Image.frombytes(
-                "RGB", (image_header["Width"], image_header["Height"]), image_data
-            ) as image:
-                with io.BytesIO() as output:
-                    image.save(output, format="JPEG")
-                    output.seek(0)
-                    samples_buffer.append(output.getvalue())
-            if len(samples_buffer) >= samples_buffer_flush_size:
-                send_samples_buffer()
+    if upload_sample and (scene_gate is not None or duplicate_filter is not None):
+        if not keep_sample(image_header, parsed_response.get("DeviceID")):
+            upload_sample = False
+
+    if upload_sample:
+        logging.debug("uploading sample")
+        # Read the image and queue it for encoding
+        future = encoder.submit(read_rgb_image(image_header))
+        if future is None:
+            logging.info("Encoder is busy, dropping sample. %s", log_utils.Lazy(encoder.metrics))
         else:
-            logging.debug("skipping sample")
-
-        if return_data:
-            # Create msgpack formatted message
-            data_types = parsed_response.get("OutputDataTypes")
-            for key in parsed_response["Outputs"]:
-                value = parsed_response["Outputs"][key]
-                if data_types[0] == 1:
-                    parsed_response["Outputs"][key] = struct.pack(
-                        "f" * len(value), *value
-                    )
-                elif data_types[0] == 3:
-                    parsed_response["Outputs"][key] = struct.pack(
-                        "b" * len(value), *value
-                    )
-            message_bytes = msgpack.packb(parsed_response)
-
-            # Send message back to runtime
-            communication_utils.sendMessageOverConnection(connection, message_bytes)
+            future.add_done_callback(queue_sample)
+    else:
+        logging.debug("skipping sample")
 
 
 if __name__ == "__main__":
     logger = logging.getLogger(__name__)
+    frame_logger = log_utils.FrameLogger(logger)
 
-    config()
+    configuration = processor_utils.read_config(CONFIG_FILE, logger)
+    start_uploads(configuration)
+    config(configuration)
 
     logger.info("Initializing example plugin")
     logging.debug("Input parameters: " + str(sys.argv))
 
-    if edge_impulse_api_key == default_edge_impulse_api_key:
-        logging.error("Edge Impulse Key is not set yet", exc_info=True)
+    # Every backend, Edge Impulse included, must be able to upload before frames are handled
+    if backend is None or uploader is None:
+        logging.error("Could not start uploading samples to the " + upload_backend + " backend, stopping")
+        exit()
+    logging.debug("Uploading samples to " + backend.name)
+    if selector is None or encoder is None:
+        logging.error("Could not apply the configuration, stopping")
         exit()
-    else:
-        logging.debug("Edge Impulse Key: " + edge_impulse_api_key)
-
-    # Parse input arguments
-    if len(sys.argv) > 1:
-        Postprocessor_Socket_Path = sys.argv[1]
-    # Handle interrupt signals
-    signal.signal(signal.SIGTERM, signal_handler)
 
-    # Start program
-    try:
-        main()
-    except Exception as e:
-        logging.error(e, exc_info=True)
+    # Handle frames until the processor is stopped, the outputs are sent back unchanged when return_data is set
+    processor_utils.run_processor(
+        Postprocessor_Socket_Path,
+        process_frame,
+        message_format=processor_utils.MSGPACK,
+        image_header=True,
+        respond=return_data,
+        on_shutdown=[shutdown],
+        config_file=CONFIG_FILE,
+        on_config=config,
+    )
@@ -0,0 +1,100 @@
+import io
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import cloud_utils
+
+# Destinations for the captured samples. Every backend has an `upload(samples)` method that takes
+# a list of (filename, data, metadata) tuples and raises an exception when the batch could not be
+# uploaded, so the uploader can count it as failed or keep it in the spool.
+#
+# Besides Edge Impulse, samples can be written to a local directory or sent to an HTTP server such
+# as ingestion_standin.py, to run and benchmark the postprocessor without an Edge Impulse account.
+
+
+class UploadError(Exception):
+    pass
+
+
+class EdgeImpulseBackend:
+    name = "Edge Impulse"
+
+    def __init__(self, api_key: str):
+        # Imported here, so the other backends work without the Edge Impulse SDK
+        import edgeimpulse
+
+        self.edgeimpulse = edgeimpulse
+        edgeimpulse.API_KEY = api_key
+
+    def upload(self, samples):
+        response = self.edgeimpulse.experimental.data.upload_samples(
+            [
+                self.edgeimpulse.experimental.data.Sample(filename=filename, data=io.BytesIO(data), metadata=metadata)
+                for filename, data, metadata in samples
+            ]
+        )
+        # Check to make sure there were no failures
+        if len(response.fails) != 0:
+            raise UploadError("Could not upload " + str(len(response.fails)) + " of " + str(len(samples)) + " files")
+
+
+class DirectoryBackend:
+    name = "directory"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def upload(self, samples):
+        for filename, data, metadata in samples:
+            path = os.path.join(self.directory, filename)
+            # Written under a temporary name first, so a reader of the directory never sees half a file
+            with open(path + ".tmp", "wb") as file:
+                file.write(data)
+            os.replace(path + ".tmp", path)
+            if metadata:
+                with open(path + ".json", "w") as file:
+                    json.dump(metadata, file)
+
+
+class HTTPBackend:
+    """
+    Sends every sample in a POST request to `<url>/api/<category>/data`, with the file name, the
+    API key and the metadata in headers, the form the Edge Impulse ingestion service accepts for
+    single files. The samples of a batch are sent concurrently over a pool of `max_connections`
+    keep-alive connections.
+    """
+
+    name = "HTTP"
+
+    def __init__(self, url: str, api_key: str = "", category: str = "training", max_connections: int = 2, timeout_seconds: float = 10.0):
+        self.api_key = api_key
+        self.path = "/api/" + category + "/data"
+        self.pool = cloud_utils.HTTPConnectionPool(url, max_connections=max_connections, timeout_seconds=timeout_seconds)
+        self._executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="http-upload")
+
+    def upload(self, samples):
+        # Raises the error of the first sample that failed
+        list(self._executor.map(self._send, samples))
+
+    def _send(self, sample):
+        filename, data, metadata = sample
+        headers = {
+            "Content-Type": "image/jpeg",
+            "x-api-key": self.api_key,
+            "x-file-name": filename,
+            "x-metadata": json.dumps(metadata),
+        }
+        self.pool.request("POST", self.path, data, headers)
+
+
+def create_backend(backend: str, api_key: str = "", directory: str = "", url: str = "", max_connections: int = 2):
+    # The backend by its name in the configuration file
+    if backend == "edgeimpulse":
+        return EdgeImpulseBackend(api_key)
+    if backend == "directory":
+        return DirectoryBackend(directory)
+    if backend == "http":
+        return HTTPBackend(url, api_key=api_key, max_connections=max_connections)
+    raise ValueError("Unknown upload backend: " + backend)
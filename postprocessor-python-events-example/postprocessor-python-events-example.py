@@ -1,15 +1,16 @@
 import os
 import sys
-import socket
-import signal
 import logging
 import logging.handlers
-import configparser
 
 # Add the nxai-utilities python utilities
 script_location = os.path.dirname(sys.argv[0])
 sys.path.append(os.path.join(script_location, "../nxai-utilities/python-utilities"))
-import communication_utils
+sys.path.append(os.path.join(script_location, "../python-utilities"))
+import config_utils
+import event_utils
+import log_utils
+import processor_utils
 
 
 CONFIG_FILE = os.path.join(script_location, "..", "etc", "plugin.events.ini")
@@ -37,6 +38,12 @@ Postprocessor_Name = "Python-Events-Example-Postprocessor"
 # But it can be manually defined as well, as long as it is the same as the socket path in the runtime settings
 Postprocessor_Socket_Path = "/tmp/python-events-example-postprocessor.sock"
 
+# Decides per camera when the example event is added, so it is not added to every frame
+event_engine = event_utils.EventEngine()
+
+# The [events] settings the event engine was created with
+event_settings = None
+
 # Data Types
 # 1:  //FLOAT
 # 2:  //UINT8
@@ -52,72 +59,45 @@ Postprocessor_Socket_Path = "/tmp/python-events-example-postprocessor.sock"
 # 13: //UINT64
 
 
-def config():
-    logger.info("Reading configuration from:" + CONFIG_FILE)
+def config(configuration):
+    # Called with the configuration at startup and again whenever the configuration file changes
+    global event_engine
+    global event_settings
 
     try:
-        configuration = configparser.ConfigParser()
-        configuration.read(CONFIG_FILE)
-
-        configured_log_level = configuration.get("common", "debug_level", fallback="INFO")
-        set_log_level(configured_log_level)
-
-        for section in configuration.sections():
-            logger.info("config section: " + section)
-            for key in configuration[section]:
-                logger.info("config key: " + key + " = " + configuration[section][key])
-
-    except Exception as e:
-        logger.error(e, exc_info=True)
-
-    logger.debug("Read configuration done")
-
-
-def set_log_level(level):
-    try:
-        logger.setLevel(level)
+        # A new engine forgets the state of the events, so it is only created when its settings change
+        new_event_settings = config_utils.section_items(configuration, "events")
+        if new_event_settings == event_settings:
+            return
+        new_event_engine = event_utils.EventEngine(
+            cooldown_seconds=configuration.getfloat("events", "cooldown_seconds", fallback=10.0),
+            hits_required=configuration.getint("events", "hits_required", fallback=1),
+            window=configuration.getint("events", "window", fallback=1),
+            change_only=configuration.getboolean("events", "change_only", fallback=False),
+        )
     except Exception as e:
-        logger.error(e, exc_info=True)
+        logger.error("Keeping the previous configuration: " + str(e), exc_info=True)
+        return
 
+    # The settings are only recorded once the engine exists, so a failed configuration is tried again
+    event_engine, event_settings = new_event_engine, new_event_settings
 
-def signal_handler(sig, _):
-    logger.info("Received interrupt signal: " + str(sig))
-    sys.exit(0)
 
+def process_frame(input_object):
+    # Dump the deep object at DEBUG level, it is only formatted when it is written
+    frame_logger.dump("Unpacked", input_object)
 
-def main():
-    # Start socket listener to receive messages from NXAI runtime
-    server = communication_utils.startUnixSocketServer(Postprocessor_Socket_Path)
+    description_string = "\nThere are no objects in the frame."
+    objects_detected = False
+    if "BBoxes_xyxy" in input_object:
+        for class_name, class_coordinates in input_object["BBoxes_xyxy"].items():
+            if objects_detected is False and len(class_coordinates) > 0:
+                description_string = "\nThere are"
+                objects_detected = True
+            description_string += " " + str(int(len(class_coordinates) / 4)) + " " + class_name + "'s in the frame"
 
-    # Wait for messages in a loop
-    while True:
-        # Wait for input message from runtime
-        logger.debug("Waiting for input message")
-
-        try:
-            input_message, connection = communication_utils.waitForSocketMessage(server)
-            logger.debug("Received input message")
-        except socket.timeout:
-            # Request timed out. Continue waiting
-            continue
-
-        # Parse input message
-        input_object = communication_utils.parseInferenceResults(input_message)
-
-        # Use pformat to format the deep object
-        # formatted_unpacked_object = pformat(input_object)
-        # logging.debug(f'Unpacked:\n\n{formatted_unpacked_object}\n\n')
-
-        description_string = "\nThere are no objects in the frame."
-        objects_detected = False
-        if "BBoxes_xyxy" in input_object:
-            for class_name, class_coordinates in input_object["BBoxes_xyxy"].items():
-                if objects_detected is False and len(class_coordinates) > 0:
-                    description_string = "\nThere are"
-                    objects_detected = True
-                description_string += " " + str(int(len(class_coordinates) / 4)) + " " + class_name + "'s in the frame"
-
-        # Add event to output
+    # Add event to output when the description changed, or the cooldown has passed
+    if event_engine.update(input_object.get("DeviceID"), "ex.example.event", True, state=description_string):
         if "Events" not in input_object:
             input_object["Events"] = []
         input_object["Events"].append(
@@ -128,40 +108,19 @@ def main():
             }
         )
 
-        logger.info("Added test event to output")
-
-        # Write object back to string
-        output_message = communication_utils.writeInferenceResults(input_object)
-
-        # Send message back to runtime
-        communication_utils.sendMessageOverConnection(connection, output_message)
+        logger.debug("Added test event to output")
 
 
 if __name__ == "__main__":
     ## initialize the logger
     logger = logging.getLogger(__name__)
+    frame_logger = log_utils.FrameLogger(logger)
 
     ## read configuration file if it's available
-    config()
+    config(processor_utils.read_config(CONFIG_FILE, logger))
 
     logger.info("Initializing example plugin")
     logger.debug("Input parameters: " + str(sys.argv))
 
-    # Parse input arguments
-    if len(sys.argv) > 1:
-        Postprocessor_Socket_Path = sys.argv[1]
-    # Handle interrupt signals
-    signal.signal(signal.SIGTERM, signal_handler)
-    # Start program
-    try:
-        main()
-    except Exception as e:
-        logger.error(e, exc_info=True)
-    except KeyboardInterrupt:
-        logger.info("Exited with keyboard interrupt")
-
-    try:
-        os.unlink(Postprocessor_Socket_Path)
-    except OSError:
-        if os.path.exists(Postprocessor_Socket_Path):
-            logger.error("Could not remove socket file: " + Postprocessor_Socket_Path)
+    # Handle frames until the processor is stopped, the socket path is given as the first argument
+    processor_utils.run_processor(Postprocessor_Socket_Path, process_frame, config_file=CONFIG_FILE, on_config=config)
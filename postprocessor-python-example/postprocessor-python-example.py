@@ -1,16 +1,14 @@
 import os
 import sys
-import socket
-import signal
 import logging
 import logging.handlers
-import configparser
-from pprint import pformat
 
 # Add the nxai-utilities python utilities
 script_location = os.path.dirname(sys.argv[0])
 sys.path.append(os.path.join(script_location, "../nxai-utilities/python-utilities"))
-import communication_utils
+sys.path.append(os.path.join(script_location, "../python-utilities"))
+import log_utils
+import processor_utils
 
 
 CONFIG_FILE = os.path.join(script_location, "..", "etc", "plugin.example.ini")
@@ -54,78 +52,25 @@ Postprocessor_Socket_Path = "/tmp/python-example-postprocessor.sock"
 
 
 def config():
-    logger.info("Reading configuration from:" + CONFIG_FILE)
+    processor_utils.read_config(CONFIG_FILE, logger)
 
-    try:
-        configuration = configparser.ConfigParser()
-        configuration.read(CONFIG_FILE)
 
-        configured_log_level = configuration.get("common", "debug_level", fallback="INFO")
-        set_log_level(configured_log_level)
+def process_frame(input_object):
+    # Dump the deep object at DEBUG level, it is only formatted when it is written
+    frame_logger.dump("Unpacked", input_object)
 
-        for section in configuration.sections():
-            logger.info("config section: " + section)
-            for key in configuration[section]:
-                logger.info("config key: " + key + " = " + configuration[section][key])
+    # Add extra bbox
+    if "BBoxes_xyxy" not in input_object:
+        input_object["BBoxes_xyxy"] = {}
+    input_object["BBoxes_xyxy"]["test"] = [100.0, 100.0, 400.0, 400.0]
 
-    except Exception as e:
-        logger.error(e, exc_info=True)
-
-    logger.debug("Read configuration done")
-
-
-def set_log_level(level):
-    try:
-        logger.setLevel(logging.DEBUG)
-    except Exception as e:
-        logger.error(e, exc_info=True)
-
-
-def signal_handler(sig, _):
-    logger.info("Received interrupt signal: " + str(sig))
-    sys.exit(0)
-
-
-def main():
-    # Start socket listener to receive messages from NXAI runtime
-    server = communication_utils.startUnixSocketServer(Postprocessor_Socket_Path)
-
-    # Wait for messages in a loop
-    while True:
-        # Wait for input message from runtime
-        logger.debug("Waiting for input message")
-
-        try:
-            input_message, connection = communication_utils.waitForSocketMessage(server)
-            logger.debug("Received input message")
-        except socket.timeout:
-            # Request timed out. Continue waiting
-            continue
-
-        # Parse input message
-        input_object = communication_utils.parseInferenceResults(input_message)
-
-        # Use pformat to format the deep object
-        formatted_unpacked_object = pformat(input_object)
-        print(f"Unpacked:\n\n{formatted_unpacked_object}\n\n")
-
-        # Add extra bbox
-        if "BBoxes_xyxy" not in input_object:
-            input_object["BBoxes_xyxy"] = {}
-        input_object["BBoxes_xyxy"]["test"] = [100.0, 100.0, 400.0, 400.0]
-
-        logger.info("Added test bounding box to output")
-
-        # Write object back to string
-        output_message = communication_utils.writeInferenceResults(input_object)
-
-        # Send message back to runtime
-        communication_utils.sendMessageOverConnection(connection, output_message)
+    logger.debug("Added test bounding box to output")
 
 
 if __name__ == "__main__":
     ## initialize the logger
     logger = logging.getLogger(__name__)
+    frame_logger = log_utils.FrameLogger(logger)
 
     ## read configuration file if it's available
     config()
@@ -133,21 +78,5 @@ if __name__ == "__main__":
     logger.info("Initializing example plugin")
     logger.debug("Input parameters: " + str(sys.argv))
 
-    # Parse input arguments
-    if len(sys.argv) > 1:
-        Postprocessor_Socket_Path = sys.argv[1]
-    # Handle interrupt signals
-    signal.signal(signal.SIGTERM, signal_handler)
-    # Start program
-    try:
-        main()
-    except Exception as e:
-        logger.error(e, exc_info=True)
-    except KeyboardInterrupt:
-        logger.info("Exited with keyboard interrupt")
-
-    try:
-        os.unlink(Postprocessor_Socket_Path)
-    except OSError:
-        if os.path.exists(Postprocessor_Socket_Path):
-            logger.error("Could not remove socket file: " + Postprocessor_Socket_Path)
+    # Handle frames until the processor is stopped, the socket path is given as the first argument
+    processor_utils.run_processor(Postprocessor_Socket_Path, process_frame, config_file=CONFIG_FILE)
@@ -1,16 +1,12 @@
 import os
 import sys
-import socket
-import signal
 import logging
 import logging.handlers
-import configparser
-from pprint import pformat
-import msgpack
 
 # Add the nxai-utilities python utilities
 script_location = os.path.dirname(sys.argv[0])
 sys.path.append(os.path.join(script_location, "../sclbl-utilities/python-utilities"))
+sys.path.append(os.path.join(script_location, "../python-utilities"))
 
 
 CONFIG_FILE = os.path.join(script_location, "..", "etc", "plugin.image.ini")
@@ -25,7 +21,11 @@ logging.basicConfig(
     filemode="w",
 )
 
-import communication_utils
+import image_utils
+import log_utils
+import processor_utils
+import shm_utils
+import statistics_utils
 
 # The name of the postprocessor.
 # This is used to match the definition of the postprocessor with routing.
@@ -36,117 +36,50 @@ Postprocessor_Name = "Python-Image-Example-Postprocessor"
 # But it can be manually defined as well, as long as it is the same as the socket path in the runtime settings
 Postprocessor_Socket_Path = "/tmp/python-image-postprocessor.sock"
 
+# Computes the statistics of the input image in one vectorized pass, the histograms are not
+# part of the output so their pass over the image is skipped
+image_statistics = statistics_utils.ImageStatistics(histogram_bins=0)
 
-def parse_image_from_shm(shm_key: int, width: int, height: int, channels: int):
-    image_data = communication_utils.read_shm(shm_key)
 
-    cumulative = 0
-    for b in image_data:
-        cumulative += b
+def parse_image_from_shm(shm_key: int, width: int, height: int, channels: int):
+    # The image is read in place, the view on the segment is released when the function returns
+    with shm_utils.attach(shm_key) as image_data:
+        statistics = image_statistics.compute(image_utils.image_view(image_data, width, height, channels))
 
-    return cumulative
+    return statistics
 
 
 def config():
-    logger.info("Reading configuration from:" + CONFIG_FILE)
-
-    try:
-        configuration = configparser.ConfigParser()
-        configuration.read(CONFIG_FILE)
-
-        configured_log_level = configuration.get(
-            "common", "debug_level", fallback="INFO"
-        )
-        set_log_level(configured_log_level)
-
-        for section in configuration.sections():
-            logger.info("config section: " + section)
-            for key in configuration[section]:
-                logger.info("config key: " + key + " = " + configuration[section][key])
-
-    except Exception as e:
-        logger.error(e, exc_info=True)
-
-    logger.debug("Read configuration done")
-
-
-def set_log_level(level):
-    try:
-        logger.setLevel(level)
-    except Exception as e:
-        logger.error(e, exc_info=True)
-
-
-def signal_handler(sig, _):
-    logger.info("Received interrupt signal: " + str(sig))
-    sys.exit(0)
-
-
-def main():
-    # Start socket listener to receive messages from NXAI runtime
-    server = communication_utils.startUnixSocketServer(Postprocessor_Socket_Path)
-    # Wait for messages in a loop
-    while True:
-        # Wait for input message from runtime
-        logger.debug("Waiting for input message")
-
-        try:
-            input_message, connection = communication_utils.waitForSocketMessage(server)
-            logger.debug("Received input message")
-            formatted_input_message = pformat(input_message)
-            logger.debug(f"Input message: :\n\n{formatted_input_message}\n\n")
-
-        except socket.timeout:
-            # Request timed out. Continue waiting
-            continue
-
-        # Since we're also expecting an image, receive the image header
-        try:
-            image_header = communication_utils.receiveMessageOverConnection(connection)
-        except socket.timeout:
-            # Did not receive image header
-            logger.debug("Did not receive image header. Are the settings correct?")
-            continue
-
-        # Parse input message
-        input_object = communication_utils.parseInferenceResults(input_message)
-        formatted_unpacked_object = pformat(input_object)
-        logger.info(f"Unpacked input image:\n\n{formatted_unpacked_object}\n\n")
-
-        image_header = msgpack.unpackb(image_header)
-        formatted_image_object = pformat(image_header)
-        logger.debug(f"Image header:\n\n{formatted_image_object}\n\n")
+    processor_utils.read_config(CONFIG_FILE, logger)
 
-        cumulative = parse_image_from_shm(
-            image_header["SHMKey"],
-            image_header["Width"],
-            image_header["Height"],
-            image_header["Channels"],
-        )
 
-        # Add extra bbox
-        if "BBoxes_xyxy" not in input_object:
-            input_object["BBoxes_xyxy"] = {}
-        input_object["BBoxes_xyxy"]["test"] = [100.0, 100.0, 200.0, 200.0]
+def process_frame(input_object, image_header):
+    # Dump the deep objects at DEBUG level, they are only formatted when they are written
+    frame_logger.dump("Unpacked input image", input_object)
+    frame_logger.dump("Image header", image_header)
 
-        # Add Counts
-        if "Counts" not in input_object:
-            input_object["Counts"] = {}
-        input_object["Counts"]["ImageBytesCumulative"] = cumulative
+    statistics = parse_image_from_shm(
+        image_header["SHMKey"],
+        image_header["Width"],
+        image_header["Height"],
+        image_header["Channels"],
+    )
 
-        formatted_packed_object = pformat(input_object)
-        logger.info(f"Returning packed object:\n\n{formatted_packed_object}\n\n")
+    # Add extra bbox
+    if "BBoxes_xyxy" not in input_object:
+        input_object["BBoxes_xyxy"] = {}
+    input_object["BBoxes_xyxy"]["test"] = [100.0, 100.0, 200.0, 200.0]
 
-        # Write object back to string
-        output_message = communication_utils.writeInferenceResults(input_object)
+    # Add the image statistics to the Counts and Scores
+    statistics_utils.add_to_output(input_object, statistics)
 
-        # Send message back to runtime
-        communication_utils.sendMessageOverConnection(connection, output_message)
+    frame_logger.dump("Returning packed object", input_object)
 
 
 if __name__ == "__main__":
     ## initialize the logger
     logger = logging.getLogger(__name__)
+    frame_logger = log_utils.FrameLogger(logger)
 
     ## read configuration file if it's available
     config()
@@ -154,13 +87,5 @@ if __name__ == "__main__":
     logger.info("Initializing image plugin")
     logger.debug("Input parameters: " + str(sys.argv))
 
-    # Parse input arguments
-    if len(sys.argv) > 1:
-        Postprocessor_Socket_Path = sys.argv[1]
-    # Handle interrupt signals
-    signal.signal(signal.SIGTERM, signal_handler)
-    # Start program
-    try:
-        main()
-    except Exception as e:
-        logging.error(e, exc_info=True)
+    # Handle frames until the processor is stopped, the image header follows every message
+    processor_utils.run_processor(Postprocessor_Socket_Path, process_frame, image_header=True, config_file=CONFIG_FILE)
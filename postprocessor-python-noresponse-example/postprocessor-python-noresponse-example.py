@@ -1,16 +1,14 @@
 import os
 import sys
-import socket
-import signal
 import logging
 import logging.handlers
-import configparser
-from pprint import pformat
 
 # Add the nxai-utilities python utilities
 script_location = os.path.dirname(sys.argv[0])
 sys.path.append(os.path.join(script_location, "../nxai-utilities/python-utilities"))
-import communication_utils
+sys.path.append(os.path.join(script_location, "../python-utilities"))
+import log_utils
+import processor_utils
 
 
 CONFIG_FILE = os.path.join(script_location, "..", "etc", "plugin.noresponse.ini")
@@ -51,69 +49,17 @@ Postprocessor_Socket_Path = "/tmp/python-noresponse-postprocessor.sock"
 
 
 def config():
-    logger.info("Reading configuration from:" + CONFIG_FILE)
+    processor_utils.read_config(CONFIG_FILE, logger)
 
-    try:
-        configuration = configparser.ConfigParser()
-        configuration.read(CONFIG_FILE)
 
-        configured_log_level = configuration.get(
-            "common", "debug_level", fallback="INFO"
-        )
-        set_log_level(configured_log_level)
-
-        for section in configuration.sections():
-            logger.info("config section: " + section)
-            for key in configuration[section]:
-                logger.info("config key: " + key + " = " + configuration[section][key])
-
-    except Exception as e:
-        logger.error(e, exc_info=True)
-
-    logger.debug("Read configuration done")
-
-
-def set_log_level(level):
-    try:
-        logger.setLevel(level)
-    except Exception as e:
-        logger.error(e, exc_info=True)
-
-
-def signal_handler(sig, _):
-    logging.debug("Received interrupt signal: " + str(sig))
-    sys.exit(0)
-
-
-def main():
-    # Start socket listener to receive messages from NXAI runtime
-    server = communication_utils.startUnixSocketServer(Postprocessor_Socket_Path)
-
-    logging.debug("Starting main" + str(Postprocessor_Socket_Path))
-    # Wait for messages in a loop
-    while True:
-        # Wait for input message from runtime
-        logging.debug("Starting loop")
-
-        try:
-            input_message, _ = communication_utils.waitForSocketMessage(server)
-            logging.debug("Received input message")
-            formatted_input_message = pformat(input_message)
-            logger.debug(f"Input message: :\n\n{formatted_input_message}\n\n")
-        except socket.timeout:
-            # Request timed out. Continue waiting
-            continue
-
-        # Parse input message
-        input_object = communication_utils.parseInferenceResults(input_message)
-
-        formatted_unpacked_object = pformat(input_object)
-        logging.info(f"Unpacked object:\n\n{formatted_unpacked_object}\n\n")
+def process_frame(input_object):
+    frame_logger.dump("Unpacked object", input_object)
 
 
 if __name__ == "__main__":
     ## initialize the logger
     logger = logging.getLogger(__name__)
+    frame_logger = log_utils.FrameLogger(logger)
 
     ## read configuration file if it's available
     config()
@@ -121,14 +67,5 @@ if __name__ == "__main__":
     logger.info("Initializing noresponse plugin")
     logger.debug("Input parameters: " + str(sys.argv))
 
-    # Parse input arguments
-    if len(sys.argv) > 1:
-        Postprocessor_Socket_Path = sys.argv[1]
-    # Handle interrupt signals
-    signal.signal(signal.SIGTERM, signal_handler)
-
-    # Start program
-    try:
-        main()
-    except Exception as e:
-        logging.error(e, exc_info=True)
+    # Handle frames until the processor is stopped, nothing is sent back to the AI Manager
+    processor_utils.run_processor(Postprocessor_Socket_Path, process_frame, respond=False, config_file=CONFIG_FILE)
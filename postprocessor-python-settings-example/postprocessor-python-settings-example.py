@@ -1,16 +1,14 @@
 import os
 import sys
-import socket
-import signal
 import logging
 import logging.handlers
-import configparser
-from pprint import pformat
 
 # Add the nxai-utilities python utilities
 script_location = os.path.dirname(sys.argv[0])
 sys.path.append(os.path.join(script_location, "../nxai-utilities/python-utilities"))
-import communication_utils
+sys.path.append(os.path.join(script_location, "../python-utilities"))
+import log_utils
+import processor_utils
 
 
 CONFIG_FILE = os.path.join(script_location, "..", "etc", "plugin.settings.ini")
@@ -54,86 +52,31 @@ Postprocessor_Socket_Path = "/tmp/python-example-settings-postprocessor.sock"
 
 
 def config():
-    logger.info("Reading configuration from:" + CONFIG_FILE)
+    processor_utils.read_config(CONFIG_FILE, logger)
 
-    try:
-        configuration = configparser.ConfigParser()
-        configuration.read(CONFIG_FILE)
 
-        configured_log_level = configuration.get("common", "debug_level", fallback="INFO")
-        set_log_level(configured_log_level)
+def process_frame(input_object):
+    # Dump the deep object at DEBUG level, it is only formatted when it is written
+    frame_logger.dump("Unpacked", input_object)
 
-        for section in configuration.sections():
-            logger.info("config section: " + section)
-            for key in configuration[section]:
-                logger.info("config key: " + key + " = " + configuration[section][key])
+    # Read the settings passed through from the AI Manager and add them as attributes
+    for _, class_data in input_object["ObjectsMetaData"].items():
+        for object_index in range(len(class_data["AttributeKeys"])):
+            for setting_name, setting_value in input_object["ExternalProcessorSettings"].items():
+                if setting_name == "externalprocessor.attributeName":
+                    class_data["AttributeKeys"][object_index].append(setting_value)
+                if setting_name == "externalprocessor.attributeValue":
+                    class_data["AttributeValues"][object_index].append(setting_value)
 
-    except Exception as e:
-        logger.error(e, exc_info=True)
+    frame_logger.dump("Packing", input_object)
 
-    logger.debug("Read configuration done")
-
-
-def set_log_level(level):
-    try:
-        logger.setLevel(level)
-    except Exception as e:
-        logger.error(e, exc_info=True)
-
-
-def signal_handler(sig, _):
-    logger.info("Received interrupt signal: " + str(sig))
-    sys.exit(0)
-
-
-def main():
-    # Start socket listener to receive messages from NXAI runtime
-    logger.debug("Creating socket at " + Postprocessor_Socket_Path)
-    server = communication_utils.startUnixSocketServer(Postprocessor_Socket_Path)
-
-    # Wait for messages in a loop
-    while True:
-        # Wait for input message from runtime
-        logger.debug("Waiting for input message")
-
-        try:
-            input_message, connection = communication_utils.waitForSocketMessage(server)
-            logger.debug("Received input message")
-        except socket.timeout:
-            # Request timed out. Continue waiting
-            continue
-
-        # Parse input message
-        input_object = communication_utils.parseInferenceResults(input_message)
-
-        # Use pformat to format the deep object
-        formatted_unpacked_object = pformat(input_object)
-        logging.info(f"Unpacked:\n\n{formatted_unpacked_object}\n\n")
-
-        # Read the settings passed through from the AI Manager and add them as attributes
-        for _, class_data in input_object["ObjectsMetaData"].items():
-            for object_index in range(len(class_data["AttributeKeys"])):
-                for setting_name, setting_value in input_object["ExternalProcessorSettings"].items():
-                    if setting_name == "externalprocessor.attributeName":
-                        class_data["AttributeKeys"][object_index].append(setting_value)
-                    if setting_name == "externalprocessor.attributeValue":
-                        class_data["AttributeValues"][object_index].append(setting_value)
-
-        formatted_unpacked_object = pformat(input_object)
-        logging.info(f"Packing:\n\n{formatted_unpacked_object}\n\n")
-
-        logger.info("Added attributes to all objects.")
-
-        # Write object back to string
-        output_message = communication_utils.writeInferenceResults(input_object)
-
-        # Send message back to runtime
-        communication_utils.sendMessageOverConnection(connection, output_message)
+    logger.debug("Added attributes to all objects.")
 
 
 if __name__ == "__main__":
     ## initialize the logger
     logger = logging.getLogger(__name__)
+    frame_logger = log_utils.FrameLogger(logger)
 
     logger.info("Location: " + str(script_location))
 
@@ -143,21 +86,5 @@ if __name__ == "__main__":
     logger.info("Initializing example plugin")
     logger.debug("Input parameters: " + str(sys.argv))
 
-    # Parse input arguments
-    if len(sys.argv) > 1:
-        Postprocessor_Socket_Path = sys.argv[1]
-    # Handle interrupt signals
-    signal.signal(signal.SIGTERM, signal_handler)
-    # Start program
-    try:
-        main()
-    except Exception as e:
-        logger.error(e, exc_info=True)
-    except KeyboardInterrupt:
-        logger.info("Exited with keyboard interrupt")
-
-    try:
-        os.unlink(Postprocessor_Socket_Path)
-    except OSError:
-        if os.path.exists(Postprocessor_Socket_Path):
-            logger.error("Could not remove socket file: " + Postprocessor_Socket_Path)
+    # Handle frames until the processor is stopped, the socket path is given as the first argument
+    processor_utils.run_processor(Postprocessor_Socket_Path, process_frame, config_file=CONFIG_FILE)
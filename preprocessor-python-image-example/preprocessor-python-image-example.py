@@ -1,16 +1,17 @@
 import os
 import sys
-import socket
-import signal
-import msgpack
 import logging
 import logging.handlers
-import configparser
 
 # Add the nxai-utilities python utilities
 script_location = os.path.dirname(sys.argv[0])
 sys.path.append(os.path.join(script_location, "../nxai-utilities/python-utilities"))
-import communication_utils
+sys.path.append(os.path.join(script_location, "../python-utilities"))
+import image_utils
+import log_utils
+import processor_utils
+import resize_utils
+import shm_utils
 
 CONFIG_FILE = os.path.join(script_location, "..", "etc", "plugin.image.pre.ini")
 
@@ -37,122 +38,139 @@ Preprocessor_Socket_Path = "/tmp/example-image-preprocessor.sock"
 global output_shm
 output_shm = None
 
+# Tracks the created SHM segments so they are removed even if the process does not exit cleanly
+shm_manager = None
 
-def parseImageFromSHM(shm_key: int, width: int, height: int, channels: int, external_settings: dict):
-    global output_shm
-    if output_shm is None:
-        # Can reuse SHM ( if data is smaller or equal size ) or create new SHM and return ID
-        input_image_size = width * height * channels
-        output_shm = communication_utils.create_shm(input_image_size)
-        print("EXAMPLE PLUGIN Created shm ID: ", output_shm.id, "Size:", output_shm.size)
+# Optional resize of the output image, configured in the [resize] section of the configuration file
+resize_width = 0
+resize_height = 0
+resizer = None
 
-    # Read image data from the shared memory
-    image_data = communication_utils.read_shm(shm_key)
+# Splits the image operations in row tiles, the number of threads is set in the [image] section
+executor = image_utils.TiledExecutor(threads=1)
 
-    # Check settings if image should be mirrored
-    mirror_image = True
-    if "externalprocessor.mirrorimage" in external_settings:
-        mirror_image = external_settings["externalprocessor.mirrorimage"] == "true"
 
+def transformImage(image_data, width: int, height: int, channels: int, mirror_image: bool):
+    global output_shm
+    input_image = image_utils.image_view(image_data, width, height, channels)
     if mirror_image is True:
-        # Create new output image
-        output_image = bytearray(len(image_data))
-        new_width = int(width / 2)
-        new_height = int(height / 2)
-        # Mirror and downscale image
-        for h_key in range(0, height, 2):
-            for w_key in range(0, width, 2):
-                output_pixel_index = int(((h_key * width / 4) * channels) + ((w_key / 2) * channels))
-                input_pixel_index = (h_key * width * channels) + ((width - w_key) * channels)
-                output_image[output_pixel_index : output_pixel_index + channels] = image_data[input_pixel_index : input_pixel_index + channels]
+        input_image = image_utils.mirror(input_image)
+
+    if resizer is not None:
+        new_width = resize_width
+        new_height = resize_height
+    elif mirror_image is True:
+        new_width = width // 2
+        new_height = height // 2
     else:
-        # Return unmodified iamge
-        output_image = image_data
         new_width = width
         new_height = height
 
-    # Write un/modified image to shared memory
-    communication_utils.write_shm(output_shm, output_image)
-
-    return output_shm.id, new_width, new_height, channels
-
+    # Geometry of the resized image within the output, None when the image is not resized
+    geometry = None
 
-def main():
-    # Start socket listener to receive messages from NXAI runtime
-    server = communication_utils.startUnixSocketServer(Preprocessor_Socket_Path)
-    # Wait for messages in a loop
-    while True:
-        # Wait for input message from runtime
-        try:
-            input_message, connection = communication_utils.waitForSocketMessage(server)
-        except socket.timeout:
-            # Request timed out. Continue waiting
-            continue
-
-        image_header = msgpack.unpackb(input_message)
-        print("EXAMPLE PREPROCESSOR: Received input message: ", image_header)
+    # Can reuse SHM ( if data is smaller or equal size ) or create new SHM and return ID
+    output_image_size = new_width * new_height * channels
+    if output_shm is None or output_shm.size < output_image_size:
+        output_shm = shm_manager.ensure_size(output_shm, output_image_size)
+        print("EXAMPLE PLUGIN Created shm ID: ", output_shm.id, "Size:", output_shm.size)
+        logger.debug("SHM in use: %s", log_utils.Lazy(shm_manager.metrics))
+
+    # Write un/modified image directly to shared memory
+    output_image = image_utils.output_view(shm_utils.as_array(output_shm), (new_height, new_width, channels))
+    if resizer is not None:
+        # Resize to the configured size, the geometry maps boxes back to the original image
+        _, geometry = resizer.resize(input_image, new_width, new_height, out=output_image, executor=executor)
+    elif mirror_image is True:
+        # Mirror and downscale image
+        executor.store(image_utils.decimate(input_image, 2), output_image)
+    else:
+        # Return unmodified iamge
+        executor.store(input_image, output_image)
 
-        external_settings = {}
-        if "ExternalProcessorSettings" in image_header:
-            logger.info("Got settings: " + str(image_header["ExternalProcessorSettings"]))
-            external_settings = image_header["ExternalProcessorSettings"]
+    return new_width, new_height, geometry
 
-        # Process image
-        output_shm_id, width, height, channels = parseImageFromSHM(
-            image_header["SHMKey"],
-            image_header["Width"],
-            image_header["Height"],
-            image_header["Channels"],
-            external_settings,
-        )
 
-        image_header["SHMID"] = output_shm_id
-        image_header["Width"] = width
-        image_header["Height"] = height
-        image_header["Channels"] = channels
+def parseImageFromSHM(shm_key: int, width: int, height: int, channels: int, external_settings: dict):
+    # Check settings if image should be mirrored
+    mirror_image = True
+    if "externalprocessor.mirrorimage" in external_settings:
+        mirror_image = external_settings["externalprocessor.mirrorimage"] == "true"
 
-        # Write header to respond
-        output_message = msgpack.packb(image_header)
+    # Read image data from the shared memory, without copying it
+    with shm_utils.attach(shm_key) as image_data:
+        new_width, new_height, geometry = transformImage(image_data, width, height, channels, mirror_image)
 
-        # Send message back to runtime
-        communication_utils.sendMessageOverConnection(connection, output_message)
+    return output_shm.id, new_width, new_height, channels, geometry
 
 
-def signalHandler(sig, _):
-    print("EXAMPLE PREPROCESSOR: Received interrupt signal: ", sig)
-    # Detach and destroy output shm
-    if output_shm is not None:
-        output_shm.detach()
-        output_shm.remove()
-    sys.exit(0)
+def process_header(image_header):
+    frame_logger.dump("Received input message", image_header)
 
+    external_settings = {}
+    if "ExternalProcessorSettings" in image_header:
+        frame_logger.dump("Got settings", image_header["ExternalProcessorSettings"])
+        external_settings = image_header["ExternalProcessorSettings"]
 
-def config():
-    logger.info("Reading configuration from:" + CONFIG_FILE)
+    # Process image
+    output_shm_id, width, height, channels, geometry = parseImageFromSHM(
+        image_header["SHMKey"],
+        image_header["Width"],
+        image_header["Height"],
+        image_header["Channels"],
+        external_settings,
+    )
 
-    try:
-        configuration = configparser.ConfigParser()
-        configuration.read(CONFIG_FILE)
+    image_header["SHMID"] = output_shm_id
+    image_header["Width"] = width
+    image_header["Height"] = height
+    image_header["Channels"] = channels
+    if geometry is not None:
+        # Scale and offset of the resized image, a postprocessor maps its boxes back to the source image with them
+        image_header.update(geometry.to_header())
 
-        configured_log_level = configuration.get("common", "debug_level", fallback="INFO")
-        set_log_level(configured_log_level)
 
-        for section in configuration.sections():
-            logger.info("config section: " + section)
-            for key in configuration[section]:
-                logger.info("config key: " + key + " = " + configuration[section][key])
+def shutdown():
+    # Detach and destroy all created shm
+    shm_manager.release_all()
+    executor.shutdown()
 
-    except Exception as e:
-        logger.error(e, exc_info=True)
 
-    logger.debug("Read configuration done")
+def config(configuration):
+    # Called with the configuration at startup and again whenever the configuration file changes.
+    # All settings are read before any of them is applied, so a configuration with an error leaves
+    # the previous configuration in place.
 
+    global resize_width
+    global resize_height
+    global resizer
+    global executor
 
-def set_log_level(level):
     try:
-        logger.setLevel(level)
+        threads = configuration.getint("image", "threads", fallback=1)
+        new_resize_width = configuration.getint("resize", "width", fallback=0)
+        new_resize_height = configuration.getint("resize", "height", fallback=0)
+        new_resizer = None
+        if new_resize_width > 0 and new_resize_height > 0:
+            new_resizer = resize_utils.Resizer(
+                mode=configuration.get("resize", "interpolation", fallback=resize_utils.BILINEAR),
+                letterbox=configuration.getboolean("resize", "letterbox", fallback=False),
+                pad_value=configuration.getint("resize", "pad_value", fallback=0),
+            )
+        # The executor starts threads, so it is created last, when everything else is valid
+        new_executor = executor
+        if threads != executor.threads:
+            new_executor = image_utils.TiledExecutor(threads=threads)
+
     except Exception as e:
-        logger.error(e, exc_info=True)
+        logger.error("Keeping the previous configuration: " + str(e), exc_info=True)
+        return
+
+    previous_executor = executor
+    resize_width, resize_height, resizer = new_resize_width, new_resize_height, new_resizer
+    executor = new_executor
+    if previous_executor is not executor:
+        previous_executor.shutdown()
 
 
 if __name__ == "__main__":
@@ -160,27 +178,27 @@ if __name__ == "__main__":
     # Parse input arguments
     if len(sys.argv) > 1:
         Preprocessor_Socket_Path = sys.argv[1]
-    # Handle interrupt signals
-    signal.signal(signal.SIGTERM, signalHandler)
 
     ## initialize the logger
     logger = logging.getLogger(__name__)
+    frame_logger = log_utils.FrameLogger(logger)
 
     ## read configuration file if it's available
-    config()
+    config(processor_utils.read_config(CONFIG_FILE, logger))
+
+    # Remove SHM segments leaked by a previous instance of this preprocessor
+    shm_manager = shm_utils.SHMLifecycleManager(Preprocessor_Socket_Path + ".shm")
+    shm_manager.reap()
 
     logger.info("Initializing example plugin")
     logger.debug("Input parameters: " + str(sys.argv))
 
-    try:
-        main()
-    except Exception as e:
-        logger.error(e, exc_info=True)
-    except KeyboardInterrupt:
-        logger.info("Exited with keyboard interrupt")
-
-    try:
-        os.unlink(Preprocessor_Socket_Path)
-    except OSError:
-        if os.path.exists(Preprocessor_Socket_Path):
-            logger.error("Could not remove socket file: " + Preprocessor_Socket_Path)
+    # Handle frames until the processor is stopped, then detach and destroy all created shm
+    processor_utils.run_processor(
+        Preprocessor_Socket_Path,
+        process_header,
+        message_format=processor_utils.MSGPACK,
+        on_shutdown=[shutdown],
+        config_file=CONFIG_FILE,
+        on_config=config,
+    )
@@ -1,17 +1,17 @@
 import os
 import sys
-import socket
-import signal
 import logging
 import logging.handlers
-import msgpack
-import configparser
 import struct
 
 # Add the nxai-utilities python utilities
 script_location = os.path.dirname(sys.argv[0])
 sys.path.append(os.path.join(script_location, "../nxai-utilities/python-utilities"))
-import communication_utils
+sys.path.append(os.path.join(script_location, "../python-utilities"))
+import log_utils
+import processor_utils
+import shm_utils
+import tensor_utils
 
 CONFIG_FILE = os.path.join(script_location, "..", "etc", "plugin.tensor.pre.ini")
 
@@ -34,21 +34,17 @@ logging.basicConfig(
 # But it can be manually defined as well, as long as it is the same as the socket path in the runtime settings
 Preprocessor_Socket_Path = "/tmp/python-tensor-example-preprocessor.sock"
 
-# Define a single SHM object to share images back to AI Manager
-global output_shm
-output_shm = None
+# Tracks the created SHM segments so they are removed even if the process does not exit cleanly
+shm_manager = None
+
+# Writes the input tensors to the output segment with the NMS setting replaced, without decoding them
+tensor_patcher = None
 
 
 def parseTensorFromSHM(shm_key: int, external_settings: dict):
 
     ######### Get input tensor from SHM
-    logger.info("Got shm key: " + str(shm_key))
-    tensor_raw_data = communication_utils.read_shm(shm_key)
-    tensor_data = msgpack.unpackb(tensor_raw_data)
-
-    if tensor_data is None or isinstance(tensor_data, dict) == False or "Tensors" not in tensor_data:
-        logger.error("Invalid input tensor received. Ignoring.")
-        return 0
+    logger.debug("Got shm key: %s", shm_key)
 
     ######## Get nms setting ( if any )
 
@@ -59,98 +55,33 @@ def parseTensorFromSHM(shm_key: int, external_settings: dict):
         except:
             pass
 
-    ######## Modify tensor as example
-
-    for tensor_name, _ in tensor_data["Tensors"].items():
-        logger.info("Got tensor name: " + str(tensor_name))
-        if tensor_name == "nms_sensitivity-":
-            # Set nms to new_nms_value
-            tensor_data["Tensors"][tensor_name] = struct.pack("f", new_nms_value)
-
-    ######## Write modified tensor to SHM
-
-    output_data = msgpack.packb(tensor_data)
-
-    global output_shm
-    if output_shm is None:
-        # Can reuse SHM ( if data is smaller or equal size ) or create new SHM and return ID
-        output_data_size = len(output_data)
-        output_shm = communication_utils.create_shm(output_data_size)
-        logger.debug("Created SHM with ID: " + str(output_shm.id) + " and size: " + str(output_shm.size))
-
-    communication_utils.write_shm(output_shm, output_data)
+    ######## Copy the tensors to the output SHM with the nms tensor set to new_nms_value
 
-    return output_shm.id
-
-
-def main():
-    # Start socket listener to receive messages from NXAI runtime
-    server = communication_utils.startUnixSocketServer(Preprocessor_Socket_Path)
-    # Wait for messages in a loop
-    while True:
-        # Wait for input message from runtime
-        try:
-            input_message, connection = communication_utils.waitForSocketMessage(server)
-        except socket.timeout:
-            # Request timed out. Continue waiting
-            continue
-
-        tensor_header = msgpack.unpackb(input_message)
-        print("EXAMPLE PREPROCESSOR: Received input message: ", tensor_header)
-
-        external_settings = {}
-        if "ExternalProcessorSettings" in tensor_header:
-            logger.info("Got settings: " + str(tensor_header["ExternalProcessorSettings"]))
-            external_settings = tensor_header["ExternalProcessorSettings"]
-
-        # Process image
-        output_shm_id = parseTensorFromSHM(tensor_header["SHMKey"], external_settings)
+    try:
+        with shm_utils.attach(shm_key) as input_buffer:
+            return tensor_patcher.write(input_buffer, {"nms_sensitivity-": struct.pack("f", new_nms_value)})
+    except ValueError as e:
+        logger.error("Invalid input tensor received. Ignoring. " + str(e))
+        return 0
 
-        if output_shm_id != 0:
-            tensor_header["SHMID"] = output_shm_id
 
-        # Write header to respond
-        output_message = msgpack.packb(tensor_header)
+def process_header(tensor_header):
+    frame_logger.dump("Received input message", tensor_header)
 
-        # Send message back to runtime
-        communication_utils.sendMessageOverConnection(connection, output_message)
+    external_settings = {}
+    if "ExternalProcessorSettings" in tensor_header:
+        frame_logger.dump("Got settings", tensor_header["ExternalProcessorSettings"])
+        external_settings = tensor_header["ExternalProcessorSettings"]
 
+    # Process tensor
+    output_shm_id = parseTensorFromSHM(tensor_header["SHMKey"], external_settings)
 
-def signalHandler(sig, _):
-    print("EXAMPLE PREPROCESSOR: Received interrupt signal: ", sig)
-    # Detach and destroy output shm
-    if output_shm is not None:
-        output_shm.detach()
-        output_shm.remove()
-    sys.exit(0)
+    if output_shm_id != 0:
+        tensor_header["SHMID"] = output_shm_id
 
 
 def config():
-    logger.info("Reading configuration from:" + CONFIG_FILE)
-
-    try:
-        configuration = configparser.ConfigParser()
-        configuration.read(CONFIG_FILE)
-
-        configured_log_level = configuration.get("common", "debug_level", fallback="INFO")
-        set_log_level(configured_log_level)
-
-        for section in configuration.sections():
-            logger.info("config section: " + section)
-            for key in configuration[section]:
-                logger.info("config key: " + key + " = " + configuration[section][key])
-
-    except Exception as e:
-        logger.error(e, exc_info=True)
-
-    logger.debug("Read configuration done")
-
-
-def set_log_level(level):
-    try:
-        logger.setLevel(level)
-    except Exception as e:
-        logger.error(e, exc_info=True)
+    processor_utils.read_config(CONFIG_FILE, logger)
 
 
 if __name__ == "__main__":
@@ -158,27 +89,27 @@ if __name__ == "__main__":
     # Parse input arguments
     if len(sys.argv) > 1:
         Preprocessor_Socket_Path = sys.argv[1]
-    # Handle interrupt signals
-    signal.signal(signal.SIGTERM, signalHandler)
 
     ## initialize the logger
     logger = logging.getLogger(__name__)
+    frame_logger = log_utils.FrameLogger(logger)
 
     ## read configuration file if it's available
     config()
 
+    # Remove SHM segments leaked by a previous instance of this preprocessor
+    shm_manager = shm_utils.SHMLifecycleManager(Preprocessor_Socket_Path + ".shm")
+    shm_manager.reap()
+    tensor_patcher = tensor_utils.TensorPatcher(shm_manager)
+
     logger.info("Initializing example plugin")
     logger.debug("Input parameters: " + str(sys.argv))
 
-    try:
-        main()
-    except Exception as e:
-        logger.error(e, exc_info=True)
-    except KeyboardInterrupt:
-        logger.info("Exited with keyboard interrupt")
-
-    try:
-        os.unlink(Preprocessor_Socket_Path)
-    except OSError:
-        if os.path.exists(Preprocessor_Socket_Path):
-            logger.error("Could not remove socket file: " + Preprocessor_Socket_Path)
+    # Handle frames until the processor is stopped, then detach and destroy all created shm
+    processor_utils.run_processor(
+        Preprocessor_Socket_Path,
+        process_header,
+        message_format=processor_utils.MSGPACK,
+        on_shutdown=[shm_manager.release_all],
+        config_file=CONFIG_FILE,
+    )
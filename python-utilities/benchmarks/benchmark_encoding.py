@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Throughput benchmark of the encoding service, compared with encoding inline.
+#
+# Usage: python3 benchmark_encoding.py [--frames N] [--width W] [--height H] [--max-width W] [--format JPEG]
+#
+# The frames are a smooth gradient with noise, which encodes at a size similar to camera images.
+
+import io
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import encoding_utils
+
+THREADS = (1, 2, 4)
+
+
+def make_frame(width, height):
+    gradient = np.add.outer(np.arange(height) * 200 // height, np.arange(width) * 50 // width)
+    noise = np.random.randint(0, 8, (height, width, 3))
+    return (gradient[:, :, None] + noise).astype(np.uint8)
+
+
+def encode_inline(frames, arguments):
+    # The same work as the service, on the calling thread
+    output_size = encoding_utils.fit_size(arguments.width, arguments.height, arguments.max_width)
+    start = time.perf_counter()
+    for frame in frames:
+        with Image.fromarray(frame) as image:
+            if output_size != image.size:
+                image = image.resize(output_size, Image.BOX, reducing_gap=2.0)
+            with io.BytesIO() as output:
+                image.save(output, format=arguments.format, quality=arguments.quality)
+                output.getvalue()
+    return time.perf_counter() - start
+
+
+def encode_service(frames, threads, arguments):
+    service = encoding_utils.EncoderService(
+        threads=threads,
+        max_pending=len(frames),
+        image_format=arguments.format,
+        quality=arguments.quality,
+        max_width=arguments.max_width,
+    )
+    start = time.perf_counter()
+    futures = [service.submit(frame) for frame in frames]
+    submitted = time.perf_counter() - start
+    for future in futures:
+        future.result()
+    elapsed = time.perf_counter() - start
+    service.shutdown()
+    return submitted, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the encoding service")
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--max-width", type=int, default=0)
+    parser.add_argument("--format", default="JPEG")
+    parser.add_argument("--quality", type=int, default=85)
+    arguments = parser.parse_args()
+
+    frames = [make_frame(arguments.width, arguments.height) for _ in range(arguments.frames)]
+    print(
+        str(arguments.frames) + " frames of " + str(arguments.width) + "x" + str(arguments.height)
+        + ", " + arguments.format + ", " + str(os.cpu_count()) + " cores"
+    )
+
+    elapsed = encode_inline(frames, arguments)
+    print("    {:<12} {:>8.1f} frames/s".format("inline", arguments.frames / elapsed))
+    for threads in THREADS:
+        submitted, elapsed = encode_service(frames, threads, arguments)
+        print(
+            "    {:<12} {:>8.1f} frames/s, submit {:.2f} ms per frame".format(
+                str(threads) + " thread(s)", arguments.frames / elapsed, submitted / arguments.frames * 1000
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# Benchmark of the image kernels on images in shared memory, from 720p up to 4K.
+#
+# Usage: python3 benchmark_image_utils.py [--repeat N] [--legacy]
+#
+# With --legacy the per pixel Python loop previously used by the image preprocessor is timed
+# as well, this takes several seconds per frame.
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import sysv_ipc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import image_utils
+
+RESOLUTIONS = {
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "1440p": (2560, 1440),
+    "4K": (3840, 2160),
+}
+CHANNELS = 3
+
+
+def legacy_mirror_downscale(image_data, width, height, channels):
+    output_image = bytearray(len(image_data))
+    for h_key in range(0, height, 2):
+        for w_key in range(0, width, 2):
+            output_pixel_index = int(((h_key * width / 4) * channels) + ((w_key / 2) * channels))
+            input_pixel_index = (h_key * width * channels) + ((width - w_key) * channels)
+            output_image[output_pixel_index : output_pixel_index + channels] = image_data[input_pixel_index : input_pixel_index + channels]
+    return output_image
+
+
+def time_kernel(kernel, repeat):
+    kernel()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        kernel()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def benchmark_resolution(width, height, repeat, legacy):
+    size = width * height * CHANNELS
+    input_shm = sysv_ipc.SharedMemory(None, sysv_ipc.IPC_CREX, size=size)
+    output_shm = sysv_ipc.SharedMemory(None, sysv_ipc.IPC_CREX, size=size)
+    results = {}
+    try:
+        input_shm.write(np.random.randint(0, 256, size, dtype=np.uint8).tobytes())
+        image = image_utils.image_view(memoryview(input_shm), width, height, CHANNELS)
+        output = memoryview(output_shm)
+        half_shape = (height // 2, width // 2, CHANNELS)
+        full_shape = (height, width, CHANNELS)
+        crop_shape = (height // 2, width // 2, CHANNELS)
+
+        results["mirror+decimate"] = time_kernel(
+            lambda: image_utils.decimate(image_utils.mirror(image), 2, out=image_utils.output_view(output, half_shape)),
+            repeat,
+        )
+        results["mirror"] = time_kernel(lambda: image_utils.mirror(image, out=image_utils.output_view(output, full_shape)), repeat)
+        results["flip"] = time_kernel(lambda: image_utils.flip(image, out=image_utils.output_view(output, full_shape)), repeat)
+        results["crop"] = time_kernel(
+            lambda: image_utils.crop(image, width // 4, height // 4, width // 4 * 3, height // 4 * 3, out=image_utils.output_view(output, crop_shape)),
+            repeat,
+        )
+        results["transpose"] = time_kernel(
+            lambda: image_utils.transpose(image, out=image_utils.output_view(output, (width, height, CHANNELS))),
+            repeat,
+        )
+        if legacy:
+            image_data = input_shm.read()
+            results["legacy loop"] = time_kernel(lambda: legacy_mirror_downscale(image_data, width, height, CHANNELS), 1)
+        del image
+        output.release()
+    finally:
+        input_shm.detach()
+        input_shm.remove()
+        output_shm.detach()
+        output_shm.remove()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the image kernels")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--legacy", action="store_true", help="also time the legacy Python loop")
+    arguments = parser.parse_args()
+
+    for name, (width, height) in RESOLUTIONS.items():
+        results = benchmark_resolution(width, height, arguments.repeat, arguments.legacy)
+        print(name + " (" + str(width) + "x" + str(height) + ")")
+        for kernel_name, milliseconds in results.items():
+            print("    {:<16} {:>10.2f} ms".format(kernel_name, milliseconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# Per frame latency of preparing the CLIP text tensor, tokenizing on every frame compared to the prompt token cache.
+#
+# Usage: python3 benchmark_prompt_tokens.py [--frames N] [--change-every N]
+#
+# The settings of every frame hold five prompts, the prompts change every `change-every` frames.
+# Requires the instant_clip_tokenizer package.
+
+import os
+import sys
+import time
+import struct
+import argparse
+
+import numpy as np
+import instant_clip_tokenizer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import prompt_utils
+
+PROMPTS = ("a person", "a car", "a bicycle", "a dog", "an empty street", "a truck", "a cat", "a bus")
+
+
+def make_settings(frames, change_every):
+    # A fresh settings dict per frame, as unpacked from the message of every frame
+    settings = []
+    for frame in range(frames):
+        first = frame // change_every
+        prompts = {"externalprocessor.prompt" + str(index): PROMPTS[(first + index) % len(PROMPTS)] for index in range(5)}
+        settings.append({"externalprocessor.eventCooldown": "10", **prompts})
+    return settings
+
+
+def tokenize_every_frame(tokenizer, external_settings):
+    # The previous implementation of the preprocessor
+    prompts = []
+    for setting_name in sorted(list(external_settings.keys())):
+        if setting_name.startswith("externalprocessor.prompt"):
+            prompts.append(external_settings[setting_name])
+    while len(prompts) != 5:
+        prompts.append("")
+    text_tokens_np = np.array(tokenizer.tokenize_batch(prompts, context_length=77), dtype=np.int32)
+    return struct.pack(f"{text_tokens_np.size}i", *text_tokens_np.flatten())
+
+
+def measure(function, settings):
+    times = []
+    for external_settings in settings:
+        start = time.perf_counter()
+        function(external_settings)
+        times.append(time.perf_counter() - start)
+    return np.array(times) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CLIP prompt token cache")
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--change-every", type=int, default=500, help="Frames between changes of the prompts")
+    arguments = parser.parse_args()
+
+    tokenizer = instant_clip_tokenizer.Tokenizer()
+    settings = make_settings(arguments.frames, arguments.change_every)
+    cache = prompt_utils.PromptTokenCache(tokenizer)
+    assert cache.tokens_for_settings(settings[0]) == tokenize_every_frame(tokenizer, settings[0])
+    cache = prompt_utils.PromptTokenCache(tokenizer)
+
+    print("{} frames, prompts change every {} frames".format(arguments.frames, arguments.change_every))
+    print("{:<22} {:>10} {:>10} {:>10}".format("", "mean us", "p50 us", "p99 us"))
+    for name, function in (
+        ("tokenize every frame", lambda external_settings: tokenize_every_frame(tokenizer, external_settings)),
+        ("prompt token cache", cache.tokens_for_settings),
+    ):
+        microseconds = measure(function, settings)
+        print("{:<22} {:>10.1f} {:>10.1f} {:>10.1f}".format(name, microseconds.mean(), *np.percentile(microseconds, [50, 99])))
+    print(cache.metrics())
+
+
+if __name__ == "__main__":
+    main()
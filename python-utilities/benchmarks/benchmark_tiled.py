@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# Scaling benchmark of the tiled image operations with 1 to 8 threads.
+#
+# Usage: python3 benchmark_tiled.py [--repeat N] [--width W] [--height H]
+#
+# The speedup is limited by the number of cores and the memory bandwidth of the machine.
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import image_utils
+import resize_utils
+
+THREADS = (1, 2, 4, 8)
+CHANNELS = 3
+
+
+def time_operation(operation, repeat):
+    operation()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        operation()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the tiled image operations")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--width", type=int, default=3840)
+    parser.add_argument("--height", type=int, default=2160)
+    arguments = parser.parse_args()
+
+    width = arguments.width
+    height = arguments.height
+    image = np.random.randint(0, 256, (height, width, CHANNELS), dtype=np.uint8)
+    half = np.empty((height // 2, width // 2, CHANNELS), dtype=np.uint8)
+    full = np.empty((height, width, CHANNELS), dtype=np.uint8)
+    model_input = np.empty((640, 640, CHANNELS), dtype=np.uint8)
+    bilinear = resize_utils.Resizer(resize_utils.BILINEAR, letterbox=True)
+    area = resize_utils.Resizer(resize_utils.AREA, letterbox=True)
+
+    print("Image " + str(width) + "x" + str(height) + ", L2 cache " + str(image_utils.cache_size() // 1024) + " KiB, " + str(os.cpu_count()) + " cores")
+    baseline = {}
+    for threads in THREADS:
+        executor = image_utils.TiledExecutor(threads=threads)
+        operations = {
+            "mirror+decimate": lambda: executor.store(image_utils.decimate(image_utils.mirror(image), 2), half),
+            "mirror": lambda: executor.store(image_utils.mirror(image), full),
+            "resize bilinear": lambda: bilinear.resize(image, 640, 640, out=model_input, executor=executor),
+            "resize area": lambda: area.resize(image, 640, 640, out=model_input, executor=executor),
+        }
+        print(str(threads) + " thread(s)")
+        for name, operation in operations.items():
+            milliseconds = time_operation(operation, arguments.repeat)
+            baseline.setdefault(name, milliseconds)
+            print("    {:<16} {:>10.2f} ms {:>6.2f}x".format(name, milliseconds, baseline[name] / milliseconds))
+        executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
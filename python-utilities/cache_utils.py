@@ -0,0 +1,197 @@
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import classification_utils
+
+# Cache of results computed per detected object, such as the description returned by a cloud
+# classifier, so an object is only described once while it stays in view.
+#
+# Entries are kept per DeviceID namespace and keyed by an object ID, the object ID of the tracker
+# of the AI Manager or a track ID. An entry can also store the box of the object: when an object
+# shows up under a new ID, for example because the tracker lost it for a moment, its result is
+# found again by matching the box with the boxes of the entries of the same device.
+
+# Estimated bytes of the bookkeeping of one entry: the key, the entry list and the dict slots
+ENTRY_OVERHEAD_BYTES = 240
+
+
+class ObjectResultCache:
+    """
+    LRU cache of per object results with a time to live.
+
+    Entries expire `ttl_seconds` after they were stored. Results that are None, a classifier that
+    found nothing, expire after `negative_ttl_seconds` so the object is retried sooner. At most
+    `max_entries` entries are kept over all devices, the least recently used entries are evicted
+    first. With `max_entries_per_device` a busy device only evicts its own entries, and with
+    `max_bytes` the estimated memory of the entries is capped as well. The cache is thread safe,
+    results can be stored from worker threads.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = 300.0,
+        negative_ttl_seconds: float = 10.0,
+        max_entries: int = 1024,
+        min_iou: float = 0.5,
+        max_entries_per_device: int = 0,
+        max_bytes: int = 0,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max_entries
+        self.min_iou = min_iou
+        self.max_entries_per_device = max_entries_per_device
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # (device_id, object_id) -> [value, expires_at, box, bytes]
+        self._entries = OrderedDict()
+        # device_id -> object IDs of the device, least recently used first
+        self._devices = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def contains(self, device_id, object_id, now: float = None):
+        with self._lock:
+            return self._entry(device_id, object_id, self._now(now)) is not None
+
+    def get(self, device_id, object_id, default=None, now: float = None):
+        # The result of the object, or default when it is not cached
+        with self._lock:
+            entry = self._entry(device_id, object_id, self._now(now))
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[0]
+
+    def lookup(self, device_id, object_id, box=None, default=None, now: float = None):
+        """
+        The result of the object, matched by its ID or otherwise by its box.
+
+        When the box matches an entry of the device the entry is moved to the new ID, with the
+        box of the object, so one object never holds two entries.
+        """
+        now = self._now(now)
+        with self._lock:
+            entry = self._entry(device_id, object_id, now)
+            if entry is None and box is not None:
+                matched_id = self._match(device_id, box, now)
+                if matched_id is not None:
+                    matched = self._entries[(device_id, matched_id)]
+                    self._remove(device_id, matched_id)
+                    entry = self._store(device_id, object_id, matched[0], matched[1], box)
+            if entry is None:
+                self.misses += 1
+                return default
+            if box is not None:
+                entry[2] = np.asarray(box, dtype=np.float32).reshape(4)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, device_id, object_id, value, box=None, now: float = None):
+        ttl = self.ttl_seconds if value is not None else self.negative_ttl_seconds
+        with self._lock:
+            self._store(device_id, object_id, value, self._now(now) + ttl, box)
+
+    def invalidate(self, device_id, object_id=None):
+        # Remove one object, or the whole namespace of the device
+        with self._lock:
+            object_ids = [object_id] if object_id is not None else list(self._devices.get(device_id, ()))
+            for removed_id in object_ids:
+                self._remove(device_id, removed_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._devices.clear()
+            self._bytes = 0
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "CacheEntries": len(self._entries),
+                "CacheDevices": len(self._devices),
+                "CacheBytes": self._bytes,
+                "CacheHits": self.hits,
+                "CacheMisses": self.misses,
+                "CacheHitRate": self.hits / lookups if lookups > 0 else 0.0,
+                "CacheEvictions": self.evictions,
+                "CacheExpirations": self.expirations,
+            }
+
+    def _now(self, now):
+        return time.monotonic() if now is None else now
+
+    def _entry(self, device_id, object_id, now: float):
+        key = (device_id, object_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            self._remove(device_id, object_id)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        self._devices[device_id].move_to_end(object_id)
+        return entry
+
+    def _match(self, device_id, box, now: float):
+        # The object ID of the live entry of the device whose box overlaps the given box the most
+        candidates = [
+            object_id
+            for object_id in self._devices.get(device_id, ())
+            if self._entries[(device_id, object_id)][2] is not None and self._entries[(device_id, object_id)][1] > now
+        ]
+        if len(candidates) == 0:
+            return None
+        boxes = np.stack([self._entries[(device_id, object_id)][2] for object_id in candidates])
+        ious = classification_utils.iou_matrix(box, boxes)[0]
+        best = int(np.argmax(ious))
+        if ious[best] < self.min_iou:
+            return None
+        return candidates[best]
+
+    def _store(self, device_id, object_id, value, expires_at: float, box):
+        key = (device_id, object_id)
+        box = None if box is None else np.asarray(box, dtype=np.float32).reshape(4)
+        size = ENTRY_OVERHEAD_BYTES + sys.getsizeof(value) + (0 if box is None else box.nbytes)
+        self._remove(device_id, object_id)
+        entry = [value, expires_at, box, size]
+        self._entries[key] = entry
+        self._bytes += size
+        object_ids = self._devices.setdefault(device_id, OrderedDict())
+        object_ids[object_id] = None
+        while self.max_entries_per_device > 0 and len(object_ids) > self.max_entries_per_device:
+            # The least recently used entry of the same device
+            self._remove(device_id, next(iter(object_ids)))
+            self.evictions += 1
+        while len(self._entries) > self.max_entries or (self.max_bytes > 0 and self._bytes > self.max_bytes and len(self._entries) > 1):
+            (evicted_device, evicted_id), evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted[3]
+            self._forget(evicted_device, evicted_id)
+            self.evictions += 1
+        return entry
+
+    def _remove(self, device_id, object_id):
+        entry = self._entries.pop((device_id, object_id), None)
+        if entry is not None:
+            self._bytes -= entry[3]
+            self._forget(device_id, object_id)
+
+    def _forget(self, device_id, object_id):
+        object_ids = self._devices.get(device_id)
+        if object_ids is not None:
+            object_ids.pop(object_id, None)
+            if len(object_ids) == 0:
+                del self._devices[device_id]
@@ -0,0 +1,191 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Asynchronous classification of detected objects with an expensive classifier, such as a cloud
+# API, without making the frame loop wait for it.
+#
+# Objects are identified by a key that stays the same across frames, the object ID of the
+# tracker of the AI Manager when available, or a track ID assigned by BoxTracker otherwise. The
+# frame loop submits crops of objects that have no result yet and attaches the results that
+# have finished to the objects in the frames that follow.
+
+logger = logging.getLogger(__name__)
+
+
+def iou_matrix(boxes_a, boxes_b):
+    # (N, M) intersection over union of two sets of xyxy boxes
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(1, -1, 4)
+    width = np.clip(np.minimum(boxes_a[..., 2], boxes_b[..., 2]) - np.maximum(boxes_a[..., 0], boxes_b[..., 0]), 0, None)
+    height = np.clip(np.minimum(boxes_a[..., 3], boxes_b[..., 3]) - np.maximum(boxes_a[..., 1], boxes_b[..., 1]), 0, None)
+    intersection = width * height
+    area_a = (boxes_a[..., 2] - boxes_a[..., 0]) * (boxes_a[..., 3] - boxes_a[..., 1])
+    area_b = (boxes_b[..., 2] - boxes_b[..., 0]) * (boxes_b[..., 3] - boxes_b[..., 1])
+    union = area_a + area_b - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def match_boxes(boxes_a, boxes_b, min_iou: float):
+    # Greedy one to one matching of the pairs with the highest IoU, as a list of (a, b) indices
+    ious = iou_matrix(boxes_a, boxes_b)
+    if ious.size == 0:
+        return []
+    candidates = np.argwhere(ious >= min_iou)
+    order = np.argsort(-ious[candidates[:, 0], candidates[:, 1]], kind="stable")
+    matches = []
+    used_a = set()
+    used_b = set()
+    for a, b in candidates[order].tolist():
+        if a not in used_a and b not in used_b:
+            used_a.add(a)
+            used_b.add(b)
+            matches.append((a, b))
+    return matches
+
+
+class BoxTracker:
+    """
+    Assigns track IDs to boxes by matching them with the boxes of the previous frame of the device.
+
+    Boxes that overlap a box of the previous frame by at least `min_iou` keep its track ID, other
+    boxes get a new one. The boxes of the `max_devices` most recently seen devices are kept.
+    """
+
+    def __init__(self, min_iou: float = 0.3, max_devices: int = 64):
+        self.min_iou = min_iou
+        self.max_devices = max_devices
+        self._tracks = OrderedDict()
+        self._next_id = 0
+
+    def update(self, device_id, boxes_xyxy):
+        boxes = np.asarray(boxes_xyxy, dtype=np.float32).reshape(-1, 4)
+        previous_boxes, previous_ids = self._tracks.get(device_id, (np.empty((0, 4), dtype=np.float32), []))
+        track_ids = [None] * len(boxes)
+        for index, previous_index in match_boxes(boxes, previous_boxes, self.min_iou):
+            track_ids[index] = previous_ids[previous_index]
+        for index, track_id in enumerate(track_ids):
+            if track_id is None:
+                track_ids[index] = self._next_id
+                self._next_id += 1
+
+        self._tracks[device_id] = (boxes, track_ids)
+        self._tracks.move_to_end(device_id)
+        while len(self._tracks) > self.max_devices:
+            self._tracks.popitem(last=False)
+        return track_ids
+
+
+class ClassificationQueue:
+    """
+    Runs `classify(payload)` on a bounded thread pool and keeps the results by object key.
+
+    `submit` never blocks: it returns False when the object already has a result, is being
+    classified, or when `max_pending` objects are waiting. The results of the last `max_results`
+    objects are kept, or when a `cache_utils.ObjectResultCache` is given the results are stored
+    in it, with (device_id, object_id) keys. A classification that raises an exception can be
+    submitted again. Only the first of a series of failures with the same error type is logged,
+    so a service that is down does not log an error for every object of every frame. Errors of
+    the `expected_errors` types, such as a circuit breaker rejecting calls, are logged at DEBUG.
+    """
+
+    def __init__(
+        self,
+        classify,
+        threads: int = 2,
+        max_pending: int = 16,
+        max_results: int = 256,
+        cache=None,
+        expected_errors: tuple = (),
+    ):
+        self.classify = classify
+        self.expected_errors = expected_errors
+        self.max_pending = max_pending
+        self.max_results = max_results
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="classifier")
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._results = OrderedDict()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._last_error = None
+
+    def submit(self, key, payload, box=None):
+        # The box of the object is stored with the result in the cache, to match the object by its box later
+        if self.cache is not None and self.cache.contains(*key):
+            return False
+        with self._lock:
+            if key in self._pending or key in self._results:
+                return False
+            if len(self._pending) >= self.max_pending:
+                self.rejected += 1
+                return False
+            self._pending.add(key)
+            self.submitted += 1
+        self._executor.submit(self._run, key, payload, box)
+        return True
+
+    def has_result(self, key):
+        if self.cache is not None:
+            return self.cache.contains(*key)
+        with self._lock:
+            return key in self._results
+
+    def result(self, key, default=None):
+        # The finished result of the object, or default when there is none yet
+        if self.cache is not None:
+            return self.cache.get(*key, default=default)
+        with self._lock:
+            if key not in self._results:
+                return default
+            self._results.move_to_end(key)
+            return self._results[key]
+
+    def is_pending(self, key):
+        with self._lock:
+            return key in self._pending
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "ClassificationPending": len(self._pending),
+                "ClassificationResults": len(self._results),
+                "ClassificationSubmitted": self.submitted,
+                "ClassificationCompleted": self.completed,
+                "ClassificationFailed": self.failed,
+                "ClassificationRejected": self.rejected,
+            }
+
+    def _run(self, key, payload, box):
+        try:
+            result = self.classify(payload)
+        except Exception as e:
+            with self._lock:
+                self._pending.discard(key)
+                self.failed += 1
+                repeated = type(e) is self._last_error
+                self._last_error = type(e)
+            if not repeated:
+                level = logging.DEBUG if isinstance(e, self.expected_errors) else logging.ERROR
+                logger.log(level, "Classification of " + str(key) + " failed: " + str(e))
+            return
+
+        if self.cache is not None:
+            self.cache.put(*key, result, box=box)
+        with self._lock:
+            self._pending.discard(key)
+            self._last_error = None
+            if self.cache is None:
+                self._results[key] = result
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+            self.completed += 1
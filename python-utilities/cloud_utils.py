@@ -0,0 +1,292 @@
+import time
+import queue
+import random
+import logging
+import threading
+import http.client
+import urllib.parse
+
+# Calling cloud services from a postprocessor without letting a slow or failing service take the
+# postprocessor down with it.
+#
+# CloudClient wraps the calls to a service with a limit on the number of calls in flight, a
+# deadline per call, retries with exponential backoff that are limited by a retry budget, and a
+# circuit breaker that fails calls immediately while the service is down. The retry budget makes
+# sure retries can never multiply the load on a service that is already overloaded.
+
+logger = logging.getLogger(__name__)
+
+
+class CloudError(Exception):
+    pass
+
+
+class CircuitOpenError(CloudError):
+    # The service failed too often, calls fail immediately until the breaker closes again
+    pass
+
+
+class DeadlineExceededError(CloudError):
+    pass
+
+
+class HTTPStatusError(CloudError):
+    def __init__(self, status: int, body: bytes = b""):
+        super().__init__("HTTP status " + str(status) + ": " + body[:200].decode(errors="replace"))
+        self.status = status
+        self.body = body
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures, and lets a single trial call through
+    after `reset_seconds`. The breaker closes again when the trial call succeeds.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.opened = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                # Only the first call after the reset time is let through
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def is_open(self):
+        # Whether calls are rejected now, without taking the trial call of an open breaker
+        with self._lock:
+            if self.state == self.OPEN:
+                return time.monotonic() - self._opened_at < self.reset_seconds
+            return self.state == self.HALF_OPEN
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self.state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opened += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class RetryBudget:
+    """
+    Allows retries for at most `ratio` of the calls, plus `min_retries_per_second`.
+
+    Every call deposits `ratio` tokens and every retry withdraws one. The balance is capped, so
+    a quiet period does not build up a burst of retries.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries_per_second: float = 1.0, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.min_retries_per_second = min_retries_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            self._refill()
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._updated) * self.min_retries_per_second)
+        self._updated = now
+
+
+def is_retryable(error):
+    # Connection problems, timeouts, throttling and server errors are worth retrying
+    if isinstance(error, HTTPStatusError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (ConnectionError, TimeoutError, http.client.HTTPException, OSError))
+
+
+class CloudClient:
+    """
+    Calls `function(*args, **kwargs)` with a concurrency limit, deadline, retries and circuit breaker.
+
+    At most `max_in_flight` calls run at the same time, other calls wait for a slot within their
+    deadline. A call is attempted at most `max_attempts` times, as long as `retryable(error)`
+    holds, the retry budget allows it and the deadline is not exceeded. Backoff between attempts
+    is exponential with full jitter. The errors of the last attempt are raised to the caller.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 4,
+        deadline_seconds: float = 5.0,
+        max_attempts: int = 3,
+        backoff_seconds: float = 0.1,
+        max_backoff_seconds: float = 2.0,
+        retry_budget: RetryBudget = None,
+        circuit_breaker: CircuitBreaker = None,
+        retryable=is_retryable,
+    ):
+        self.max_in_flight = max_in_flight
+        self.deadline_seconds = deadline_seconds
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.retry_budget = retry_budget if retry_budget is not None else RetryBudget()
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker()
+        self.retryable = retryable
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.calls = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+        self.rejected = 0
+
+    def call(self, function, *args, deadline_seconds: float = None, **kwargs):
+        deadline = time.monotonic() + (self.deadline_seconds if deadline_seconds is None else deadline_seconds)
+        if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            self._count("rejected")
+            raise DeadlineExceededError("No call slot available within the deadline")
+        # Only asked once the call can be made, a half-open breaker waits for the result of its trial call
+        if not self.circuit_breaker.allow():
+            self._slots.release()
+            self._count("rejected")
+            raise CircuitOpenError("Circuit breaker is open")
+
+        with self._lock:
+            self._in_flight += 1
+            self.calls += 1
+        self.retry_budget.deposit()
+        try:
+            return self._attempt(function, args, kwargs, deadline)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "CloudInFlight": self._in_flight,
+                "CloudCalls": self.calls,
+                "CloudSucceeded": self.succeeded,
+                "CloudFailed": self.failed,
+                "CloudRetries": self.retries,
+                "CloudRejected": self.rejected,
+                "CloudBreakerState": self.circuit_breaker.state,
+                "CloudBreakerOpened": self.circuit_breaker.opened,
+            }
+
+    def _attempt(self, function, args, kwargs, deadline: float):
+        attempt = 1
+        while True:
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                retryable = self.retryable(e)
+                if retryable:
+                    self.circuit_breaker.record_failure()
+                else:
+                    # The service answered, the request itself was wrong
+                    self.circuit_breaker.record_success()
+                backoff = random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (attempt - 1)))
+                if (
+                    attempt >= self.max_attempts
+                    or not retryable
+                    or time.monotonic() + backoff >= deadline
+                    or not self.retry_budget.withdraw()
+                    or not self.circuit_breaker.allow()
+                ):
+                    self._count("failed")
+                    raise
+                logger.debug("Retrying call after error: " + str(e))
+                self._count("retries")
+                time.sleep(backoff)
+                attempt += 1
+                continue
+            self.circuit_breaker.record_success()
+            self._count("succeeded")
+            return result
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+class HTTPConnectionPool:
+    """
+    Pool of keep-alive HTTP connections to one host.
+
+    At most `max_connections` connections are open, requests wait for a free connection. A
+    connection that fails is closed instead of being returned to the pool.
+    """
+
+    def __init__(self, url: str, max_connections: int = 4, timeout_seconds: float = 5.0):
+        parsed = urllib.parse.urlsplit(url)
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.base_path = parsed.path.rstrip("/")
+        self.timeout_seconds = timeout_seconds
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+    def request(self, method: str, path: str = "/", body: bytes = None, headers: dict = None):
+        # Returns the status, response headers and body, raises HTTPStatusError for error statuses
+        self._slots.acquire()
+        try:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                connection_class = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+                connection = connection_class(self.host, self.port, timeout=self.timeout_seconds)
+            try:
+                connection.request(method, self.base_path + path, body=body, headers=headers or {})
+                response = connection.getresponse()
+                data = response.read()
+            except Exception:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._idle.put(connection)
+        finally:
+            self._slots.release()
+
+        if response.status >= 400:
+            raise HTTPStatusError(response.status, data)
+        return response.status, dict(response.getheaders()), data
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
@@ -0,0 +1,177 @@
+import numpy as np
+
+# Conversion of camera pixel formats to packed RGB.
+#
+# The YUV conversions use the integer BT.601 limited range coefficients scaled by 256, the same
+# fixed point math as libyuv and the Android camera stack. Chroma is upsampled horizontally only
+# and broadcast over each pair of rows, so no full resolution chroma planes are created. Images
+# with an odd width or height have chroma planes of half the size rounded up, as in libyuv.
+
+RGB = "RGB"
+BGR = "BGR"
+RGBA = "RGBA"
+BGRA = "BGRA"
+GRAY = "GRAY"
+NV12 = "NV12"
+NV21 = "NV21"
+I420 = "I420"
+PIXEL_FORMATS = (RGB, BGR, RGBA, BGRA, GRAY, NV12, NV21, I420)
+
+
+def pixel_format_for_channels(channels: int):
+    # The image header only carries the number of channels, assume the usual packed format
+    if channels == 1:
+        return GRAY
+    if channels == 4:
+        return RGBA
+    return RGB
+
+
+def chroma_size(width: int, height: int):
+    # Width and height of the chroma planes of a YUV 4:2:0 image
+    return (width + 1) // 2, (height + 1) // 2
+
+
+def buffer_size(pixel_format: str, width: int, height: int):
+    # Number of bytes of an image in the given pixel format
+    if pixel_format in (NV12, NV21, I420):
+        chroma_width, chroma_height = chroma_size(width, height)
+        return width * height + 2 * chroma_width * chroma_height
+    if pixel_format in (RGBA, BGRA):
+        return width * height * 4
+    if pixel_format == GRAY:
+        return width * height
+    return width * height * 3
+
+
+def _output(out, width: int, height: int):
+    if out is None:
+        return np.empty((height, width, 3), dtype=np.uint8)
+    return out
+
+
+def _yuv420_rows(luma, d, e, out):
+    # Convert rows that share their chroma rows, luma is (rows, rows_per_chroma, width)
+    y = luma.astype(np.int32)
+    y -= 16
+    y *= 298
+    y += 128
+    chroma = (
+        (409 * e)[:, None, :],
+        (-100 * d - 208 * e)[:, None, :],
+        (516 * d)[:, None, :],
+    )
+    channel = np.empty(luma.shape, dtype=np.int32)
+    for index, contribution in enumerate(chroma):
+        np.add(y, contribution, out=channel)
+        np.right_shift(channel, 8, out=channel)
+        np.clip(channel, 0, 255, out=channel)
+        np.copyto(out[..., index], channel, casting="unsafe")
+
+
+def _yuv420_to_rgb(luma, u, v, out):
+    # luma is (height, width), u and v are the chroma planes or strided views of them
+    height, width = luma.shape
+    # Chroma is only upsampled horizontally, the vertical upsampling is a broadcast over row pairs
+    d = np.repeat(u, 2, axis=1)[:, :width].astype(np.int32)
+    d -= 128
+    e = np.repeat(v, 2, axis=1)[:, :width].astype(np.int32)
+    e -= 128
+
+    pairs = height // 2
+    _yuv420_rows(luma[: 2 * pairs].reshape((pairs, 2, width)), d[:pairs], e[:pairs], out[: 2 * pairs].reshape((pairs, 2, width, 3)))
+    if height % 2 != 0:
+        # The last row of an odd height has a chroma row of its own
+        _yuv420_rows(luma[2 * pairs :].reshape((1, 1, width)), d[pairs:], e[pairs:], out[2 * pairs :].reshape((1, 1, width, 3)))
+    return out
+
+
+def _yuv420_planes(buffer, pixel_format: str, width: int, height: int):
+    # The Y plane and the bytes of the chroma planes
+    data = np.frombuffer(buffer, dtype=np.uint8, count=buffer_size(pixel_format, width, height))
+    return data[: width * height].reshape((height, width)), data[width * height :]
+
+
+def nv12_to_rgb(buffer, width: int, height: int, out=None):
+    # Full resolution Y plane followed by an interleaved half resolution UV plane
+    luma, chroma = _yuv420_planes(buffer, NV12, width, height)
+    chroma_width, chroma_height = chroma_size(width, height)
+    chroma = chroma.reshape((chroma_height, chroma_width, 2))
+    return _yuv420_to_rgb(luma, chroma[..., 0], chroma[..., 1], _output(out, width, height))
+
+
+def nv21_to_rgb(buffer, width: int, height: int, out=None):
+    # Same as NV12 with V and U swapped
+    luma, chroma = _yuv420_planes(buffer, NV21, width, height)
+    chroma_width, chroma_height = chroma_size(width, height)
+    chroma = chroma.reshape((chroma_height, chroma_width, 2))
+    return _yuv420_to_rgb(luma, chroma[..., 1], chroma[..., 0], _output(out, width, height))
+
+
+def i420_to_rgb(buffer, width: int, height: int, out=None):
+    # Full resolution Y plane followed by half resolution U and V planes
+    luma, chroma = _yuv420_planes(buffer, I420, width, height)
+    chroma_width, chroma_height = chroma_size(width, height)
+    plane_size = chroma_width * chroma_height
+    u = chroma[:plane_size].reshape((chroma_height, chroma_width))
+    v = chroma[plane_size:].reshape((chroma_height, chroma_width))
+    return _yuv420_to_rgb(luma, u, v, _output(out, width, height))
+
+
+def _packed(buffer, width: int, height: int, channels: int):
+    return np.frombuffer(buffer, dtype=np.uint8, count=width * height * channels).reshape((height, width, channels))
+
+
+def _copy_channels(image, order, out):
+    # Copying one channel plane at a time is much faster than a strided copy of whole pixels
+    for index, channel in enumerate(order):
+        np.copyto(out[..., index], image[..., channel])
+    return out
+
+
+def rgb_to_rgb(buffer, width: int, height: int, out=None):
+    image = _packed(buffer, width, height, 3)
+    if out is None:
+        return image
+    np.copyto(out, image)
+    return out
+
+
+def bgr_to_rgb(buffer, width: int, height: int, out=None):
+    return _copy_channels(_packed(buffer, width, height, 3), (2, 1, 0), _output(out, width, height))
+
+
+def rgba_to_rgb(buffer, width: int, height: int, out=None):
+    return _copy_channels(_packed(buffer, width, height, 4), (0, 1, 2), _output(out, width, height))
+
+
+def bgra_to_rgb(buffer, width: int, height: int, out=None):
+    return _copy_channels(_packed(buffer, width, height, 4), (2, 1, 0), _output(out, width, height))
+
+
+def gray_to_rgb(buffer, width: int, height: int, out=None):
+    return _copy_channels(_packed(buffer, width, height, 1), (0, 0, 0), _output(out, width, height))
+
+
+CONVERTERS = {
+    RGB: rgb_to_rgb,
+    BGR: bgr_to_rgb,
+    RGBA: rgba_to_rgb,
+    BGRA: bgra_to_rgb,
+    GRAY: gray_to_rgb,
+    NV12: nv12_to_rgb,
+    NV21: nv21_to_rgb,
+    I420: i420_to_rgb,
+}
+
+
+def to_rgb(buffer, width: int, height: int, pixel_format: str, out=None):
+    """
+    Convert an image in any of the PIXEL_FORMATS to a packed (height, width, 3) RGB array.
+
+    The buffer can be a view on an SHM segment. When `out` is given the result is written into
+    it, otherwise a new array is allocated. RGB input without `out` is returned as a view.
+    """
+    if pixel_format not in CONVERTERS:
+        raise ValueError("Unknown pixel format: " + str(pixel_format))
+    return CONVERTERS[pixel_format](buffer, width, height, out)
@@ -0,0 +1,153 @@
+import os
+import time
+import ctypes
+import ctypes.util
+import struct
+import logging
+import configparser
+
+# Reloading the configuration file of a processor while it runs.
+#
+# ConfigWatcher notices when the file changes, with inotify where it is available and otherwise
+# by polling the modification time. load_config parses the new file completely before anything
+# is applied, so a file that is half written or has a syntax error never replaces the running
+# configuration.
+
+logger = logging.getLogger(__name__)
+
+# inotify flags, from <sys/inotify.h>
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class ConfigError(Exception):
+    pass
+
+
+def load_config(config_file: str):
+    # The parsed configuration file, raises ConfigError when it is missing or can not be parsed
+    configuration = configparser.ConfigParser()
+    try:
+        with open(config_file, "r") as file:
+            configuration.read_file(file, source=config_file)
+    except (OSError, UnicodeDecodeError, configparser.Error) as e:
+        raise ConfigError("Could not read " + config_file + ": " + str(e)) from e
+    return configuration
+
+
+def section_items(configuration, section: str):
+    # The settings of a section as a tuple, to check whether a section changed between two configurations
+    if configuration is None or not configuration.has_section(section):
+        return ()
+    return tuple(configuration.items(section, raw=True))
+
+
+def _inotify():
+    # The inotify functions of the C library, or None when they are not available
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        return libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+
+
+class ConfigWatcher:
+    """
+    Tells whether a configuration file changed since the previous call of `changed()`.
+
+    The directory of the file is watched with inotify, so the file is also seen when an editor
+    replaces it by renaming a new file over it. Checking is a non-blocking read of the inotify
+    descriptor, done at most every `check_seconds`, so it can be called between every frame.
+    When inotify is not available, or the directory does not exist, the modification time, size
+    and inode of the file are compared every `poll_seconds` instead.
+    """
+
+    def __init__(self, config_file: str, check_seconds: float = 0.25, poll_seconds: float = 2.0):
+        self.config_file = config_file
+        self.check_seconds = check_seconds
+        self.poll_seconds = poll_seconds
+        self._name = os.path.basename(config_file).encode()
+        self._fd = None
+        self._next_check = 0.0
+        self._stat = self._file_stat()
+        self.changes = 0
+        self._open_inotify()
+
+    @property
+    def method(self):
+        return "inotify" if self._fd is not None else "poll"
+
+    def changed(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        if self._fd is not None:
+            self._next_check = now + self.check_seconds
+            changed = self._read_events()
+        else:
+            self._next_check = now + self.poll_seconds
+            stat = self._file_stat()
+            changed = stat != self._stat
+            self._stat = stat
+        if changed:
+            self.changes += 1
+        return changed
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def metrics(self):
+        return {
+            "ConfigWatchMethod": self.method,
+            "ConfigChanges": self.changes,
+        }
+
+    def _open_inotify(self):
+        functions = _inotify()
+        if functions is None:
+            logger.info("inotify is not available, polling " + self.config_file + " for changes")
+            return
+        inotify_init1, inotify_add_watch = functions
+        fd = inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            logger.info("Could not start inotify: " + os.strerror(ctypes.get_errno()) + ", polling for changes")
+            return
+        directory = os.path.dirname(os.path.abspath(self.config_file))
+        if inotify_add_watch(fd, directory.encode(), WATCH_MASK) < 0:
+            logger.info("Could not watch " + directory + ": " + os.strerror(ctypes.get_errno()) + ", polling for changes")
+            os.close(fd)
+            return
+        self._fd = fd
+
+    def _read_events(self):
+        changed = False
+        while True:
+            try:
+                data = os.read(self._fd, 4096)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(data):
+                _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size : offset + EVENT_HEADER.size + length].rstrip(b"\0")
+                offset += EVENT_HEADER.size + length
+                # An overflow of the event queue may have dropped an event of the file
+                if name == self._name or mask & IN_Q_OVERFLOW:
+                    changed = True
+
+    def _file_stat(self):
+        try:
+            stat = os.stat(self.config_file)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
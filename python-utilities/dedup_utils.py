@@ -0,0 +1,126 @@
+from collections import OrderedDict
+
+import numpy as np
+
+# Perceptual hashing to drop near-duplicate images, such as samples captured from a static scene.
+#
+# The image is reduced to a tiny grayscale image by averaging a few sampled pixels per cell, so
+# only a couple of thousand bytes of the image are read. The hash is computed on that with
+# NumPy: dHash compares every cell with its right neighbour, aHash compares every cell with the
+# mean. Images whose hashes differ in at most `max_distance` bits are considered duplicates.
+
+DHASH = "dhash"
+AHASH = "ahash"
+METHODS = (DHASH, AHASH)
+
+# Pixels sampled along each axis of a cell of the tiny image
+SAMPLES_PER_CELL = 4
+
+
+def _grid(height: int, width: int, rows: int, columns: int):
+    # Indices of SAMPLES_PER_CELL x SAMPLES_PER_CELL pixels at the centers of sub-cells
+    row_indices = ((np.arange(rows * SAMPLES_PER_CELL) + 0.5) * height / (rows * SAMPLES_PER_CELL)).astype(np.intp)
+    column_indices = ((np.arange(columns * SAMPLES_PER_CELL) + 0.5) * width / (columns * SAMPLES_PER_CELL)).astype(np.intp)
+    return row_indices[:, None], column_indices[None, :]
+
+
+def tiny_image(image, rows: int, columns: int, grid=None):
+    # (rows, columns) grayscale image, every cell the mean of its sampled pixels
+    height, width, channels = image.shape
+    if grid is None:
+        grid = _grid(height, width, rows, columns)
+    sample = image[grid]
+    if channels >= 3:
+        sample = sample[..., :3].sum(axis=2, dtype=np.uint32)
+    else:
+        sample = sample[..., 0].astype(np.uint32)
+    return sample.reshape((rows, SAMPLES_PER_CELL, columns, SAMPLES_PER_CELL)).sum(axis=(1, 3))
+
+
+def dhash(image, hash_size: int = 8, grid=None):
+    # hash_size * hash_size bits, set where a cell is brighter than its right neighbour
+    tiny = tiny_image(image, hash_size, hash_size + 1, grid)
+    return np.packbits(tiny[:, 1:] < tiny[:, :-1])
+
+
+def ahash(image, hash_size: int = 8, grid=None):
+    # hash_size * hash_size bits, set where a cell is brighter than the mean
+    tiny = tiny_image(image, hash_size, hash_size, grid)
+    return np.packbits(tiny * tiny.size > tiny.sum())
+
+
+def hamming_distances(hashes, image_hash):
+    # Number of differing bits between every row of hashes and the given hash
+    return np.unpackbits(np.bitwise_xor(hashes, image_hash), axis=-1).sum(axis=-1)
+
+
+class DuplicateFilter:
+    """
+    Keeps the hashes of the last `history` accepted images per DeviceID and rejects images that
+    are within `max_distance` bits of any of them.
+
+    Only accepted images are added to the index, so a slowly changing scene is accepted again
+    once it differs enough from every recent sample. The index of the `max_devices` most recently
+    seen devices is kept.
+    """
+
+    def __init__(self, method: str = DHASH, hash_size: int = 8, max_distance: int = 4, history: int = 32, max_devices: int = 64):
+        if method not in METHODS:
+            raise ValueError("Unknown hash method: " + str(method))
+        self.method = method
+        self.hash_size = hash_size
+        self.max_distance = max_distance
+        self.history = history
+        self.max_devices = max_devices
+        self._indices = OrderedDict()
+        self._grids = {}
+        self.accepted = 0
+        self.duplicates = 0
+
+    def hash(self, image):
+        height, width = image.shape[:2]
+        key = (height, width)
+        grid = self._grids.get(key)
+        if grid is None:
+            columns = self.hash_size + 1 if self.method == DHASH else self.hash_size
+            grid = _grid(height, width, self.hash_size, columns)
+            self._grids[key] = grid
+        if self.method == DHASH:
+            return dhash(image, self.hash_size, grid)
+        return ahash(image, self.hash_size, grid)
+
+    def is_duplicate(self, device_id, image):
+        # Check the image against the index of the device, and add it when it is not a duplicate
+        image_hash = self.hash(image)
+        index = self._indices.get(device_id)
+        if index is None:
+            # Ring buffer of hashes and the number of hashes in it
+            index = [np.zeros((self.history, image_hash.size), dtype=np.uint8), 0]
+            self._indices[device_id] = index
+        self._indices.move_to_end(device_id)
+
+        hashes, count = index
+        if count > 0 and hamming_distances(hashes[: min(count, self.history)], image_hash).min() <= self.max_distance:
+            self.duplicates += 1
+            return True
+
+        hashes[count % self.history] = image_hash
+        index[1] = count + 1
+        while len(self._indices) > self.max_devices:
+            self._indices.popitem(last=False)
+        self.accepted += 1
+        return False
+
+    def reset(self, device_id=None):
+        # Forget the index of one device or of all devices
+        if device_id is None:
+            self._indices.clear()
+        else:
+            self._indices.pop(device_id, None)
+
+    def metrics(self):
+        return {
+            "DedupDevices": len(self._indices),
+            "DedupAccepted": self.accepted,
+            "DedupDuplicates": self.duplicates,
+        }
@@ -0,0 +1,140 @@
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Encoding of frames and crops to JPEG or PNG on a thread pool, off the socket loop.
+#
+# The image is copied into a pooled buffer before `submit` returns, so the caller can reuse or
+# detach its own buffer right away. Downscaling and encoding both happen in the workers. Pillow
+# releases the GIL for both, so the workers run in parallel with the socket loop and with each
+# other.
+
+
+def fit_size(width: int, height: int, max_width: int = 0, max_height: int = 0):
+    # Size downscaled to fit within max_width x max_height keeping the aspect ratio, 0 is no limit
+    scale = 1.0
+    if max_width > 0:
+        scale = min(scale, max_width / width)
+    if max_height > 0:
+        scale = min(scale, max_height / height)
+    if scale >= 1.0:
+        return width, height
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+
+class EncoderService:
+    """
+    Encodes images on a bounded thread pool and returns futures of the encoded bytes.
+
+    At most `max_pending` images are queued or being encoded. When the service is full `submit`
+    returns None and the image is dropped, the socket loop is never blocked. Images larger than
+    `max_width` x `max_height` are downscaled with a box filter first, keeping the aspect ratio.
+    Pillow is only imported by the workers.
+    """
+
+    def __init__(
+        self,
+        threads: int = 2,
+        max_pending: int = 8,
+        image_format: str = "JPEG",
+        quality: int = 85,
+        max_width: int = 0,
+        max_height: int = 0,
+    ):
+        self.image_format = image_format.upper()
+        self.quality = quality
+        self.max_width = max_width
+        self.max_height = max_height
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="encoder")
+        self._lock = threading.Lock()
+        self._free_buffers = {}
+        self._free_count = 0
+        self._local = threading.local()
+        self._pending = 0
+        self.encoded = 0
+        self.dropped = 0
+        self.encoded_bytes = 0
+
+    def submit(self, image, image_format: str = None, quality: int = None):
+        """
+        Queue a packed (height, width, channels) image for encoding.
+
+        Returns a future of the encoded bytes, or None when `max_pending` images are pending.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.dropped += 1
+                return None
+            self._pending += 1
+
+        buffer = self._acquire(image.shape)
+        np.copyto(buffer, image)
+        return self._executor.submit(
+            self._encode,
+            buffer,
+            image_format or self.image_format,
+            self.quality if quality is None else quality,
+        )
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "EncoderPending": self._pending,
+                "EncoderEncoded": self.encoded,
+                "EncoderDropped": self.dropped,
+                "EncoderBytes": self.encoded_bytes,
+            }
+
+    def _encode(self, buffer, image_format: str, quality: int):
+        from PIL import Image
+
+        # Every worker reuses its own output stream
+        output = getattr(self._local, "output", None)
+        if output is None:
+            output = io.BytesIO()
+            self._local.output = output
+        output.seek(0)
+        output.truncate()
+        try:
+            height, width, channels = buffer.shape
+            output_size = fit_size(width, height, self.max_width, self.max_height)
+            with Image.fromarray(buffer[:, :, 0] if channels == 1 else buffer) as pil_image:
+                if output_size != (width, height):
+                    # Reducing by an integer factor first is much faster than a box filter alone
+                    pil_image = pil_image.resize(output_size, Image.BOX, reducing_gap=2.0)
+                if image_format in ("JPEG", "JPG"):
+                    pil_image.save(output, format="JPEG", quality=quality)
+                else:
+                    pil_image.save(output, format=image_format)
+            encoded = output.getvalue()
+        finally:
+            self._release(buffer)
+
+        with self._lock:
+            self.encoded += 1
+            self.encoded_bytes += len(encoded)
+        return encoded
+
+    def _acquire(self, shape):
+        with self._lock:
+            buffers = self._free_buffers.get(shape)
+            if buffers:
+                self._free_count -= 1
+                return buffers.pop()
+        return np.empty(shape, dtype=np.uint8)
+
+    def _release(self, buffer):
+        with self._lock:
+            self._pending -= 1
+            if self._free_count >= self.max_pending:
+                # Crops come in many shapes, start over instead of keeping buffers of every shape
+                self._free_buffers.clear()
+                self._free_count = 0
+            self._free_buffers.setdefault(buffer.shape, []).append(buffer)
+            self._free_count += 1
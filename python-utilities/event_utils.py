@@ -0,0 +1,148 @@
+import time
+
+import numpy as np
+
+# Deciding when a postprocessor emits an event, so a condition that holds for many frames does
+# not flood the VMS with one event per frame.
+#
+# The state is kept per (device, event ID) key in flat arrays, a key is mapped to its slot by a
+# dictionary. Every update is a constant number of array reads and writes, so the engine scales
+# to thousands of cameras and event types.
+
+NO_STATE = -1
+
+# Interned states are compacted to the states the keys hold once there are more than this many,
+# and more than twice the number of keys
+MIN_COMPACT_STATES = 1024
+
+
+class EventEngine:
+    """
+    Debounces events per device and event ID with hysteresis, a cooldown and change detection.
+
+    Every frame `update(device_id, event_id, detected, state)` records whether the condition of
+    the event holds. The key becomes active when the condition held in at least `hits_required`
+    of the last `window` frames, and inactive again when it held in fewer than
+    `window - hits_required + 1` of them. `update` returns True when an event should be emitted:
+
+    - when the `state` of the key changes, such as the recognized prompt or a description of
+      the frame,
+    - when the key becomes active again with the same state, once `cooldown_seconds` have
+      passed since the last event of the key,
+    - and otherwise, unless `change_only` is set, while it stays active and `cooldown_seconds`
+      have passed since the last event of the key.
+
+    Only frames in which the condition holds emit events and change the state. The state and the
+    time of the last event are kept while the key is inactive, so a condition that drops out for
+    a frame does not emit the same event again within the cooldown.
+    """
+
+    def __init__(self, cooldown_seconds: float = 0.0, hits_required: int = 1, window: int = 1, change_only: bool = False, initial_keys: int = 64):
+        if not 1 <= hits_required <= window <= 64:
+            raise ValueError("Requires 1 <= hits_required <= window <= 64")
+        self.cooldown_seconds = cooldown_seconds
+        self.hits_required = hits_required
+        self.window = window
+        self.change_only = change_only
+        self._window_mask = (1 << window) - 1
+        # (device_id, event_id) -> slot in the arrays
+        self._slots = {}
+        # Interned states, state -> code. States are free-form, such as prompt texts, so the states
+        # no key holds anymore are dropped now and then
+        self._states = {}
+        initial_keys = max(1, initial_keys)
+        self._history = np.zeros(initial_keys, dtype=np.uint64)
+        self._active = np.zeros(initial_keys, dtype=np.bool_)
+        self._state = np.full(initial_keys, NO_STATE, dtype=np.int32)
+        self._last_event = np.full(initial_keys, -np.inf, dtype=np.float64)
+        self.updates = 0
+        self.emitted = 0
+        self.suppressed = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def update(self, device_id, event_id, detected: bool, state=None, now: float = None, cooldown_seconds: float = None):
+        self.updates += 1
+        slot = self._slots.get((device_id, event_id))
+        if slot is None:
+            slot = self._add((device_id, event_id))
+
+        history = ((int(self._history[slot]) << 1) | bool(detected)) & self._window_mask
+        self._history[slot] = history
+        hits = history.bit_count()
+        was_active = bool(self._active[slot])
+        if was_active:
+            active = hits > self.window - self.hits_required
+        else:
+            active = hits >= self.hits_required
+        self._active[slot] = active
+        # A frame without the condition only counts for the hysteresis, its state is not recorded
+        if not active or not detected:
+            return False
+
+        state_code = NO_STATE if state is None else self._state_code(state)
+        changed = state_code != self._state[slot]
+        self._state[slot] = state_code
+        now = time.monotonic() if now is None else now
+        cooldown = self.cooldown_seconds if cooldown_seconds is None else cooldown_seconds
+        cooled_down = now - self._last_event[slot] >= cooldown
+        if changed or (cooled_down and (not was_active or not self.change_only)):
+            self._last_event[slot] = now
+            self.emitted += 1
+            return True
+        self.suppressed += 1
+        return False
+
+    def is_active(self, device_id, event_id):
+        slot = self._slots.get((device_id, event_id))
+        return slot is not None and bool(self._active[slot])
+
+    def reset(self, device_id, event_id):
+        # Forget the history of the key, the next detection is a new event
+        slot = self._slots.get((device_id, event_id))
+        if slot is not None:
+            self._history[slot] = 0
+            self._active[slot] = False
+            self._state[slot] = NO_STATE
+            self._last_event[slot] = -np.inf
+
+    def metrics(self):
+        return {
+            "EventKeys": len(self._slots),
+            "EventActive": int(np.count_nonzero(self._active[: len(self._slots)])),
+            "EventStates": len(self._states),
+            "EventUpdates": self.updates,
+            "EventEmitted": self.emitted,
+            "EventSuppressed": self.suppressed,
+        }
+
+    def _state_code(self, state):
+        code = self._states.get(state)
+        if code is None:
+            if len(self._states) >= max(MIN_COMPACT_STATES, 2 * len(self._slots)):
+                self._compact_states()
+            code = len(self._states)
+            self._states[state] = code
+        return code
+
+    def _compact_states(self):
+        # Keep the states the keys hold and renumber them, at most one state per key remains
+        codes = self._state[: len(self._slots)]
+        held = codes != NO_STATE
+        used = np.unique(codes[held])
+        remap = np.full(len(self._states), NO_STATE, dtype=np.int32)
+        remap[used] = np.arange(len(used), dtype=np.int32)
+        codes[held] = remap[codes[held]]
+        self._states = {state: int(remap[code]) for state, code in self._states.items() if remap[code] != NO_STATE}
+
+    def _add(self, key):
+        slot = len(self._slots)
+        if slot == len(self._history):
+            # Double the arrays, new slots start inactive without history
+            self._history = np.concatenate([self._history, np.zeros(slot, dtype=np.uint64)])
+            self._active = np.concatenate([self._active, np.zeros(slot, dtype=np.bool_)])
+            self._state = np.concatenate([self._state, np.full(slot, NO_STATE, dtype=np.int32)])
+            self._last_event = np.concatenate([self._last_event, np.full(slot, -np.inf)])
+        self._slots[key] = slot
+        return slot
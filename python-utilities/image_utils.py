@@ -0,0 +1,150 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Image kernels operating on packed (height, width, channels) uint8 images.
+#
+# Every kernel returns a strided view on its input when no output is given, so kernels can be
+# chained without copying pixels. When `out` is given, the result is copied into it once. The
+# output is typically a view on the output SHM segment, see `shm_utils.as_array`.
+#
+# For large frames the final copy can be split in row tiles processed on a thread pool with
+# TiledExecutor. NumPy releases the GIL while copying, so the tiles run in parallel.
+
+# Cache size used to size the tiles when it can not be read from the system
+DEFAULT_CACHE_BYTES = 1024 * 1024
+
+
+def image_view(buffer, width: int, height: int, channels: int):
+    # Zero-copy view of a packed image, the buffer may be larger than the image itself
+    return np.frombuffer(buffer, dtype=np.uint8, count=width * height * channels).reshape((height, width, channels))
+
+
+def output_view(buffer, shape):
+    # Writable view of the first bytes of a buffer, shaped to receive an image
+    return np.frombuffer(buffer, dtype=np.uint8, count=int(np.prod(shape))).reshape(shape)
+
+
+# Rows copied per block when transposing, keeps both source and destination blocks in cache
+TRANSPOSE_BLOCK_ROWS = 64
+
+
+def _store(result, out):
+    if out is None:
+        return result
+    if result.ndim == 3 and result.strides[1] != result.shape[2] * result.itemsize:
+        # Pixels are not adjacent, copying one channel plane at a time is several times faster
+        for channel in range(result.shape[2]):
+            np.copyto(out[:, :, channel], result[:, :, channel])
+    else:
+        np.copyto(out, result)
+    return out
+
+
+def flip(image, out=None):
+    # Flip upside down
+    return _store(image[::-1], out)
+
+
+def mirror(image, out=None):
+    # Mirror left to right
+    return _store(image[:, ::-1], out)
+
+
+def decimate(image, factor: int = 2, out=None):
+    # Keep every factor-th pixel in both directions, the output is (height // factor, width // factor)
+    height = image.shape[0] // factor
+    width = image.shape[1] // factor
+    return _store(image[: height * factor : factor, : width * factor : factor], out)
+
+
+def crop(image, x1: int, y1: int, x2: int, y2: int, out=None):
+    # Crop to the half open box [x1, x2) x [y1, y2), clipped to the image
+    height, width = image.shape[:2]
+    x1 = min(max(int(x1), 0), width)
+    x2 = min(max(int(x2), x1), width)
+    y1 = min(max(int(y1), 0), height)
+    y2 = min(max(int(y2), y1), height)
+    return _store(image[y1:y2, x1:x2], out)
+
+
+def transpose(image, out=None):
+    # Swap rows and columns, keeping the channels together
+    if out is None:
+        return image.transpose(1, 0, 2)
+    for row in range(0, image.shape[0], TRANSPOSE_BLOCK_ROWS):
+        block = image[row : row + TRANSPOSE_BLOCK_ROWS]
+        for channel in range(image.shape[2]):
+            np.copyto(out[:, row : row + block.shape[0], channel], block[:, :, channel].T)
+    return out
+
+
+def cache_size():
+    # Size of the per core L2 cache in bytes, tiles are sized to fit in it
+    try:
+        with open("/sys/devices/system/cpu/cpu0/cache/index2/size", "r") as size_file:
+            size = size_file.read().strip()
+    except OSError:
+        return DEFAULT_CACHE_BYTES
+    multipliers = {"K": 1024, "M": 1024 * 1024}
+    try:
+        if size[-1] in multipliers:
+            return int(size[:-1]) * multipliers[size[-1]]
+        return int(size)
+    except (ValueError, IndexError):
+        return DEFAULT_CACHE_BYTES
+
+
+class TiledExecutor:
+    """
+    Splits image operations in row tiles and runs them on a thread pool.
+
+    The tile height is chosen so that the source and destination rows of a tile fit in the L2
+    cache, while leaving enough tiles to balance the work over the threads. With a single
+    thread everything runs inline on the calling thread.
+    """
+
+    def __init__(self, threads: int = 1, cache_bytes: int = None):
+        self.threads = max(1, int(threads))
+        self.cache_bytes = cache_bytes or cache_size()
+        self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="image-tile") if self.threads > 1 else None
+
+    def tile_rows(self, height: int, row_bytes: int):
+        rows = max(1, self.cache_bytes // max(1, row_bytes))
+        if self.threads > 1:
+            # At least a few tiles per thread, so a slow tile does not stall the others
+            rows = min(rows, -(-height // (self.threads * 4)))
+        return max(1, rows)
+
+    def tiles(self, height: int, row_bytes: int, alignment: int = 1):
+        rows = self.tile_rows(height, row_bytes)
+        rows = max(alignment, rows - rows % alignment)
+        return [(start, min(start + rows, height)) for start in range(0, height, rows)]
+
+    def map_rows(self, function, height: int, row_bytes: int, alignment: int = 1):
+        """
+        Call function(start, stop) for every row tile and wait for all of them to finish.
+
+        Tiles start at a multiple of `alignment` rows, for formats which process rows in pairs.
+        """
+        tiles = self.tiles(height, row_bytes, alignment)
+        if self._pool is None or len(tiles) == 1:
+            for start, stop in tiles:
+                function(start, stop)
+            return
+        # Consume the results so exceptions raised in a tile are passed on to the caller
+        for _ in self._pool.map(lambda tile: function(*tile), tiles):
+            pass
+
+    def store(self, result, out):
+        # Tiled version of the `out` argument of the kernels, for example
+        # executor.store(decimate(mirror(image), 2), output_image)
+        def store_tile(start, stop):
+            _store(result[start:stop], out[start:stop])
+
+        self.map_rows(store_tile, out.shape[0], out[0].nbytes + result[0].nbytes)
+        return out
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
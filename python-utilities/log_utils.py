@@ -0,0 +1,86 @@
+import logging
+from pprint import pformat
+
+# Logging in the frame loop of a processor.
+#
+# Formatting a whole frame with pformat costs more than handling most frames, so it must not
+# happen when the log level is disabled, and at DEBUG level it is often enough to see a few
+# frames. The messages are formatted lazily: the logging module only turns the arguments into
+# text when the record is actually written.
+
+logger = logging.getLogger(__name__)
+
+# Dump one in every `dump_every` frames, set from the [common] section of the configuration file
+dump_every = 1
+
+# Buffers longer than this are summarized in a dump instead of written out
+MAX_BUFFER_LENGTH = 64
+
+
+def set_dump_every(every: int):
+    global dump_every
+    dump_every = max(1, int(every))
+
+
+class Lazy:
+    """
+    Calls `function(*args)` only when the log record is written, and logs the result as text.
+
+        logger.debug("Queue: %s", log_utils.Lazy(queue.metrics))
+    """
+
+    __slots__ = ("function", "args")
+
+    def __init__(self, function, *args):
+        self.function = function
+        self.args = args
+
+    def __str__(self):
+        return str(self.function(*self.args))
+
+
+def summarize(value):
+    # A copy of the value in which long buffers, such as raw tensors and images, are replaced by their size
+    if isinstance(value, dict):
+        return {key: summarize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(summarize(item) for item in value)
+    if isinstance(value, (bytes, bytearray, memoryview)) and len(value) > MAX_BUFFER_LENGTH:
+        return "<" + str(len(value)) + " bytes>"
+    if hasattr(value, "shape") and hasattr(value, "dtype") and getattr(value, "size", 0) > MAX_BUFFER_LENGTH:
+        return "<" + str(value.dtype) + " array of shape " + str(tuple(value.shape)) + ">"
+    return value
+
+
+def pretty(value):
+    # Lazily pformat the value, with long buffers summarized
+    return Lazy(lambda: pformat(summarize(value)))
+
+
+class FrameLogger:
+    """
+    Logs dumps of whole objects from the frame loop, such as the input and output of a frame.
+
+    A dump costs one level check when `level` is disabled. When it is enabled, one in every
+    `every` dumps of the same message is written, by default `dump_every` from the configuration,
+    so the input and output dumps of a processor are written for the same frames.
+
+        frame_logger = log_utils.FrameLogger(logger)
+        frame_logger.dump("Unpacked", input_object)
+    """
+
+    def __init__(self, frame_logger: logging.Logger, level: int = logging.DEBUG, every: int = None):
+        self.logger = frame_logger
+        self.level = level
+        self.every = every
+        self._counts = {}
+
+    def dump(self, message: str, value):
+        if not self.logger.isEnabledFor(self.level):
+            return False
+        count = self._counts.get(message, 0)
+        self._counts[message] = count + 1
+        if count % (self.every or dump_every) != 0:
+            return False
+        self.logger.log(self.level, "%s:\n\n%s\n\n", message, pretty(value))
+        return True
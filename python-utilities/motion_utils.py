@@ -0,0 +1,119 @@
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+# Scene change detection to skip expensive work on frames that show the same scene.
+#
+# Every frame is reduced to a small grayscale thumbnail by sampling a fixed grid of pixels, which
+# only touches a few thousand bytes of the image. The thumbnail is compared with the reference
+# thumbnail of the device, the last frame for which the gate was opened. Comparing with the
+# reference instead of the previous frame makes slow changes, like a drifting shadow, add up
+# until they open the gate.
+
+SceneChange = namedtuple("SceneChange", ["changed", "score", "reason"])
+
+# Reasons for opening the gate
+FIRST_FRAME = "first"
+CHANGED = "changed"
+EXPIRED = "expired"
+UNCHANGED = "unchanged"
+
+
+class SceneChangeGate:
+    """
+    Decides per DeviceID whether a frame differs enough from the last processed frame.
+
+    The score is the mean absolute difference of the thumbnails, from 0 to 255. The gate opens
+    when the score reaches `threshold`, and at least every `max_skip_seconds` when it is larger
+    than 0. The thumbnails of the `max_devices` most recently seen devices are kept.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 6.0,
+        thumbnail_width: int = 64,
+        thumbnail_height: int = 36,
+        max_skip_seconds: float = 0.0,
+        max_devices: int = 64,
+    ):
+        self.threshold = threshold
+        self.thumbnail_width = thumbnail_width
+        self.thumbnail_height = thumbnail_height
+        self.max_skip_seconds = max_skip_seconds
+        self.max_devices = max_devices
+        self._references = OrderedDict()
+        self._grids = {}
+        self.passed = 0
+        self.skipped = 0
+
+    def thumbnail(self, image):
+        # Grayscale thumbnail of a packed (height, width, channels) image
+        height, width, channels = image.shape
+        rows, columns = self._grid(height, width)
+        sample = image[rows, columns]
+        if channels >= 3:
+            return sample[..., :3].mean(axis=2, dtype=np.float32)
+        return sample[..., 0].astype(np.float32)
+
+    def score(self, device_id, thumbnail):
+        # Difference with the reference of the device, None when there is no reference yet
+        reference = self._references.get(device_id)
+        if reference is None or reference[0].shape != thumbnail.shape:
+            return None
+        return float(np.abs(thumbnail - reference[0]).mean())
+
+    def check(self, device_id, image, now: float = None):
+        """
+        Returns a SceneChange for the image of the given device.
+
+        When the gate opens the image becomes the new reference of the device, the caller is
+        expected to do its work on this frame.
+        """
+        if now is None:
+            now = time.monotonic()
+        thumbnail = self.thumbnail(image)
+        score = self.score(device_id, thumbnail)
+
+        if score is None:
+            reason = FIRST_FRAME
+        elif score >= self.threshold:
+            reason = CHANGED
+        elif self.max_skip_seconds > 0 and now - self._references[device_id][1] >= self.max_skip_seconds:
+            reason = EXPIRED
+        else:
+            self._references.move_to_end(device_id)
+            self.skipped += 1
+            return SceneChange(False, score, UNCHANGED)
+
+        self._references[device_id] = (thumbnail, now)
+        self._references.move_to_end(device_id)
+        while len(self._references) > self.max_devices:
+            self._references.popitem(last=False)
+        self.passed += 1
+        return SceneChange(True, 0.0 if score is None else score, reason)
+
+    def reset(self, device_id=None):
+        # Forget the reference of one device or of all devices
+        if device_id is None:
+            self._references.clear()
+        else:
+            self._references.pop(device_id, None)
+
+    def metrics(self):
+        return {
+            "SceneDevices": len(self._references),
+            "ScenePassed": self.passed,
+            "SceneSkipped": self.skipped,
+        }
+
+    def _grid(self, height: int, width: int):
+        # Indices of the sampled pixels, at the centers of a thumbnail sized grid of blocks
+        key = (height, width)
+        grid = self._grids.get(key)
+        if grid is None:
+            rows = ((np.arange(self.thumbnail_height) + 0.5) * height / self.thumbnail_height).astype(np.intp)
+            columns = ((np.arange(self.thumbnail_width) + 0.5) * width / self.thumbnail_width).astype(np.intp)
+            grid = (rows[:, None], columns[None, :])
+            self._grids[key] = grid
+        return grid
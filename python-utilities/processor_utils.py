@@ -0,0 +1,316 @@
+import os
+import sys
+import time
+import socket
+import signal
+import logging
+import configparser
+
+import msgpack
+
+import communication_utils
+import config_utils
+import log_utils
+
+# The frame loop shared by the Python pre and postprocessors.
+#
+# A processor only implements the transformation of a single frame, a handler function that takes
+# the parsed input message and returns the output. The frame loop owns the socket, the parsing and
+# packing of the messages, the timing of the frames, reloading the configuration file when it
+# changes and the shutdown: on SIGTERM or SIGINT the frame that is being handled is finished and
+# answered before the processor stops, and the socket file is removed.
+
+logger = logging.getLogger(__name__)
+
+# The loggers the configured debug level applies to, the frame loop and the processor scripts
+_loggers = [logger]
+
+# Formats of the input message
+INFERENCE_RESULTS = "inference_results"  # Inference results, parsed by communication_utils
+MSGPACK = "msgpack"  # A plain MessagePack message, such as the image or tensor header of a preprocessor
+
+
+def read_config(config_file: str, processor_logger: logging.Logger):
+    """
+    Read the configuration file of a processor and apply its `[common] debug_level`.
+
+    Returns the parsed configuration, which is empty when the file does not exist or can not be
+    parsed, so the processor falls back to its defaults.
+    """
+    processor_logger.info("Reading configuration from:" + config_file)
+    if processor_logger not in _loggers:
+        _loggers.append(processor_logger)
+    configuration = configparser.ConfigParser()
+    if os.path.exists(config_file):
+        try:
+            configuration = config_utils.load_config(config_file)
+        except config_utils.ConfigError as e:
+            processor_logger.error(e)
+    apply_common_config(configuration, processor_logger)
+
+    processor_logger.debug("Read configuration done")
+    return configuration
+
+
+def apply_common_config(configuration, processor_logger: logging.Logger):
+    # Apply the debug level and the sampling of the frame dumps of the configuration and log its settings
+    configured_log_level = configuration.get("common", "debug_level", fallback="INFO")
+    set_log_level(configured_log_level, processor_logger)
+    try:
+        log_utils.set_dump_every(configuration.getint("common", "dump_every", fallback=1))
+    except ValueError as e:
+        processor_logger.error("Invalid dump_every: " + str(e))
+
+    for section in configuration.sections():
+        processor_logger.info("config section: " + section)
+        for key in configuration[section]:
+            processor_logger.info("config key: " + key + " = " + configuration[section][key])
+
+
+def set_log_level(level, processor_logger: logging.Logger):
+    # The level applies to the processor and to the frame loop
+    try:
+        processor_logger.setLevel(level)
+        for configured_logger in _loggers:
+            configured_logger.setLevel(level)
+    except Exception as e:
+        processor_logger.error(e, exc_info=True)
+
+
+class Processor:
+    """
+    Receives messages on a Unix socket and calls `handle` for each frame.
+
+    `handle(input_object)` gets the parsed input message, or `handle(input_object, image_header)`
+    when `image_header` is set and the AI Manager sends the image header after every message. It
+    may modify the input object in place and return None, or return the object to send back. When
+    `respond` is False nothing is sent back, for processors set to "NoResponse".
+
+    With a `config_file`, the file is watched between frames. When it changes, the new file is
+    parsed first and only applied when it is valid: the debug level is set and
+    `on_config(configuration)` is called with the new configuration, before the next frame.
+
+    A frame of which the handler raises an exception is logged and answered with the unmodified
+    input message, so one bad frame does not stop the processor. `metrics()` reports the number of
+    frames and errors and the time spent per frame, a summary is logged every
+    `stats_interval_seconds`.
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        handle,
+        message_format: str = INFERENCE_RESULTS,
+        image_header: bool = False,
+        respond: bool = True,
+        on_shutdown=(),
+        stats_interval_seconds: float = 60.0,
+        config_file: str = None,
+        on_config=None,
+    ):
+        if message_format not in (INFERENCE_RESULTS, MSGPACK):
+            raise ValueError("Unknown message format: " + str(message_format))
+        self.socket_path = socket_path
+        self.handle = handle
+        self.message_format = message_format
+        self.image_header = image_header
+        self.respond = respond
+        self.on_shutdown = list(on_shutdown)
+        self.stats_interval_seconds = stats_interval_seconds
+        self.config_file = config_file
+        self.on_config = on_config
+        self.config_reloads = 0
+        self.config_errors = 0
+        self._config_watcher = None
+        # Reused for every response, msgpack.packb creates a new packer on each call
+        self._packer = msgpack.Packer()
+        self._stopping = False
+        self._in_frame = False
+        self.frames = 0
+        self.errors = 0
+        self.frame_seconds = 0.0
+        self.max_frame_seconds = 0.0
+        self._interval_start = time.monotonic()
+        self._interval_frames = 0
+        self._interval_seconds = 0.0
+
+    def run(self):
+        # Serve frames until the processor is stopped, then run the shutdown callbacks
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signal_number, self._signal_handler)
+
+        # Remove the socket of a previous instance that did not exit cleanly
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+        logger.debug("Creating socket at " + self.socket_path)
+        server = communication_utils.startUnixSocketServer(self.socket_path)
+        if self.config_file is not None:
+            self._config_watcher = config_utils.ConfigWatcher(self.config_file)
+            logger.debug("Watching " + self.config_file + " for changes with " + self._config_watcher.method)
+
+        try:
+            while not self._stopping:
+                try:
+                    input_message, connection = communication_utils.waitForSocketMessage(server)
+                except socket.timeout:
+                    # Request timed out. Continue waiting
+                    continue
+
+                self._in_frame = True
+                try:
+                    # A changed configuration applies to the frame that was received after the change
+                    if self._config_watcher is not None and self._config_watcher.changed():
+                        self._reload_config()
+                    self._handle_frame(input_message, connection)
+                finally:
+                    self._in_frame = False
+        except SystemExit:
+            logger.info("Stopped while waiting for a message")
+        finally:
+            self._shutdown(server)
+
+    def stop(self):
+        # Stop after the current frame
+        self._stopping = True
+
+    def metrics(self):
+        return {
+            "ProcessorFrames": self.frames,
+            "ProcessorErrors": self.errors,
+            "ProcessorFrameMsMean": 1000 * self.frame_seconds / self.frames if self.frames > 0 else 0.0,
+            "ProcessorFrameMsMax": 1000 * self.max_frame_seconds,
+            "ProcessorConfigReloads": self.config_reloads,
+            "ProcessorConfigErrors": self.config_errors,
+        }
+
+    def _reload_config(self):
+        # Parse the whole file before anything is applied, an invalid file keeps the running configuration
+        try:
+            configuration = config_utils.load_config(self.config_file)
+        except config_utils.ConfigError as e:
+            self.config_errors += 1
+            logger.error(str(e) + ", keeping the current configuration")
+            return
+
+        logger.info("Configuration changed, reloading " + self.config_file)
+        self.config_reloads += 1
+        apply_common_config(configuration, logger)
+        if self.on_config is not None:
+            try:
+                self.on_config(configuration)
+            except Exception as e:
+                self.config_errors += 1
+                logger.error(e, exc_info=True)
+
+    def _handle_frame(self, input_message, connection):
+        start = time.perf_counter()
+        try:
+            if self.image_header:
+                # Since we're also expecting an image, receive the image header
+                try:
+                    image_header = msgpack.unpackb(communication_utils.receiveMessageOverConnection(connection))
+                except socket.timeout:
+                    # Did not receive image header
+                    logger.debug("Did not receive image header. Are the settings correct?")
+                    return
+                output_message = self._transform(input_message, image_header)
+            else:
+                output_message = self._transform(input_message)
+
+            if self.respond:
+                # Send message back to runtime
+                communication_utils.sendMessageOverConnection(connection, output_message)
+        finally:
+            self._record(time.perf_counter() - start)
+
+    def _transform(self, input_message, *image_header):
+        # The response to a message, the input message itself when the handler fails
+        try:
+            if self.message_format == INFERENCE_RESULTS:
+                input_object = communication_utils.parseInferenceResults(input_message)
+            else:
+                input_object = msgpack.unpackb(input_message)
+
+            output_object = self.handle(input_object, *image_header)
+            if output_object is None:
+                output_object = input_object
+            if not self.respond:
+                return None
+
+            if self.message_format == INFERENCE_RESULTS:
+                return communication_utils.writeInferenceResults(output_object)
+            return self._packer.pack(output_object)
+        except Exception as e:
+            self.errors += 1
+            logger.error("Could not process frame, returning the input unmodified: " + str(e), exc_info=True)
+            # A failed pack can leave partial data in the packer
+            self._packer.reset()
+            return input_message
+
+    def _record(self, seconds: float):
+        self.frames += 1
+        self.frame_seconds += seconds
+        if seconds > self.max_frame_seconds:
+            self.max_frame_seconds = seconds
+        self._interval_frames += 1
+        self._interval_seconds += seconds
+
+        if self.stats_interval_seconds > 0:
+            now = time.monotonic()
+            elapsed = now - self._interval_start
+            if elapsed >= self.stats_interval_seconds:
+                logger.info(
+                    "Handled %d frames in %.0f seconds, %.2f ms per frame. %s",
+                    self._interval_frames,
+                    elapsed,
+                    1000 * self._interval_seconds / self._interval_frames,
+                    self.metrics(),
+                )
+                self._interval_start = now
+                self._interval_frames = 0
+                self._interval_seconds = 0.0
+
+    def _signal_handler(self, sig, _):
+        logger.info("Received interrupt signal: " + str(sig))
+        self.stop()
+        if not self._in_frame:
+            # Waiting for a message, stop right away
+            raise SystemExit(0)
+
+    def _shutdown(self, server):
+        logger.info("Shutting down. " + str(self.metrics()))
+        if self._config_watcher is not None:
+            self._config_watcher.close()
+        for callback in self.on_shutdown:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(e, exc_info=True)
+        try:
+            server.close()
+        except Exception:
+            pass
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            if os.path.exists(self.socket_path):
+                logger.error("Could not remove socket file: " + self.socket_path)
+
+
+def run_processor(default_socket_path: str, handle, **options):
+    """
+    Run a processor on the socket given as the first argument of the process, or on
+    `default_socket_path` when it is started without arguments.
+
+    The options are passed to Processor. Returns the processor after it stopped.
+    """
+    # The socket path is always given as the first argument when the process is started
+    socket_path = sys.argv[1] if len(sys.argv) > 1 else default_socket_path
+    processor = Processor(socket_path, handle, **options)
+    try:
+        processor.run()
+    except Exception as e:
+        logger.error(e, exc_info=True)
+    return processor
@@ -0,0 +1,163 @@
+import operator
+from collections import OrderedDict
+
+import numpy as np
+
+# Text prompts of CLIP models, set by the user in the `externalprocessor.prompt*` settings.
+#
+# The prompts only change when a user edits the settings, but the settings arrive with every frame.
+# PromptTokenCache keeps the token tensors of recent prompt sets, so the tokenizer only runs when
+# the prompts change. PlanCache does the same for the postprocessor: the settings are compiled
+# once into a PromptPlan, which picks the top prompt from the scores of a frame.
+
+PROMPT_PREFIX = "externalprocessor.prompt"
+COOLDOWN_SETTING = "externalprocessor.eventCooldown"
+
+
+def prompts_from_settings(external_settings: dict, count: int = 5):
+    # The prompts ordered by setting name, padded with empty prompts or cut off to `count` prompts
+    prompts = [external_settings[name] for name in sorted(external_settings) if name.startswith(PROMPT_PREFIX)]
+    return (prompts + [""] * count)[:count]
+
+
+class PromptTokenCache:
+    """
+    Int32 token tensors of prompt sets, as the bytes of a (prompts, context_length) array.
+
+    The tensors of the last `max_entries` prompt sets are kept, so switching between a few prompt
+    sets does not tokenize either. `tokens_for_settings` also skips extracting the prompts while
+    the settings are the same as in the previous call.
+    """
+
+    def __init__(self, tokenizer, context_length: int = 77, count: int = 5, max_entries: int = 8):
+        self.tokenizer = tokenizer
+        self.context_length = context_length
+        self.count = count
+        self.max_entries = max_entries
+        self._tokens = OrderedDict()
+        self._last_settings = None
+        self._last_tokens = None
+        self.hits = 0
+        self.misses = 0
+
+    def tokens(self, prompts):
+        key = tuple(prompts)
+        tokens = self._tokens.get(key)
+        if tokens is None:
+            self.misses += 1
+            tokens = np.asarray(self.tokenizer.tokenize_batch(list(key), context_length=self.context_length), dtype=np.int32).tobytes()
+            self._tokens[key] = tokens
+            while len(self._tokens) > self.max_entries:
+                self._tokens.popitem(last=False)
+        else:
+            self.hits += 1
+            self._tokens.move_to_end(key)
+        return tokens
+
+    def tokens_for_settings(self, external_settings: dict):
+        settings = tuple(external_settings.items())
+        if settings == self._last_settings:
+            self.hits += 1
+            return self._last_tokens
+        self._last_tokens = self.tokens(prompts_from_settings(external_settings, self.count))
+        self._last_settings = settings
+        return self._last_tokens
+
+    def metrics(self):
+        lookups = self.hits + self.misses
+        return {
+            "PromptCacheEntries": len(self._tokens),
+            "PromptCacheHits": self.hits,
+            "PromptCacheMisses": self.misses,
+            "PromptCacheHitRate": self.hits / lookups if lookups > 0 else 0.0,
+        }
+
+
+class PromptPlan:
+    """
+    The prompts and event cooldown of one settings snapshot, compiled for the frame loop.
+
+    The scores of the CLIP model are named after the prompt settings without the
+    `externalprocessor.` prefix, such as `prompt1`. `top_prompt` gathers the prompt scores with an
+    itemgetter, which is only rebuilt when the score names change. For the handful of prompts of
+    a CLIP model this is faster than gathering them into a NumPy array.
+    """
+
+    def __init__(self, external_settings: dict):
+        names = sorted(name for name in external_settings if name.startswith(PROMPT_PREFIX))
+        self.prompts = {name.replace("externalprocessor.", ""): external_settings[name] for name in names}
+        self.event_cooldown = 0.0
+        try:
+            self.event_cooldown = float(external_settings.get(COOLDOWN_SETTING, 0))
+        except (TypeError, ValueError):
+            pass
+        self._score_names = None
+        self._getter = None
+        self._texts = None
+
+    def top_prompt(self, scores: dict):
+        # The text and score of the prompt with the highest score, "" when no score is above 0, or None without prompt scores
+        score_names = tuple(scores)
+        if score_names != self._score_names:
+            names = [name for name in score_names if name in self.prompts]
+            self._getter = operator.itemgetter(*names) if names else None
+            self._texts = [self.prompts[name] for name in names]
+            self._score_names = score_names
+        if self._getter is None:
+            return None
+        values = self._getter(scores)
+        if len(self._texts) == 1:
+            values = (values,)
+        # The first of equal scores wins, in the order of the scores
+        best = max(range(len(self._texts)), key=values.__getitem__)
+        if values[best] <= 0.0:
+            return "", 0.0
+        return self._texts[best], values[best]
+
+
+class PlanCache:
+    """
+    Compiled PromptPlans by settings snapshot, shared by the devices with the same settings.
+
+    While the settings of a device are the same as in its previous frame, its plan is returned
+    without hashing the settings. The plans of the last `max_plans` snapshots are kept.
+    """
+
+    def __init__(self, max_plans: int = 64):
+        self.max_plans = max_plans
+        self._plans = OrderedDict()
+        self._devices = {}
+        self.hits = 0
+        self.compiled = 0
+
+    def plan(self, device_id, external_settings: dict):
+        settings = tuple(external_settings.items())
+        last = self._devices.get(device_id)
+        if last is not None and last[0] == settings:
+            self.hits += 1
+            return last[1]
+        key = settings
+        try:
+            hash(key)
+        except TypeError:
+            # A setting value that can not be hashed, such as a list
+            key = repr(settings)
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = PromptPlan(external_settings)
+            self.compiled += 1
+            self._plans[key] = plan
+            while len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+        else:
+            self.hits += 1
+            self._plans.move_to_end(key)
+        self._devices[device_id] = (settings, plan)
+        return plan
+
+    def metrics(self):
+        return {
+            "PlanCachePlans": len(self._plans),
+            "PlanCacheHits": self.hits,
+            "PlanCacheCompiled": self.compiled,
+        }
@@ -0,0 +1,274 @@
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+# Resizing of packed (height, width, channels) uint8 images to an arbitrary size.
+#
+# The resize is separable: the rows are resized first, then the columns. The index and weight
+# tables of both passes only depend on the source and target size, so they are computed once
+# per resolution and cached across frames.
+
+NEAREST = "nearest"
+BILINEAR = "bilinear"
+AREA = "area"
+MODES = (NEAREST, BILINEAR, AREA)
+
+
+class ResizeGeometry(namedtuple("ResizeGeometry", ["source_width", "source_height", "scale_x", "scale_y", "offset_x", "offset_y", "width", "height"])):
+    """
+    Placement of the resized image within the target image.
+
+    The resized image of `width` x `height` pixels starts at (`offset_x`, `offset_y`), the rest
+    of the target image is padding. Postprocessors use this to map boxes back to the source.
+    """
+
+    def to_source(self, boxes_xyxy):
+        # Map a flat or (N, 4) array of target coordinates back to source image coordinates
+        boxes = np.array(boxes_xyxy, dtype=np.float32).reshape(-1, 4)
+        boxes[:, 0::2] = np.clip((boxes[:, 0::2] - self.offset_x) / self.scale_x, 0, self.source_width)
+        boxes[:, 1::2] = np.clip((boxes[:, 1::2] - self.offset_y) / self.scale_y, 0, self.source_height)
+        return boxes
+
+    def to_target(self, boxes_xyxy):
+        # Map a flat or (N, 4) array of source coordinates to target image coordinates
+        boxes = np.array(boxes_xyxy, dtype=np.float32).reshape(-1, 4)
+        boxes[:, 0::2] = boxes[:, 0::2] * self.scale_x + self.offset_x
+        boxes[:, 1::2] = boxes[:, 1::2] * self.scale_y + self.offset_y
+        return boxes
+
+    def to_header(self):
+        # The fields a preprocessor adds to the image header it returns, read back with geometry_from_header
+        return {
+            "ResizeSourceSize": [self.source_width, self.source_height],
+            "ResizeScale": [self.scale_x, self.scale_y],
+            "ResizeOffset": [self.offset_x, self.offset_y],
+        }
+
+
+def geometry_from_header(header: dict):
+    # The ResizeGeometry in the fields of an image header, None when the image was not resized
+    if "ResizeScale" not in header or "ResizeOffset" not in header or "ResizeSourceSize" not in header:
+        return None
+    source_width, source_height = header["ResizeSourceSize"]
+    scale_x, scale_y = header["ResizeScale"]
+    offset_x, offset_y = header["ResizeOffset"]
+    return ResizeGeometry(
+        source_width,
+        source_height,
+        scale_x,
+        scale_y,
+        offset_x,
+        offset_y,
+        int(round(source_width * scale_x)),
+        int(round(source_height * scale_y)),
+    )
+
+
+def resize_geometry(source_width: int, source_height: int, width: int, height: int, letterbox: bool = False):
+    # Pure function of the sizes, so a postprocessor can compute the same geometry from the image header
+    if not letterbox:
+        return ResizeGeometry(source_width, source_height, width / source_width, height / source_height, 0, 0, width, height)
+    scale = min(width / source_width, height / source_height)
+    content_width = max(1, min(width, int(round(source_width * scale))))
+    content_height = max(1, min(height, int(round(source_height * scale))))
+    offset_x = (width - content_width) // 2
+    offset_y = (height - content_height) // 2
+    return ResizeGeometry(
+        source_width,
+        source_height,
+        content_width / source_width,
+        content_height / source_height,
+        offset_x,
+        offset_y,
+        content_width,
+        content_height,
+    )
+
+
+def _nearest_table(source: int, target: int):
+    centers = (np.arange(target, dtype=np.float64) + 0.5) * (source / target)
+    return (np.minimum(centers.astype(np.intp), source - 1),)
+
+
+def _bilinear_table(source: int, target: int):
+    # Half pixel centers, the same convention as OpenCV and PIL
+    positions = (np.arange(target, dtype=np.float64) + 0.5) * (source / target) - 0.5
+    positions = np.clip(positions, 0, source - 1)
+    lower = positions.astype(np.intp)
+    upper = np.minimum(lower + 1, source - 1)
+    weight = (positions - lower).astype(np.float32)
+    return lower, upper, weight
+
+
+def _area_table(source: int, target: int):
+    # Every target pixel averages the source interval [edges[i], edges[i + 1]). The whole pixels
+    # overlapping the interval are summed first, the parts of the first and last pixel that fall
+    # outside of the interval are subtracted again afterwards.
+    edges = np.arange(target + 1, dtype=np.float64) * (source / target)
+    first = np.floor(edges[:-1]).astype(np.intp)
+    end = np.minimum(np.ceil(edges[1:]).astype(np.intp), source)
+    # Even entries give the sums over [first, end), the last end equals source and is implied
+    segments = np.empty(target * 2, dtype=np.intp)
+    segments[0::2] = first
+    segments[1::2] = end
+    segments = segments[:-1]
+    first_excess = (edges[:-1] - first).astype(np.float32)
+    last_excess = (end - edges[1:]).astype(np.float32)
+    return segments, first, end - 1, first_excess, last_excess, np.float32(target / source)
+
+
+def _broadcast(weights, axis: int):
+    # Shape a per index weight vector so it broadcasts along the given image axis
+    return weights.reshape((-1, 1, 1) if axis == 0 else (1, -1, 1))
+
+
+def _nearest_pass(image, table, axis: int):
+    return np.take(image, table[0], axis=axis)
+
+
+def _bilinear_pass(image, table, axis: int):
+    lower, upper, weight = table
+    lower_values = np.take(image, lower, axis=axis).astype(np.float32)
+    upper_values = np.take(image, upper, axis=axis).astype(np.float32)
+    upper_values -= lower_values
+    upper_values *= _broadcast(weight, axis)
+    lower_values += upper_values
+    return lower_values
+
+
+def _area_pass(image, table, axis: int):
+    segments, first, last, first_excess, last_excess, normalization = table
+    if axis == 0:
+        # Summing whole rows is contiguous, which is much faster than reduceat along the first axis
+        sums = np.empty((len(first),) + image.shape[1:], dtype=np.float32)
+        for index, (start, stop) in enumerate(zip(first, last + 1)):
+            np.add.reduce(image[start:stop], axis=0, dtype=np.float32, out=sums[index])
+    else:
+        sums = np.add.reduceat(image, segments, axis=axis, dtype=np.float32)
+        sums = np.take(sums, np.arange(0, sums.shape[axis], 2), axis=axis)
+    sums -= np.take(image, first, axis=axis) * _broadcast(first_excess, axis)
+    sums -= np.take(image, last, axis=axis) * _broadcast(last_excess, axis)
+    sums *= normalization
+    return sums
+
+
+_PASSES = {
+    NEAREST: _nearest_pass,
+    BILINEAR: _bilinear_pass,
+    AREA: _area_pass,
+}
+
+
+def _slice_table(mode: str, table, start: int, stop: int):
+    # Table for the target rows [start, stop) only, used to resize a tile of rows
+    if mode == AREA:
+        _, first, last, first_excess, last_excess, normalization = table
+        return None, first[start:stop], last[start:stop], first_excess[start:stop], last_excess[start:stop], normalization
+    return tuple(entry[start:stop] for entry in table)
+
+
+class Resizer:
+    """
+    Resizes images with the nearest, bilinear or area interpolation mode.
+
+    With `letterbox` enabled the aspect ratio is preserved and the remaining target area is
+    filled with `pad_value`. The tables for the last `cache_size` resolutions are kept.
+    """
+
+    def __init__(self, mode: str = BILINEAR, letterbox: bool = False, pad_value: int = 0, cache_size: int = 8):
+        if mode not in MODES:
+            raise ValueError("Unknown interpolation mode: " + str(mode))
+        self.mode = mode
+        self.letterbox = letterbox
+        self.pad_value = pad_value
+        self.cache_size = cache_size
+        self._tables = OrderedDict()
+
+    def geometry(self, source_width: int, source_height: int, width: int, height: int):
+        return resize_geometry(source_width, source_height, width, height, self.letterbox)
+
+    def resize(self, image, width: int, height: int, out=None, executor=None):
+        """
+        Resize the image to width x height, returns the resized image and its ResizeGeometry.
+
+        When `out` is given the result is written into it, for example a view on the output SHM.
+        With an `image_utils.TiledExecutor` the output rows are resized in parallel tiles.
+        """
+        source_height, source_width, channels = image.shape
+        geometry = self.geometry(source_width, source_height, width, height)
+        if out is None:
+            out = np.empty((height, width, channels), dtype=np.uint8)
+
+        content = out[geometry.offset_y : geometry.offset_y + geometry.height, geometry.offset_x : geometry.offset_x + geometry.width]
+        # Look up the tables before splitting in tiles, the table cache is not thread safe
+        row_pass = self._pass(source_height, geometry.height)
+        column_pass = self._pass(source_width, geometry.width)
+
+        def resize_tile(start: int, stop: int):
+            self._resize_rows(image, row_pass, column_pass, content[start:stop], start, stop)
+
+        if executor is None:
+            resize_tile(0, geometry.height)
+        else:
+            # Every output row reads about source_height / height input rows
+            row_bytes = content[0].nbytes + image[0].nbytes * max(1, source_height // geometry.height)
+            executor.map_rows(resize_tile, geometry.height, row_bytes)
+
+        if geometry.width != width or geometry.height != height:
+            self._pad(out, geometry)
+        return out, geometry
+
+    def _resize_rows(self, image, row_pass, column_pass, content, start: int, stop: int):
+        # Resize the output rows [start, stop) into content
+        if row_pass is None:
+            resized = image[start:stop]
+        else:
+            mode, table = row_pass
+            resized = _PASSES[mode](image, _slice_table(mode, table, start, stop), 0)
+        if column_pass is not None:
+            mode, table = column_pass
+            resized = _PASSES[mode](resized, table, 1)
+
+        if resized.dtype == np.uint8:
+            np.copyto(content, resized)
+        else:
+            # Interpolated values are within [0, 255], adding 0.5 and truncating rounds them
+            resized += 0.5
+            np.copyto(content, resized, casting="unsafe")
+
+    def _pass(self, source: int, target: int):
+        # Interpolation mode and table for one axis, None when the size does not change
+        if source == target:
+            return None
+        mode = self.mode
+        if mode == AREA and target > source:
+            # Area averaging is only defined for downscaling, upscaling falls back to bilinear
+            mode = BILINEAR
+        return mode, self._table(mode, source, target)
+
+    def _table(self, mode: str, source: int, target: int):
+        key = (mode, source, target)
+        table = self._tables.get(key)
+        if table is not None:
+            self._tables.move_to_end(key)
+            return table
+        if mode == NEAREST:
+            table = _nearest_table(source, target)
+        elif mode == BILINEAR:
+            table = _bilinear_table(source, target)
+        else:
+            table = _area_table(source, target)
+        self._tables[key] = table
+        # Two tables are needed per resolution, one for each axis
+        while len(self._tables) > self.cache_size * 2:
+            self._tables.popitem(last=False)
+        return table
+
+    def _pad(self, out, geometry: ResizeGeometry):
+        # Only the borders around the resized image are written
+        bottom = geometry.offset_y + geometry.height
+        right = geometry.offset_x + geometry.width
+        out[: geometry.offset_y] = self.pad_value
+        out[bottom:] = self.pad_value
+        out[geometry.offset_y : bottom, : geometry.offset_x] = self.pad_value
+        out[geometry.offset_y : bottom, right:] = self.pad_value
@@ -0,0 +1,77 @@
+import io
+
+import numpy as np
+
+# Extraction of regions of interest, such as detected objects, from packed (height, width, channels)
+# images.
+#
+# The boxes come straight from the BBoxes_xyxy field of the inference results, a flat list of
+# x1, y1, x2, y2 coordinates per class. Crops are either zero-copy views on the image or copied
+# back to back into a single reusable buffer, so they stay valid after the SHM segment of the
+# image is detached. Encoding to PNG or JPEG happens in memory, nothing is written to disk.
+
+
+def clip_boxes(boxes_xyxy, width: int, height: int):
+    # Integer (N, 4) pixel boxes covering the given coordinates, clipped to the image
+    boxes = np.asarray(boxes_xyxy, dtype=np.float32).reshape(-1, 4)
+    pixels = np.empty(boxes.shape, dtype=np.intp)
+    np.floor(boxes[:, :2], out=pixels[:, :2], casting="unsafe")
+    np.ceil(boxes[:, 2:], out=pixels[:, 2:], casting="unsafe")
+    np.clip(pixels[:, 0::2], 0, width, out=pixels[:, 0::2])
+    np.clip(pixels[:, 1::2], 0, height, out=pixels[:, 1::2])
+    # Boxes with the corners swapped or outside of the image become empty
+    np.maximum(pixels[:, 2], pixels[:, 0], out=pixels[:, 2])
+    np.maximum(pixels[:, 3], pixels[:, 1], out=pixels[:, 3])
+    return pixels
+
+
+def crop_views(image, boxes_xyxy):
+    # Zero-copy views on the image, one per box, only valid as long as the image is
+    height, width = image.shape[:2]
+    return [image[y1:y2, x1:x2] for x1, y1, x2, y2 in clip_boxes(boxes_xyxy, width, height).tolist()]
+
+
+class ROIPacker:
+    """
+    Copies the crops of all boxes back to back into a single buffer.
+
+    The buffer grows when needed and is reused for the next frame, the returned crops are
+    contiguous arrays that stay valid until the next call to `pack`.
+    """
+
+    def __init__(self, initial_bytes: int = 0):
+        self._buffer = np.empty(initial_bytes, dtype=np.uint8)
+
+    def pack(self, image, boxes_xyxy):
+        height, width, channels = image.shape
+        boxes = clip_boxes(boxes_xyxy, width, height)
+        sizes = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]) * channels
+        offsets = np.concatenate(([0], np.cumsum(sizes)))
+        if offsets[-1] > self._buffer.size:
+            self._buffer = np.empty(int(offsets[-1]), dtype=np.uint8)
+
+        crops = []
+        for (x1, y1, x2, y2), start, stop in zip(boxes.tolist(), offsets[:-1].tolist(), offsets[1:].tolist()):
+            crop = self._buffer[start:stop].reshape((y2 - y1, x2 - x1, channels))
+            np.copyto(crop, image[y1:y2, x1:x2])
+            crops.append(crop)
+        return crops
+
+
+def encode_image(image, image_format: str = "PNG", quality: int = 90):
+    """
+    Encode a packed RGB, RGBA or grayscale image to PNG or JPEG bytes in memory.
+
+    Uses Pillow, which is only imported when an image is encoded.
+    """
+    from PIL import Image
+
+    if image.ndim == 3 and image.shape[2] == 1:
+        image = image[:, :, 0]
+    with io.BytesIO() as output:
+        with Image.fromarray(np.ascontiguousarray(image)) as pil_image:
+            if image_format.upper() in ("JPEG", "JPG"):
+                pil_image.save(output, format="JPEG", quality=quality)
+            else:
+                pil_image.save(output, format=image_format.upper())
+        return output.getvalue()
@@ -0,0 +1,111 @@
+import time
+from math import prod
+
+import numpy as np
+
+# Selecting the frames worth capturing from the detection output of a model, for example the
+# frames with detections the model is unsure about (uncertainty sampling).
+#
+# The detection output is a flat tensor of entries of `entry_size` values, such as
+# x1, y1, x2, y2, score, class. The selection runs on all entries at once with NumPy, so it costs
+# microseconds per frame, also for models with hundreds of entries.
+
+DATA_TYPES = {1: np.float32, 3: np.int8}
+
+
+def decode_outputs(parsed_response):
+    # The outputs of the message as NumPy arrays by name, without copying the data
+    outputs = {}
+    for index, (name, value) in enumerate(parsed_response["Outputs"].items()):
+        dtype = DATA_TYPES[parsed_response["OutputDataTypes"][index]]
+        shape = parsed_response["OutputShapes"][index]
+        outputs[name] = np.frombuffer(value, dtype=dtype, count=prod(shape)).reshape(shape)
+    return outputs
+
+
+class SampleSelector:
+    """
+    Selects frames with at least one entry whose score is in the band [min_score, max_score).
+
+    Entries are `entry_size` values with the score at `score_index` and the class at
+    `class_index`, -1 when the output has no class. Only the classes in `classes` count when it
+    is given, and the classes in `exclude_classes` never count. With `rate_per_second` each class
+    has a token bucket of `burst` tokens: a frame is selected for the classes that have a token
+    left, and uses one token of each of them.
+    """
+
+    def __init__(
+        self,
+        entry_size: int = 6,
+        score_index: int = 4,
+        class_index: int = 5,
+        min_score: float = 0.0,
+        max_score: float = 0.4,
+        classes=None,
+        exclude_classes=None,
+        rate_per_second: float = 0.0,
+        burst: float = 1.0,
+    ):
+        self.entry_size = entry_size
+        self.score_index = score_index
+        self.class_index = class_index
+        self.min_score = min_score
+        self.max_score = max_score
+        self.classes = None if classes is None else np.asarray(list(classes), dtype=np.int64)
+        self.exclude_classes = None if exclude_classes is None else np.asarray(list(exclude_classes), dtype=np.int64)
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        # Token buckets indexed by class, grown when a higher class shows up
+        self._tokens = np.zeros(0, dtype=np.float64)
+        self._updated = np.zeros(0, dtype=np.float64)
+        self.frames = 0
+        self.selected = 0
+        self.rate_limited = 0
+
+    def select(self, output, now: float = None):
+        # The classes the frame is selected for, an empty array when the frame is not selected
+        self.frames += 1
+        output = np.asarray(output).reshape(-1)
+        entries = output[: len(output) // self.entry_size * self.entry_size].reshape(-1, self.entry_size)
+        scores = entries[:, self.score_index]
+        mask = (scores >= self.min_score) & (scores < self.max_score)
+        if self.class_index >= 0:
+            classes = entries[:, self.class_index].astype(np.int64)
+        else:
+            classes = np.zeros(len(entries), dtype=np.int64)
+        if self.classes is not None:
+            mask &= np.isin(classes, self.classes)
+        if self.exclude_classes is not None:
+            mask &= ~np.isin(classes, self.exclude_classes)
+        candidates = np.unique(classes[mask])
+        candidates = candidates[candidates >= 0]
+
+        if self.rate_per_second > 0 and len(candidates) > 0:
+            selected = self._take_tokens(candidates, time.monotonic() if now is None else now)
+            if len(selected) == 0:
+                self.rate_limited += 1
+        else:
+            selected = candidates
+        if len(selected) > 0:
+            self.selected += 1
+        return selected
+
+    def metrics(self):
+        return {
+            "SelectorFrames": self.frames,
+            "SelectorSelected": self.selected,
+            "SelectorRateLimited": self.rate_limited,
+        }
+
+    def _take_tokens(self, classes, now: float):
+        size = int(classes[-1]) + 1
+        if size > len(self._tokens):
+            # New classes start with a full bucket
+            self._tokens = np.concatenate([self._tokens, np.full(size - len(self._tokens), float(self.burst))])
+            self._updated = np.concatenate([self._updated, np.full(size - len(self._updated), now)])
+        tokens = np.minimum(self.burst, self._tokens[classes] + (now - self._updated[classes]) * self.rate_per_second)
+        self._updated[classes] = now
+        allowed = tokens >= 1.0
+        tokens[allowed] -= 1.0
+        self._tokens[classes] = tokens
+        return classes[allowed]
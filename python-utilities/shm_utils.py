@@ -0,0 +1,182 @@
+import os
+import json
+import atexit
+import logging
+import threading
+import contextlib
+
+import numpy as np
+import sysv_ipc
+
+import communication_utils
+
+logger = logging.getLogger(__name__)
+
+
+def _process_alive(pid: int):
+    # Signal 0 only checks whether the process exists
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+@contextlib.contextmanager
+def attach(shm_key: int):
+    """
+    Attach to the segment with the given key and yield a zero-copy memoryview of its contents.
+
+    Arrays created from the view must not be used after the block ends, since the segment is
+    detached at that point.
+    """
+    shm = sysv_ipc.SharedMemory(shm_key)
+    buffer = memoryview(shm)
+    try:
+        yield buffer
+    finally:
+        try:
+            buffer.release()
+        except BufferError:
+            # An array still refers to the segment, keep it attached rather than invalidating the array
+            logger.warning("SHM with key " + str(shm_key) + " is still in use, not detaching")
+        else:
+            shm.detach()
+
+
+def as_array(shm, size: int = None):
+    # Writable uint8 view on an attached segment, writing to it writes directly to shared memory
+    if size is None:
+        size = shm.size
+    return np.frombuffer(memoryview(shm), dtype=np.uint8, count=size)
+
+
+class SHMLifecycleManager:
+    """
+    Keeps track of every shared memory segment a processor creates.
+
+    The created segments are recorded in a small registry file next to the socket of the
+    processor. All tracked segments are removed when the process exits, and on start up
+    segments left behind by a previous instance that was killed are reaped.
+    """
+
+    def __init__(self, registry_path: str):
+        self.registry_path = registry_path
+        self.segments = {}
+        self.created_total = 0
+        self.reaped_total = 0
+        self._lock = threading.Lock()
+        atexit.register(self.release_all)
+
+    def reap(self):
+        # Remove segments left behind by a previous instance which did not exit cleanly
+        try:
+            with open(self.registry_path, "r") as registry_file:
+                registry = json.load(registry_file)
+        except (OSError, ValueError):
+            return 0
+
+        previous_pid = registry.get("PID", 0)
+        if previous_pid != os.getpid() and _process_alive(previous_pid):
+            logger.warning("SHM registry " + self.registry_path + " is owned by running process " + str(previous_pid))
+            return 0
+
+        reaped = 0
+        for shm_id, size in registry.get("Segments", {}).items():
+            if self._remove_leaked(shm_id, size, previous_pid):
+                reaped += 1
+        self.reaped_total += reaped
+        if reaped > 0:
+            logger.info("Reaped " + str(reaped) + " leaked SHM segments from process " + str(previous_pid))
+
+        self._write_registry()
+        return reaped
+
+    def _remove_leaked(self, shm_id, size, owner_pid):
+        # SysV IDs are reused, so a recorded ID may now belong to a segment of another process.
+        # Only the segment with the recorded size that was created by the owner is removed.
+        try:
+            shm = sysv_ipc.attach(int(shm_id))
+        except (sysv_ipc.ExistentialError, sysv_ipc.PermissionsError, ValueError, TypeError):
+            # Segment was already removed, or can not be ours
+            return False
+        try:
+            if shm.size != size or shm.creator_pid != owner_pid:
+                logger.warning(
+                    "Not removing SHM with ID " + str(shm_id) + ", it is no longer the segment of process " + str(owner_pid)
+                    + " (size " + str(shm.size) + ", creator " + str(shm.creator_pid) + ")"
+                )
+                return False
+            shm.remove()
+            return True
+        except sysv_ipc.Error:
+            return False
+        finally:
+            try:
+                shm.detach()
+            except sysv_ipc.Error:
+                pass
+
+    def create(self, size: int):
+        shm = communication_utils.create_shm(size)
+        with self._lock:
+            self.segments[shm.id] = shm
+            self.created_total += 1
+            self._write_registry()
+        logger.debug("Created SHM with ID: " + str(shm.id) + " and size: " + str(shm.size))
+        return shm
+
+    def ensure_size(self, shm, size: int):
+        # Reuse the segment if the data fits, otherwise replace it with a larger one
+        if shm is not None and shm.size >= size:
+            return shm
+        if shm is not None:
+            self.release(shm)
+        return self.create(size)
+
+    def release(self, shm):
+        with self._lock:
+            self.segments.pop(shm.id, None)
+            self._write_registry()
+        self._destroy(shm)
+
+    def release_all(self):
+        with self._lock:
+            segments = list(self.segments.values())
+            self.segments.clear()
+            self._write_registry()
+        for shm in segments:
+            self._destroy(shm)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "SHMSegments": len(self.segments),
+                "SHMBytes": sum(shm.size for shm in self.segments.values()),
+                "SHMCreated": self.created_total,
+                "SHMReaped": self.reaped_total,
+            }
+
+    def _destroy(self, shm):
+        try:
+            shm.detach()
+        except (sysv_ipc.Error, ValueError):
+            pass
+        try:
+            shm.remove()
+        except sysv_ipc.Error:
+            pass
+
+    def _write_registry(self):
+        # Write to a temporary file first so a crash never leaves a half written registry
+        registry = {"PID": os.getpid(), "Segments": {str(shm_id): shm.size for shm_id, shm in self.segments.items()}}
+        temporary_path = self.registry_path + ".tmp"
+        try:
+            with open(temporary_path, "w") as registry_file:
+                json.dump(registry, registry_file)
+            os.replace(temporary_path, self.registry_path)
+        except OSError as e:
+            logger.error("Could not write SHM registry: " + str(e))
+
@@ -0,0 +1,237 @@
+import os
+import time
+import zlib
+import struct
+import logging
+import threading
+from collections import deque
+
+# Append-only on-disk spool of captured samples, so samples that are waiting for upload survive a
+# crash or restart of the processor.
+#
+# Samples are appended to segment files of about `segment_bytes` each. Every record is a header
+# with a magic number, the length, the capture time and a CRC32 of the data, followed by the data.
+# The index file holds the position up to which the records have been uploaded, it is replaced
+# atomically after every uploaded batch. Segments before that position are deleted. When the
+# spool grows beyond `max_bytes` the oldest segments are evicted, samples that were not uploaded
+# yet included.
+#
+# On startup the segments after the index position are scanned and their records are pending
+# again. A record that was only partly written when the processor crashed is cut off.
+
+logger = logging.getLogger(__name__)
+
+RECORD_MAGIC = 0x53504C31
+RECORD_HEADER = struct.Struct("<IIdI")
+SEGMENT_SUFFIX = ".seg"
+INDEX_FILE = "index"
+
+
+class SampleSpool:
+    """
+    Persistent FIFO of samples, with the interface of the queue of upload_utils.BackgroundUploader.
+
+    `put` appends a sample, `take` returns the next samples in order and `done` acknowledges or
+    returns them once the upload finished. Samples are only removed from disk after `done(True)`,
+    so a sample is uploaded at least once. Data is flushed to the operating system on every
+    `put`, with `fsync=True` it is also synced to the disk.
+    """
+
+    # Failed samples stay in the spool and are uploaded again
+    retries_failed = True
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024, segment_bytes: int = 4 * 1024 * 1024, fsync: bool = False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        # Pending records as (segment, offset, length, timestamp), and the records being uploaded
+        self._records = deque()
+        self._taken = []
+        self._segment_sizes = {}
+        self._file = None
+        self._segment = 0
+        self.appended = 0
+        self.evicted = 0
+        self.corrupt = 0
+        self.resumed = 0
+
+        os.makedirs(directory, exist_ok=True)
+        # Segment numbers keep increasing, also past segments that were removed
+        self._open_segment(self._recover() + 1)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._records)
+
+    def put(self, data: bytes, timestamp: float = None):
+        # Append a sample, returns the number of pending samples that were evicted to make room
+        timestamp = time.time() if timestamp is None else timestamp
+        record = RECORD_HEADER.pack(RECORD_MAGIC, len(data), timestamp, zlib.crc32(data)) + data
+        with self._lock:
+            if self._segment_sizes[self._segment] >= self.segment_bytes:
+                self._open_segment(self._segment + 1)
+            offset = self._segment_sizes[self._segment]
+            self._file.write(record)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._segment_sizes[self._segment] += len(record)
+            self._records.append((self._segment, offset, len(data), timestamp))
+            self.appended += 1
+            return self._evict()
+
+    def oldest_age(self):
+        # Seconds since the oldest pending sample was captured
+        with self._lock:
+            if len(self._records) == 0:
+                return 0.0
+            return time.time() - self._records[0][3]
+
+    def take(self, count: int):
+        # The data of the next `count` pending samples, records that fail their CRC are skipped
+        with self._lock:
+            records = [self._records.popleft() for _ in range(min(count, len(self._records)))]
+            self._taken.extend(records)
+        samples = []
+        for segment, offset, length, _ in records:
+            data = self._read(segment, offset, length)
+            if data is not None:
+                samples.append(data)
+        return samples
+
+    def done(self, succeeded: bool):
+        # Acknowledge the taken samples after a successful upload, or return them to the spool
+        with self._lock:
+            if len(self._taken) == 0:
+                return
+            if not succeeded:
+                self._records.extendleft(reversed(self._taken))
+                self._taken = []
+                return
+            segment, offset, length, _ = self._taken[-1]
+            self._taken = []
+            self._write_index(segment, offset + RECORD_HEADER.size + length)
+            for removed in [s for s in self._segment_sizes if s < segment]:
+                self._remove_segment(removed)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "SpoolPending": len(self._records),
+                "SpoolBytes": sum(self._segment_sizes.values()),
+                "SpoolSegments": len(self._segment_sizes),
+                "SpoolAppended": self.appended,
+                "SpoolEvicted": self.evicted,
+                "SpoolCorrupt": self.corrupt,
+                "SpoolResumed": self.resumed,
+            }
+
+    def _path(self, segment: int):
+        return os.path.join(self.directory, "{:016d}".format(segment) + SEGMENT_SUFFIX)
+
+    def _open_segment(self, segment: int):
+        if self._file is not None:
+            self._file.close()
+        self._segment = segment
+        self._file = open(self._path(segment), "ab")
+        self._segment_sizes[segment] = self._file.tell()
+
+    def _remove_segment(self, segment: int):
+        try:
+            os.remove(self._path(segment))
+        except FileNotFoundError:
+            pass
+        del self._segment_sizes[segment]
+
+    def _evict(self):
+        # Remove the oldest segments until the spool fits, the segment being written is kept
+        evicted = 0
+        while sum(self._segment_sizes.values()) > self.max_bytes and len(self._segment_sizes) > 1:
+            oldest = min(self._segment_sizes)
+            while len(self._records) > 0 and self._records[0][0] == oldest:
+                self._records.popleft()
+                evicted += 1
+            self._remove_segment(oldest)
+        if evicted > 0:
+            logger.warning("Spool is full, evicted " + str(evicted) + " samples")
+            self.evicted += evicted
+        return evicted
+
+    def _read(self, segment: int, offset: int, length: int):
+        try:
+            with open(self._path(segment), "rb") as file:
+                file.seek(offset)
+                header = file.read(RECORD_HEADER.size)
+                data = file.read(length)
+        except FileNotFoundError:
+            # Evicted while it was being taken
+            return None
+        if len(header) != RECORD_HEADER.size or len(data) != length or zlib.crc32(data) != RECORD_HEADER.unpack(header)[3]:
+            logger.error("Skipping corrupt sample in spool segment " + str(segment) + " at " + str(offset))
+            with self._lock:
+                self.corrupt += 1
+            return None
+        return data
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE)) as file:
+                segment, offset = file.read().split()
+                return int(segment), int(offset)
+        except (FileNotFoundError, ValueError):
+            return 0, 0
+
+    def _write_index(self, segment: int, offset: int):
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + ".tmp", "w") as file:
+            file.write(str(segment) + " " + str(offset) + "\n")
+            if self.fsync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+
+    def _recover(self):
+        # Rebuild the pending records from the segments after the index position, returns the last segment number
+        index_segment, index_offset = self._read_index()
+        segments = sorted(
+            int(name[: -len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX) and name[: -len(SEGMENT_SUFFIX)].isdigit()
+        )
+        for segment in segments:
+            if segment < index_segment:
+                os.remove(self._path(segment))
+                continue
+            pending = len(self._records)
+            size = os.path.getsize(self._path(segment))
+            offset = index_offset if segment == index_segment else 0
+            with open(self._path(segment), "rb") as file:
+                while offset + RECORD_HEADER.size <= size:
+                    file.seek(offset)
+                    magic, length, timestamp, _ = RECORD_HEADER.unpack(file.read(RECORD_HEADER.size))
+                    if magic != RECORD_MAGIC or offset + RECORD_HEADER.size + length > size:
+                        break
+                    self._records.append((segment, offset, length, timestamp))
+                    offset += RECORD_HEADER.size + length
+            if offset < size:
+                # The tail of a record that was being written when the processor stopped
+                logger.warning("Truncating spool segment " + str(segment) + " at " + str(offset))
+                os.truncate(self._path(segment), offset)
+                size = offset
+            if len(self._records) == pending:
+                # Nothing left to upload in this segment
+                os.remove(self._path(segment))
+                continue
+            self._segment_sizes[segment] = size
+        self.resumed = len(self._records)
+        if self.resumed > 0:
+            logger.info("Resuming " + str(self.resumed) + " samples from the spool")
+        return max(segments + [index_segment])
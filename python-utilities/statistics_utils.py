@@ -0,0 +1,106 @@
+from collections import namedtuple
+
+import numpy as np
+
+# Image statistics computed in a single vectorized pass over a packed (height, width, channels)
+# uint8 image, typically a view on the SHM segment of the input image.
+#
+# The image is reduced to a small grid of block sums first. Summing whole rows is contiguous and
+# fast, and the per channel sums, means, brightness and fingerprint all follow from the grid.
+# Histograms are computed on a subsampled image, since their cost scales with the pixel count.
+
+ImageStatisticsResult = namedtuple(
+    "ImageStatisticsResult",
+    ["total", "sums", "means", "brightness", "histograms", "fingerprint"],
+)
+
+# ITU-R BT.601 luma weights
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float64)
+
+
+class ImageStatistics:
+    """
+    Computes per channel sums and means, histograms, brightness and a downsampled fingerprint.
+
+    The fingerprint is a (grid_height, grid_width) array with the mean brightness of each block of
+    the image, useful to compare frames cheaply. Histograms with `histogram_bins` bins per
+    channel are computed on every `histogram_stride`-th row and column. They are the only part
+    that needs a second pass over the image, with `histogram_bins=0` the pass is skipped and
+    `histograms` is None.
+    """
+
+    def __init__(self, grid_width: int = 16, grid_height: int = 9, histogram_bins: int = 16, histogram_stride: int = 4):
+        if histogram_bins != 0 and 256 % histogram_bins != 0:
+            raise ValueError("The number of histogram bins must divide 256, got " + str(histogram_bins))
+        self.grid_width = grid_width
+        self.grid_height = grid_height
+        self.histogram_bins = histogram_bins
+        self.histogram_stride = histogram_stride
+        self._histogram_offsets = {}
+
+    def compute(self, image):
+        height, width, channels = image.shape
+        block_height = height // self.grid_height
+        block_width = width // self.grid_width
+        grid_rows = block_height * self.grid_height
+        grid_columns = block_width * self.grid_width
+
+        # Sum the rows of every block row, then the columns of every block
+        rows = image[:grid_rows].reshape((self.grid_height, block_height, width * channels))
+        row_sums = np.add.reduce(rows, axis=1, dtype=np.uint32).reshape((self.grid_height, width, channels))
+        blocks = np.add.reduce(
+            row_sums[:, :grid_columns].reshape((self.grid_height, self.grid_width, block_width, channels)),
+            axis=2,
+            dtype=np.uint64,
+        )
+
+        # Pixels outside of the grid still count for the exact sums
+        sums = blocks.sum(axis=(0, 1), dtype=np.uint64)
+        if grid_columns < width:
+            sums += row_sums[:, grid_columns:].sum(axis=(0, 1), dtype=np.uint64)
+        if grid_rows < height:
+            sums += np.add.reduce(image[grid_rows:].reshape((-1, channels)), axis=0, dtype=np.uint64)
+
+        pixel_count = max(1, height * width)
+        means = sums / pixel_count
+        block_means = blocks / max(1, block_height * block_width)
+        if channels >= 3:
+            brightness = float(means[:3] @ LUMA_WEIGHTS)
+            fingerprint = block_means[:, :, :3] @ LUMA_WEIGHTS
+        else:
+            brightness = float(means.mean())
+            fingerprint = block_means.mean(axis=2)
+
+        return ImageStatisticsResult(
+            total=int(sums.sum()),
+            sums=sums,
+            means=means,
+            brightness=brightness,
+            histograms=self.histograms(image) if self.histogram_bins > 0 else None,
+            fingerprint=fingerprint.astype(np.float32),
+        )
+
+    def histograms(self, image):
+        # (channels, histogram_bins) counts of a subsampled image, one bincount for all channels
+        channels = image.shape[2]
+        sample = image[:: self.histogram_stride, :: self.histogram_stride]
+        offsets = self._histogram_offsets.get(channels)
+        if offsets is None:
+            offsets = (np.arange(channels, dtype=np.uint16) * 256)
+            self._histogram_offsets[channels] = offsets
+        values = sample.astype(np.uint16)
+        values += offsets
+        counts = np.bincount(values.ravel(), minlength=256 * channels)
+        return counts.reshape((channels, self.histogram_bins, 256 // self.histogram_bins)).sum(axis=2)
+
+
+def add_to_output(input_object: dict, statistics: ImageStatisticsResult, prefix: str = "Image"):
+    # Add the statistics to the Counts and Scores of an inference results object
+    counts = input_object.setdefault("Counts", {})
+    scores = input_object.setdefault("Scores", {})
+    counts[prefix + "BytesCumulative"] = statistics.total
+    for channel, (channel_sum, channel_mean) in enumerate(zip(statistics.sums, statistics.means)):
+        counts[prefix + "Channel" + str(channel) + "Sum"] = int(channel_sum)
+        scores[prefix + "Channel" + str(channel) + "Mean"] = float(channel_mean)
+    scores[prefix + "Brightness"] = statistics.brightness
+    return input_object
@@ -0,0 +1,183 @@
+import struct
+import logging
+
+import msgpack
+import numpy as np
+
+import shm_utils
+
+# Changing some tensors of the tensor message of a preprocessor, without unpacking the message.
+#
+# The input segment of a tensor preprocessor holds a MessagePack map with the tensors as binary
+# values, next to their shapes and data types. A preprocessor that only replaces small tensors,
+# such as a setting or the tokens of the prompts, by values of the same size does not need to
+# decode and encode the large image tensor. TensorLayout finds the offsets of the tensors by
+# walking the few bytes of MessagePack around them, and TensorPatcher copies the input once into
+# the output segment and writes the replacements over the tensors.
+
+logger = logging.getLogger(__name__)
+
+# Size of the fixed size MessagePack types, including the type byte
+_FIXED_SIZES = {
+    0xC0: 1, 0xC2: 1, 0xC3: 1,  # nil, false, true
+    0xCA: 5, 0xCB: 9,  # float 32, 64
+    0xCC: 2, 0xCD: 3, 0xCE: 5, 0xCF: 9,  # uint 8, 16, 32, 64
+    0xD0: 2, 0xD1: 3, 0xD2: 5, 0xD3: 9,  # int 8, 16, 32, 64
+    0xD4: 3, 0xD5: 4, 0xD6: 6, 0xD7: 10, 0xD8: 18,  # fixext 1, 2, 4, 8, 16
+}
+# Size of the length field, and the number of bytes before the data, of the variable length types
+_LENGTH_FIELDS = {
+    0xC4: (">B", 0), 0xC5: (">H", 0), 0xC6: (">I", 0),  # bin 8, 16, 32
+    0xC7: (">B", 1), 0xC8: (">H", 1), 0xC9: (">I", 1),  # ext 8, 16, 32, followed by a type byte
+    0xD9: (">B", 0), 0xDA: (">H", 0), 0xDB: (">I", 0),  # str 8, 16, 32
+}
+# Size of the count field, and the number of values per entry, of arrays and maps
+_COUNT_FIELDS = {0xDC: (">H", 1), 0xDD: (">I", 1), 0xDE: (">H", 2), 0xDF: (">I", 2)}
+
+BIN_TYPES = (0xC4, 0xC5, 0xC6)
+METADATA_KEYS = ("TensorsRanks", "TensorShapes", "TensorDataTypes")
+
+
+def _header(buffer, offset: int):
+    # The offset and length of the data of the value at `offset`, and the number of values it contains
+    byte = buffer[offset]
+    if byte <= 0x7F or byte >= 0xE0:
+        return offset + 1, 0, 0
+    if byte <= 0x8F:
+        return offset + 1, 0, 2 * (byte & 0x0F)
+    if byte <= 0x9F:
+        return offset + 1, 0, byte & 0x0F
+    if byte <= 0xBF:
+        return offset + 1, byte & 0x1F, 0
+    if byte in _FIXED_SIZES:
+        return offset + 1, _FIXED_SIZES[byte] - 1, 0
+    if byte in _LENGTH_FIELDS:
+        length_format, skip = _LENGTH_FIELDS[byte]
+        length = struct.unpack_from(length_format, buffer, offset + 1)[0]
+        return offset + 1 + struct.calcsize(length_format) + skip, length, 0
+    if byte in _COUNT_FIELDS:
+        count_format, values = _COUNT_FIELDS[byte]
+        count = struct.unpack_from(count_format, buffer, offset + 1)[0]
+        return offset + 1 + struct.calcsize(count_format), 0, count * values
+    raise ValueError("Invalid MessagePack type " + hex(byte) + " at offset " + str(offset))
+
+
+def _skip(buffer, offset: int):
+    # The offset after the value at `offset`, including the values it contains
+    remaining = 1
+    while remaining > 0:
+        data_offset, length, values = _header(buffer, offset)
+        offset = data_offset + length
+        remaining += values - 1
+    return offset
+
+
+def _is_map(byte: int):
+    return 0x80 <= byte <= 0x8F or byte in (0xDE, 0xDF)
+
+
+class TensorLayout:
+    """
+    Where the tensors are in a MessagePack tensor message, read from a buffer without copying it.
+
+    `tensors` maps the tensor names to the (offset, length) of their data, or to None when a
+    tensor is not a binary value. `size` is the length of the message, a segment may be larger.
+    `key` identifies the layout: the names and sizes of the tensors, their ranks, shapes and data
+    types. Raises ValueError when the buffer does not hold a tensor message.
+    """
+
+    def __init__(self, buffer):
+        self.tensors = {}
+        self.metadata = {}
+        try:
+            self._read(buffer)
+        except (IndexError, struct.error, UnicodeDecodeError, msgpack.UnpackException) as e:
+            raise ValueError("Invalid tensor message: " + str(e)) from e
+        if not self.tensors:
+            raise ValueError("Invalid tensor message: no tensors")
+
+    @property
+    def key(self):
+        return (
+            tuple((name, None if span is None else span[1]) for name, span in self.tensors.items()),
+            tuple(self.metadata.get(key) for key in METADATA_KEYS),
+        )
+
+    def _read(self, buffer):
+        if not _is_map(buffer[0]):
+            raise ValueError("Invalid tensor message: not a map")
+        offset, _, values = _header(buffer, 0)
+        for _ in range(values // 2):
+            key_offset, key_length, _ = _header(buffer, offset)
+            key = bytes(buffer[key_offset : key_offset + key_length]).decode()
+            value_offset = key_offset + key_length
+            offset = _skip(buffer, value_offset)
+            if key == "Tensors" and _is_map(buffer[value_offset]):
+                self._read_tensors(buffer, value_offset)
+            elif key in METADATA_KEYS:
+                # Small values, decoded as tuples so the key can be compared and hashed
+                self.metadata[key] = msgpack.unpackb(buffer[value_offset:offset], use_list=False)
+        self.size = offset
+
+    def _read_tensors(self, buffer, offset: int):
+        offset, _, values = _header(buffer, offset)
+        for _ in range(values // 2):
+            name_offset, name_length, _ = _header(buffer, offset)
+            name = bytes(buffer[name_offset : name_offset + name_length]).decode()
+            offset = name_offset + name_length
+            if buffer[offset] in BIN_TYPES:
+                data_offset, length, _ = _header(buffer, offset)
+                self.tensors[name] = (data_offset, length)
+                offset = data_offset + length
+            else:
+                self.tensors[name] = None
+                offset = _skip(buffer, offset)
+
+
+class TensorPatcher:
+    """
+    Writes a tensor message to an output segment, with some of its tensors replaced.
+
+    When every replacement has the size of the tensor it replaces, the input is copied once into
+    the output segment and the replacements are written over the tensors, so the message is not
+    decoded, encoded or copied in between. Otherwise the message is unpacked, changed and packed
+    again. The layout is read from the input of every frame, so a change of the tensors or their
+    shapes is always noticed. `metrics()` counts both paths.
+    """
+
+    def __init__(self, shm_manager):
+        self.shm_manager = shm_manager
+        self.output_shm = None
+        self._layout_key = None
+        self.patched = 0
+        self.repacked = 0
+
+    def write(self, input_buffer, replacements: dict):
+        # Returns the SHM ID of the output, raises ValueError when the input is not a tensor message
+        layout = TensorLayout(input_buffer)
+        if layout.key != self._layout_key:
+            self._layout_key = layout.key
+            logger.info("Tensor layout: " + str(layout.key))
+        spans = {name: layout.tensors[name] for name in replacements if name in layout.tensors}
+        if all(span is not None and span[1] == len(replacements[name]) for name, span in spans.items()):
+            self.output_shm = self.shm_manager.ensure_size(self.output_shm, layout.size)
+            output = shm_utils.as_array(self.output_shm, layout.size)
+            np.copyto(output, np.frombuffer(input_buffer, dtype=np.uint8, count=layout.size))
+            for name, (offset, length) in spans.items():
+                output[offset : offset + length] = np.frombuffer(replacements[name], dtype=np.uint8)
+            self.patched += 1
+        else:
+            tensor_data = msgpack.unpackb(input_buffer[: layout.size])
+            for name in spans:
+                tensor_data["Tensors"][name] = replacements[name]
+            output_data = msgpack.packb(tensor_data)
+            self.output_shm = self.shm_manager.ensure_size(self.output_shm, len(output_data))
+            np.copyto(shm_utils.as_array(self.output_shm, len(output_data)), np.frombuffer(output_data, dtype=np.uint8))
+            self.repacked += 1
+        return self.output_shm.id
+
+    def metrics(self):
+        return {
+            "TensorsPatched": self.patched,
+            "TensorsRepacked": self.repacked,
+        }
@@ -0,0 +1,92 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+import colorspace_utils
+
+# The integer YUV conversions compared with a floating point BT.601 limited range reference.
+
+KR = 0.299
+KB = 0.114
+KG = 1.0 - KR - KB
+
+SIZES = [(2, 2), (16, 8), (64, 48), (1, 1), (3, 5), (17, 9), (33, 2), (2, 7)]
+
+
+def reference_rgb(luma, u, v):
+    # BT.601 limited range YUV to RGB in floating point, u and v are full resolution
+    y = (luma.astype(np.float64) - 16.0) * 255.0 / 219.0
+    d = (u.astype(np.float64) - 128.0) * 255.0 / 224.0
+    e = (v.astype(np.float64) - 128.0) * 255.0 / 224.0
+    r = y + 2.0 * (1.0 - KR) * e
+    g = y - 2.0 * (1.0 - KB) * KB / KG * d - 2.0 * (1.0 - KR) * KR / KG * e
+    b = y + 2.0 * (1.0 - KB) * d
+    return np.clip(np.round(np.stack([r, g, b], axis=-1)), 0, 255)
+
+
+def random_planes(width: int, height: int, seed: int):
+    # A Y plane and chroma planes of half the size rounded up, with every value in use
+    generator = np.random.default_rng(seed)
+    chroma_width, chroma_height = colorspace_utils.chroma_size(width, height)
+    luma = generator.integers(0, 256, (height, width), dtype=np.uint8)
+    u = generator.integers(0, 256, (chroma_height, chroma_width), dtype=np.uint8)
+    v = generator.integers(0, 256, (chroma_height, chroma_width), dtype=np.uint8)
+    return luma, u, v
+
+
+def pack(pixel_format: str, luma, u, v):
+    if pixel_format == colorspace_utils.I420:
+        return luma.tobytes() + u.tobytes() + v.tobytes()
+    first, second = (u, v) if pixel_format == colorspace_utils.NV12 else (v, u)
+    return luma.tobytes() + np.stack([first, second], axis=-1).tobytes()
+
+
+def upsample(plane, width: int, height: int):
+    return plane.repeat(2, axis=0).repeat(2, axis=1)[:height, :width]
+
+
+@pytest.mark.parametrize("pixel_format", [colorspace_utils.NV12, colorspace_utils.NV21, colorspace_utils.I420])
+@pytest.mark.parametrize("width,height", SIZES)
+def test_yuv_matches_reference(pixel_format, width, height):
+    luma, u, v = random_planes(width, height, seed=width * 1000 + height)
+    buffer = pack(pixel_format, luma, u, v)
+    assert len(buffer) == colorspace_utils.buffer_size(pixel_format, width, height)
+
+    rgb = colorspace_utils.to_rgb(buffer, width, height, pixel_format)
+    expected = reference_rgb(luma, upsample(u, width, height), upsample(v, width, height))
+
+    assert rgb.shape == (height, width, 3)
+    assert rgb.dtype == np.uint8
+    assert np.abs(rgb.astype(np.int32) - expected.astype(np.int32)).max() <= 1
+
+
+@pytest.mark.parametrize("pixel_format", [colorspace_utils.NV12, colorspace_utils.NV21, colorspace_utils.I420])
+def test_yuv_extremes_match_reference(pixel_format):
+    # Every combination of black, white and the chroma limits, where the clipping happens
+    values = np.array([0, 16, 128, 235, 255], dtype=np.uint8)
+    luma_values, u_values, v_values = np.meshgrid(values, values, values, indexing="ij")
+    count = luma_values.size
+    width, height = 2 * count, 2
+    u = u_values.reshape((1, count))
+    v = v_values.reshape((1, count))
+    luma = np.repeat(np.repeat(luma_values.reshape((1, count)), 2, axis=1), 2, axis=0)
+
+    rgb = colorspace_utils.to_rgb(pack(pixel_format, luma, u, v), width, height, pixel_format)
+    expected = reference_rgb(luma, upsample(u, width, height), upsample(v, width, height))
+
+    assert np.abs(rgb.astype(np.int32) - expected.astype(np.int32)).max() <= 1
+
+
+@pytest.mark.parametrize("width,height", [(16, 8), (17, 9)])
+def test_yuv_writes_into_out(width, height):
+    luma, u, v = random_planes(width, height, seed=7)
+    buffer = pack(colorspace_utils.NV12, luma, u, v)
+    out = np.zeros((height, width, 3), dtype=np.uint8)
+
+    result = colorspace_utils.to_rgb(buffer, width, height, colorspace_utils.NV12, out=out)
+
+    assert result is out
+    np.testing.assert_array_equal(out, colorspace_utils.to_rgb(buffer, width, height, colorspace_utils.NV12))
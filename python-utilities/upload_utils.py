@@ -0,0 +1,180 @@
+import time
+import logging
+import threading
+from collections import deque
+
+# Uploading captured samples in the background, so the socket loop never waits for the network.
+#
+# Samples are queued and a single uploader thread sends them in batches. A batch is sent when
+# `batch_size` samples are queued, or when the oldest sample has waited `max_latency_seconds`.
+# The queue is bounded: when it is full the oldest samples are dropped, recent samples are
+# usually the more interesting ones and the memory use of the processor stays bounded. To keep the
+# samples across a crash or restart, queue them in a spool_utils.SampleSpool instead.
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryQueue:
+    """
+    Bounded in-memory FIFO of samples, the default queue of BackgroundUploader.
+
+    When it is full the oldest sample is dropped. Samples of a failed upload are not returned.
+    """
+
+    retries_failed = False
+
+    def __init__(self, max_queue: int = 200):
+        self.max_queue = max_queue
+        self._samples = deque()
+
+    def __len__(self):
+        return len(self._samples)
+
+    def put(self, sample):
+        # Returns the number of samples that were dropped to make room
+        dropped = 0
+        while len(self._samples) >= self.max_queue:
+            self._samples.popleft()
+            dropped += 1
+        self._samples.append((time.monotonic(), sample))
+        return dropped
+
+    def oldest_age(self):
+        if len(self._samples) == 0:
+            return 0.0
+        return time.monotonic() - self._samples[0][0]
+
+    def take(self, count: int):
+        return [self._samples.popleft()[1] for _ in range(min(count, len(self._samples)))]
+
+    def done(self, succeeded: bool):
+        pass
+
+
+class BackgroundUploader:
+    """
+    Calls `upload(samples)` on a background thread with batches of at most `batch_size` samples.
+
+    A batch that fails to upload is logged and counted. The samples are dropped, unless the queue
+    keeps them, such as a spool_utils.SampleSpool, then they are uploaded again after
+    `retry_seconds`. `metrics()` reports the queue depth and the upload throughput.
+    """
+
+    def __init__(self, upload, batch_size: int = 20, max_latency_seconds: float = 10.0, max_queue: int = 200, queue=None, retry_seconds: float = 5.0):
+        self.upload = upload
+        self.batch_size = batch_size
+        self.max_latency_seconds = max_latency_seconds
+        self.retry_seconds = retry_seconds
+        self._queue = queue if queue is not None else MemoryQueue(max_queue)
+        self._condition = threading.Condition()
+        self._closing = False
+        self._flushing = False
+        self._uploading = 0
+        self.queued = 0
+        self.uploaded = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.upload_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name="uploader", daemon=True)
+        self._thread.start()
+
+    def submit(self, sample):
+        # Queue a sample, returns False when the oldest sample had to be dropped to make room
+        with self._condition:
+            dropped = self._queue.put(sample)
+            self.dropped += dropped
+            self.queued += 1
+            # Wakes the uploader thread for a full batch, or to time the oldest sample
+            self._condition.notify_all()
+        return dropped == 0
+
+    def configure(self, batch_size: int = None, max_latency_seconds: float = None):
+        # Change the batching while the uploader runs, the next batch uses the new values
+        with self._condition:
+            if batch_size is not None:
+                self.batch_size = batch_size
+            if max_latency_seconds is not None:
+                self.max_latency_seconds = max_latency_seconds
+            self._condition.notify_all()
+
+    def flush(self, timeout: float = None):
+        # Upload everything that is queued now, returns False when the timeout expired first
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._flushing = True
+            self._condition.notify_all()
+            while len(self._queue) > 0 or self._uploading > 0:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def close(self, timeout: float = None):
+        # Upload the queued samples and stop the uploader thread, samples left in a spool are uploaded after a restart
+        flushed = self.flush(timeout)
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        return flushed
+
+    def metrics(self):
+        with self._condition:
+            return {
+                "UploadQueueDepth": len(self._queue),
+                "UploadQueued": self.queued,
+                "UploadUploaded": self.uploaded,
+                "UploadDropped": self.dropped,
+                "UploadFailed": self.failed,
+                "UploadBatches": self.batches,
+                "UploadSamplesPerSecond": self.uploaded / self.upload_seconds if self.upload_seconds > 0 else 0.0,
+            }
+
+    def _next_batch(self):
+        # Wait for a full batch, a sample that waited too long or a flush, returns None on close
+        with self._condition:
+            while True:
+                if self._closing:
+                    return None
+                if len(self._queue) >= self.batch_size or (len(self._queue) > 0 and self._flushing):
+                    break
+                if len(self._queue) == 0:
+                    self._flushing = False
+                    self._condition.wait()
+                    continue
+                waited = self._queue.oldest_age()
+                if waited >= self.max_latency_seconds:
+                    break
+                self._condition.wait(self.max_latency_seconds - waited)
+            batch = self._queue.take(self.batch_size)
+            self._uploading += 1
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            start = time.perf_counter()
+            try:
+                if len(batch) > 0:
+                    self.upload(batch)
+                succeeded = True
+            except Exception as e:
+                logger.error("Upload of " + str(len(batch)) + " samples failed: " + str(e))
+                succeeded = False
+            with self._condition:
+                self.upload_seconds += time.perf_counter() - start
+                self.batches += 1
+                if succeeded:
+                    self.uploaded += len(batch)
+                else:
+                    self.failed += len(batch)
+                self._queue.done(succeeded)
+                self._uploading -= 1
+                self._condition.notify_all()
+                if not succeeded and self._queue.retries_failed and not self._closing:
+                    # Give the service some time before the same samples are uploaded again
+                    self._condition.wait(self.retry_seconds)